@@ -1,17 +1,82 @@
 #!/usr/bin/env python3
-from flask import Flask, jsonify, request, send_file, send_from_directory
+from flask import Flask, Response, jsonify, request
 from werkzeug.utils import secure_filename
 import os
 import mimetypes
 from datetime import datetime
 import stat
+import threading
+import json
+import hashlib
+import time
+import uuid
+from concurrent.futures import TimeoutError as FutureTimeoutError
+
+import config
+from archive import FORMATS, available_formats, stream_archive
+from batch import Change, OperationError, run_batch
+from blobstore import BlobStore, is_digest
+from checksums import ChecksumStore, available_algorithms, digest_header, hash_file, save_stream
+from delta import DeltaError, SignatureCache, apply_delta, compute_signature
+from compression import (MIN_SIZE, PrecompressedCache, compress_bytes, is_compressible,
+                         negotiate)
+from events import EventLog, InotifyWatcher
+from jobs import JobQueue, remove_tree
+from listing import DirectoryCache, iter_directory, paginate
+from previews import (MAX_TEXT_PREVIEW_BYTES, TEXT_PREVIEW_BYTES, PreviewCache, make_thumbnail,
+                      parse_line_range, preview_kind, text_head, text_lines, thumbnail_size)
+from metrics import CountingIterable, Metrics, SlowRequestProfiler, call_after_close, fs_timer
+from search_index import SearchIndex
+from shaping import BandwidthScheduler, ShapingMiddleware, parse_weights
+from uploads import UploadSessionError, UploadSessions
+from transfer import (DOWNLOAD_BACKENDS, MAX_RANGES, OFFLOAD_BACKENDS, accel_redirect,
+                      content_disposition, file_etag, if_range_matches, is_inside, parse_ranges,
+                      partial_content, range_not_satisfiable, satisfiable_ranges,
+                      send_whole_file)
 
 app = Flask(__name__)
 
-# Configurazione
-BASE_DIR = "/home/mottu/file"
+# Configurazione (file INI indicato da FILESERVER_CONFIG, vedi config.py)
+settings = config.load()
+BASE_DIR = settings['base_dir']
 UPLOAD_FOLDER = BASE_DIR
-MAX_CONTENT_LENGTH = 16 * 1024 * 1024  # 16MB max file size
+MAX_CONTENT_LENGTH = settings['max_content_length']  # Dimensione massima di una richiesta
+LISTING_CACHE_MAX_ITEMS = settings['listing_cache_max_items']  # Elementi massimi nella cache dei listing
+LISTING_MAX_PAGE_SIZE = settings['listing_max_page_size']  # Elementi massimi per pagina con ?limit=
+MAX_UPLOAD_SIZE = settings['max_upload_size']  # Dimensione massima per le sessioni di upload
+UPLOAD_CHUNK_SIZE = settings['upload_chunk_size']  # Blocchi consigliati (sotto MAX_CONTENT_LENGTH)
+JOB_WORKERS = settings['job_workers']  # Thread per le operazioni lunghe in background
+TRASH_GRACE = 3600  # Secondi prima che un elemento del cestino venga eliminato all'avvio
+DOWNLOAD_BACKEND = settings['download_backend']  # Invio dei download (vedi transfer.py)
+X_ACCEL_PREFIX = settings['x_accel_prefix']  # Location interna di nginx per X-Accel-Redirect
+INDEX_RECONCILE_INTERVAL = settings['index_reconcile_interval']  # Secondi tra le riconciliazioni
+SEARCH_MAX_RESULTS = 1000  # Risultati massimi per ricerca
+TREE_MAX_DEPTH = 8  # Livelli massimi restituiti da /tree
+TREE_MAX_CHILDREN = 1000  # Elementi massimi per directory in /tree
+EVENTS_MAX_STREAMS = settings['events_max_streams']  # Stream e long-poll /events aperti per worker
+EVENTS_POLL_INTERVAL = 0.5  # Secondi tra due letture del registro eventi
+EVENTS_PING_INTERVAL = 15  # Secondi tra due ping sugli stream inattivi
+EVENTS_MAX_WAIT = 60  # Attesa massima del long-poll su /events
+EVENTS_BUSY_RETRY = 5  # Retry-After quando stream e long-poll occupano tutti i posti
+BATCH_MAX_OPERATIONS = 1000  # Operazioni massime per richiesta /batch
+BATCH_WORKERS = 8  # Operazioni di un batch eseguite in parallelo
+COMPRESSION_CACHE_MAX_BYTES = settings['compression_cache_max_bytes']  # Varianti compresse su disco
+DEDUP = settings['dedup']  # Archivio deduplicato degli upload
+SIGNATURE_CACHE_MAX_BYTES = 256 * 1024 * 1024  # Firme dei blocchi salvate per /signature
+PREVIEW_WORKERS = settings['preview_workers']  # Thread che generano le anteprime
+PREVIEW_CACHE_MAX_BYTES = settings['preview_cache_max_bytes']  # Anteprime salvate su disco
+PREVIEW_WAIT = 10  # Secondi di attesa di un'anteprima prima di rispondere 202
+METRICS = settings['metrics']  # Metriche Prometheus su /metrics
+METRICS_SLOW_REQUEST_SECONDS = settings['metrics_slow_request_seconds']  # Soglia del profilatore (0 = spento)
+BANDWIDTH_TOTAL_RATE = settings['bandwidth_total_rate']  # Byte/s ripartiti tra i client (0 = illimitato)
+BANDWIDTH_CLIENT_RATE = settings['bandwidth_client_rate']  # Byte/s massimi per client (0 = illimitato)
+BANDWIDTH_CLIENT_HEADER = settings['bandwidth_client_header']  # Header che identifica il client
+BANDWIDTH_MIN_BYTES = 1024 * 1024  # Risposte più piccole non vengono mai rallentate
+# Directory dei dati interni del server (sessioni di upload...), nascosta ai client
+DATA_DIR_NAME = '.fileserver'
+
+if DOWNLOAD_BACKEND not in DOWNLOAD_BACKENDS:
+    raise ValueError(f"download_backend non valido: {DOWNLOAD_BACKEND}")
 
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 app.config['MAX_CONTENT_LENGTH'] = MAX_CONTENT_LENGTH
@@ -19,21 +84,291 @@ app.config['MAX_CONTENT_LENGTH'] = MAX_CONTENT_LENGTH
 # Assicurati che la directory esista
 os.makedirs(BASE_DIR, exist_ok=True)
 
+def data_path(*parts):
+    """Path all'interno della directory dei dati interni del server"""
+    return os.path.join(os.path.abspath(BASE_DIR), DATA_DIR_NAME, *parts)
+
+def is_internal_path(path):
+    """Verifica se il path appartiene ai dati interni del server"""
+    data_dir = data_path()
+    return path == data_dir or path.startswith(data_dir + os.sep)
+
+def is_allowed_path(path):
+    """Verifica che il path sia dentro BASE_DIR e fuori dai dati interni"""
+    abs_path = os.path.abspath(path)
+    base_dir = os.path.abspath(BASE_DIR)
+    if abs_path != base_dir and not abs_path.startswith(base_dir + os.sep):
+        return False
+    return not is_internal_path(abs_path)
+
+# Metriche del worker, salvate periodicamente per l'aggregazione su /metrics
+metrics = Metrics(data_path('metrics')) if METRICS else None
+slow_request_profiler = None
+if metrics is not None:
+    metrics.start_flusher()
+    if METRICS_SLOW_REQUEST_SECONDS > 0:
+        slow_request_profiler = SlowRequestProfiler(METRICS_SLOW_REQUEST_SECONDS,
+                                                    data_path('profiles'))
+
+def timed_stat(path):
+    """os.stat misurato nelle metriche del filesystem"""
+    with fs_timer(metrics, 'stat'):
+        return os.stat(path)
+
+# Cache dei metadati delle directory
+listing_cache = DirectoryCache(max_items=LISTING_CACHE_MAX_ITEMS, hidden=is_internal_path,
+                               metrics=metrics)
+
+# Sessioni di upload a blocchi
+upload_sessions = UploadSessions(data_path('uploads'))
+
+# Job in background (eliminazioni ricorsive...)
+job_queue = JobQueue(workers=JOB_WORKERS, state_dir=data_path('jobs'))
+
+def purge_trash():
+    """Elimina in background ciò che è rimasto nel cestino interno.
+    
+    Gli elementi spostati da meno di TRASH_GRACE secondi possono appartenere
+    a un /batch atomico ancora in corso in un altro worker: restano dove sono.
+    """
+    trash_dir = data_path('trash')
+    if not os.path.isdir(trash_dir):
+        return
+    now = time.time()
+    for name in os.listdir(trash_dir):
+        trash_path = os.path.join(trash_dir, name)
+        try:
+            # Lo spostamento con rename aggiorna il ctime, non l'mtime
+            moved = os.lstat(trash_path).st_ctime
+        except FileNotFoundError:
+            continue
+        if now - moved >= TRASH_GRACE:
+            job_queue.submit('delete', name, remove_tree, trash_path)
+
+purge_trash()
+
+# Contenuti deduplicati degli upload (None se disattivato)
+blob_store = BlobStore(data_path('blobs')) if DEDUP else None
+
+def collect_blobs():
+    """Libera in background i blob non più collegati a nessun file"""
+    if blob_store is not None:
+        job_queue.submit('collect', 'blobs', blob_store.collect)
+
+collect_blobs()
+
+# Digest dei file per /checksum, calcolati durante gli upload o in background
+checksum_store = ChecksumStore(data_path('checksums.db'))
+file_jobs = {}
+file_jobs_lock = threading.Lock()
+
+def submit_file_job(kind, full_path, stat_result, func):
+    """Accoda func(job, full_path), una sola volta per tipo e versione del file"""
+    key = (kind, stat_result.st_dev, stat_result.st_ino, stat_result.st_size,
+           stat_result.st_mtime_ns)
+    
+    def done(job):
+        with file_jobs_lock:
+            file_jobs.pop(key, None)
+    
+    with file_jobs_lock:
+        job = file_jobs.get(key)
+        if job is None:
+            relative_path = os.path.relpath(full_path, BASE_DIR).replace(os.sep, '/')
+            job = job_queue.submit(kind, relative_path, func, full_path, on_done=done)
+            file_jobs[key] = job
+        return job
+
+def index_tree(job, full_path):
+    """Indicizza un path con i suoi antenati e, se è una directory, tutto il contenuto"""
+    relative_path = os.path.relpath(full_path, BASE_DIR).replace(os.sep, '/')
+    if relative_path != '.':
+        search_index.update(full_path)
+    if os.path.isdir(full_path):
+        job.advance(items=search_index.reconcile('' if relative_path == '.' else relative_path))
+
+def compute_checksums(full_path, stat_result):
+    """Accoda il calcolo dei digest di un file, una sola volta per versione del file"""
+    return submit_file_job('checksum', full_path, stat_result, checksum_file)
+
+def checksum_file(job, full_path):
+    digests, stat_result = hash_file(full_path, job)
+    checksum_store.put(stat_result, digests)
+
+# Firme dei blocchi per la sincronizzazione delta (vedi delta.py)
+signature_cache = SignatureCache(data_path('signatures'), SIGNATURE_CACHE_MAX_BYTES)
+
+def signature_file(job, full_path):
+    signature, stat_result = compute_signature(full_path, job)
+    signature_cache.put(stat_result, signature)
+
+def record_checksums(file_path, digests):
+    """Salva i digest calcolati durante la scrittura di un file"""
+    try:
+        checksum_store.put(timed_stat(file_path), digests)
+    except Exception as e:
+        app.logger.warning("Salvataggio checksum fallito per %s: %s", file_path, e)
+
+# Indice dei nomi per /search, aggiornato dalle route e riconciliato in background
+search_index = SearchIndex(data_path('index.db'), BASE_DIR, hidden=is_internal_path)
+if INDEX_RECONCILE_INTERVAL > 0:
+    search_index.start_reconciler(INDEX_RECONCILE_INTERVAL, lock_path=data_path('index.lock'))
+
+# Varianti compresse dei download, riusate finché il file non cambia
+compression_cache = PrecompressedCache(data_path('compressed'), COMPRESSION_CACHE_MAX_BYTES)
+
+# Miniature e intervalli di righe per /preview, generati da un pool limitato
+preview_cache = PreviewCache(data_path('previews'), PREVIEW_CACHE_MAX_BYTES, PREVIEW_WORKERS)
+
+# Registro delle modifiche per /events; su Linux lo alimenta inotify (un solo worker)
+event_log = EventLog(data_path('events.db'), BASE_DIR)
+event_watcher = InotifyWatcher(event_log, BASE_DIR, hidden=is_internal_path,
+                               status_path=data_path('events.watcher.json'))
+event_watcher.start(lock_path=data_path('events.lock'))
+event_streams = threading.BoundedSemaphore(EVENTS_MAX_STREAMS)
+
+def bandwidth_client(environ):
+    """Chiave del client per i limiti di banda: header configurato o indirizzo IP"""
+    if BANDWIDTH_CLIENT_HEADER:
+        value = environ.get('HTTP_' + BANDWIDTH_CLIENT_HEADER.upper().replace('-', '_'))
+        if value:
+            # X-Forwarded-For: il primo indirizzo è quello del client
+            return value.split(',')[0].strip()
+    return environ.get('REMOTE_ADDR', '')
+
+def is_bulk_upload(environ):
+    """Richieste il cui corpo è un file: /upload e i blocchi delle sessioni di upload"""
+    method = environ['REQUEST_METHOD']
+    path = environ.get('PATH_INFO', '')
+    return ((method == 'POST' and (path == '/upload' or path.startswith('/delta/')))
+            or (method == 'PUT' and path.startswith('/uploads/')))
+
+# Limiti di banda e ripartizione tra i client dei trasferimenti grandi (vedi shaping.py)
+bandwidth = None
+if BANDWIDTH_TOTAL_RATE or BANDWIDTH_CLIENT_RATE:
+    bandwidth = BandwidthScheduler(BANDWIDTH_TOTAL_RATE, BANDWIDTH_CLIENT_RATE,
+                                   parse_weights(settings['bandwidth_weights']),
+                                   settings['bandwidth_interactive_reserve'])
+    bandwidth.start_publisher(data_path('bandwidth'))
+    app.wsgi_app = ShapingMiddleware(app.wsgi_app, bandwidth, bandwidth_client,
+                                     is_bulk_upload, BANDWIDTH_MIN_BYTES)
+
+def path_changed(full_path):
+    """Aggiorna indice ed eventi dopo una modifica; un errore non deve far fallire l'operazione"""
+    try:
+        search_index.update(full_path)
+        # Senza inotify gli eventi li registrano le route
+        if not event_watcher.covers(full_path):
+            event_log.append('created', full_path)
+    except Exception as e:
+        app.logger.warning("Aggiornamento indice fallito per %s: %s", full_path, e)
+
+def path_removed(full_path):
+    """Aggiorna indice ed eventi dopo un'eliminazione"""
+    try:
+        search_index.remove(full_path)
+        if not event_watcher.covers(full_path):
+            event_log.append('deleted', full_path)
+    except Exception as e:
+        app.logger.warning("Aggiornamento indice fallito per %s: %s", full_path, e)
+
 def get_file_info(filepath):
     """Ottieni informazioni dettagliate su un file o directory"""
     try:
-        stat_result = os.stat(filepath)
+        stat_result = timed_stat(filepath)
+        is_directory = stat.S_ISDIR(stat_result.st_mode)
         return {
             'name': os.path.basename(filepath),
             'path': filepath,
-            'is_directory': os.path.isdir(filepath),
-            'size': stat_result.st_size if not os.path.isdir(filepath) else 0,
+            'is_directory': is_directory,
+            'size': stat_result.st_size if not is_directory else 0,
             'modified': datetime.fromtimestamp(stat_result.st_mtime).isoformat(),
             'permissions': oct(stat_result.st_mode)[-3:]
         }
     except Exception as e:
         return None
 
+@app.before_request
+def start_request_metrics():
+    """Inizio della misura della richiesta (route, tempo, richieste in corso)"""
+    if metrics is None:
+        return
+    route = request.endpoint or 'none'
+    metrics.add('fileserver_requests_in_flight', (route,))
+    profile = None
+    # Gli stream /events restano aperti per minuti: non sono richieste lente
+    if slow_request_profiler is not None and route != 'get_events':
+        profile = slow_request_profiler.begin(route)
+    request.environ['fileserver.metrics'] = (route, time.perf_counter(), profile)
+
+# Registrata prima di compress_response, quindi eseguita dopo: misura i byte inviati davvero
+@app.after_request
+def finish_request_metrics(response):
+    """Registra la richiesta quando il client ha ricevuto la risposta"""
+    state = request.environ.pop('fileserver.metrics', None)
+    if state is None:
+        return response
+    route, started, profile = state
+    method = request.method
+    status = response.status_code
+    bytes_in = request.content_length or 0
+    
+    counted = None
+    if method == 'HEAD' or status == 304:
+        bytes_out = 0
+    elif response.content_length is not None:
+        bytes_out = response.content_length
+    elif response.is_streamed and not response.direct_passthrough:
+        # Corpo generato durante l'invio: si contano i byte man mano
+        counted = response.response = CountingIterable(response.response)
+        bytes_out = 0
+    else:
+        bytes_out = 0
+    
+    def finish():
+        if profile is not None:
+            slow_request_profiler.end(profile)
+        metrics.request_finished(route, method, status, time.perf_counter() - started,
+                                 bytes_in, counted.count if counted is not None else bytes_out)
+    
+    if not response.direct_passthrough:
+        response.call_on_close(finish)
+    elif not call_after_close(response.response, finish):
+        finish()
+    return response
+
+@app.teardown_request
+def abort_request_metrics(error):
+    """Richiesta interrotta da un'eccezione prima di after_request: conta come 500"""
+    state = request.environ.pop('fileserver.metrics', None)
+    if state is None:
+        return
+    route, started, profile = state
+    if profile is not None:
+        slow_request_profiler.end(profile)
+    metrics.request_finished(route, request.method, 500, time.perf_counter() - started,
+                             request.content_length or 0, 0)
+
+@app.after_request
+def compress_response(response):
+    """Comprimi le risposte JSON secondo l'Accept-Encoding del client"""
+    if (response.status_code != 200 or response.direct_passthrough or response.is_streamed
+            or response.mimetype != 'application/json'
+            or 'Content-Encoding' in response.headers):
+        return response
+    response.vary.add('Accept-Encoding')
+    codec = negotiate(request.accept_encodings)
+    if codec is None or response.content_length < MIN_SIZE:
+        return response
+    
+    response.set_data(compress_bytes(response.get_data(), codec))
+    response.headers['Content-Encoding'] = codec
+    # La rappresentazione compressa cambia i byte: l'ETag diventa debole
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(etag, weak=True)
+    return response
+
 @app.route('/')
 def index():
     """Homepage con informazioni API"""
@@ -42,10 +377,29 @@ def index():
         'version': '1.0',
         'endpoints': {
             'GET /files': 'Lista file e cartelle',
-            'GET /files/<path>': 'Lista contenuto di una cartella specifica',
-            'GET /download/<path>': 'Scarica un file',
+            'GET /files/<path>': 'Lista contenuto di una cartella specifica '
+                                 '(?limit=&cursor= per la paginazione, '
+                                 'Accept: application/x-ndjson per lo streaming)',
+            'GET /download/<path>': 'Scarica un file (supporta Range e If-Range)',
+            'GET /download/<dir>?format=zip|tar|tar.zst': 'Scarica una cartella come archivio',
             'POST /upload': 'Carica un file',
-            'POST /mkdir': 'Crea una cartella'
+            'POST /uploads': 'Crea una sessione di upload a blocchi',
+            'PUT /uploads/<id>?offset=': 'Invia un blocco della sessione',
+            'GET /uploads/<id>': 'Intervalli ricevuti della sessione',
+            'POST /uploads/<id>/commit': 'Completa la sessione',
+            'POST /mkdir': 'Crea una cartella',
+            'DELETE /delete/<path>': 'Elimina un file (le cartelle in background: 202 con job_id)',
+            'GET /jobs/<id>': 'Stato di un job in background',
+            'GET /search?q=&path=': 'Cerca file e cartelle per nome',
+            'GET /tree/<path>?depth=': 'Albero con byte e file ricorsivi per cartella',
+            'GET /events?path=&since=': 'Modifiche a una cartella (SSE o long-poll JSON)',
+            'POST /batch': 'Più operazioni stat/mkdir/delete in una richiesta',
+            'GET /checksum/<path>?algorithm=': 'Checksum di un file (202 mentre viene calcolato)',
+            'GET /metrics': 'Metriche Prometheus',
+            'GET /bandwidth': 'Velocità e limiti dei trasferimenti per client',
+            'GET /signature/<path>': 'Firma dei blocchi di un file per la sincronizzazione delta',
+            'POST /delta/<path>': 'Aggiorna un file inviando solo i blocchi cambiati (If-Match)',
+            'GET /preview/<path>?size=&bytes=&lines=': 'Anteprima: miniatura, inizio del testo o metadati'
         }
     })
 
@@ -57,7 +411,7 @@ def list_files(subpath=''):
         target_path = os.path.join(BASE_DIR, subpath) if subpath else BASE_DIR
         
         # Verifica che il path sia all'interno della directory base
-        if not os.path.abspath(target_path).startswith(os.path.abspath(BASE_DIR)):
+        if not is_allowed_path(target_path):
             return jsonify({'error': 'Accesso negato'}), 403
             
         if not os.path.exists(target_path):
@@ -66,28 +420,75 @@ def list_files(subpath=''):
         if not os.path.isdir(target_path):
             return jsonify({'error': 'Il path non è una directory'}), 400
         
-        items = []
-        for item in os.listdir(target_path):
-            item_path = os.path.join(target_path, item)
-            file_info = get_file_info(item_path)
-            if file_info:
-                # Aggiungi il path relativo per l'API
-                relative_path = os.path.relpath(item_path, BASE_DIR)
-                file_info['relative_path'] = relative_path
-                items.append(file_info)
+        # Path relativo della directory per l'API ('' per la radice)
+        relative_dir = os.path.relpath(target_path, BASE_DIR)
+        if relative_dir == '.':
+            relative_dir = ''
         
-        # Ordina: prima le directory, poi i file
-        items.sort(key=lambda x: (not x['is_directory'], x['name'].lower()))
+        if request.accept_mimetypes.best == 'application/x-ndjson':
+            return stream_listing(target_path, relative_dir)
         
-        return jsonify({
+        limit = request.args.get('limit')
+        if limit is not None:
+            try:
+                limit = int(limit)
+            except ValueError:
+                return jsonify({'error': 'Parametro limit non valido'}), 400
+            if limit <= 0:
+                return jsonify({'error': 'Parametro limit non valido'}), 400
+            limit = min(limit, LISTING_MAX_PAGE_SIZE)
+        
+        # Elementi già ordinati: prima le directory, poi i file
+        items, digest = listing_cache.listing(target_path, relative_dir)
+        cursor = request.args.get('cursor')
+        
+        # ETag forte: contenuto della directory più i parametri della pagina.
+        # Se il client ha già questa versione non serve costruire il JSON.
+        etag = hashlib.sha1(f"{digest}:{subpath}:{cursor}:{limit}".encode('utf-8')).hexdigest()
+        if request.if_none_match.contains_weak(etag):
+            response = Response(status=304)
+            response.set_etag(etag)
+            return response
+        
+        try:
+            page, next_cursor = paginate(items, cursor, limit)
+        except ValueError:
+            return jsonify({'error': 'Cursore non valido'}), 400
+        
+        response = jsonify({
             'current_path': subpath,
-            'items': items,
-            'total': len(items)
+            'items': page,
+            'total': len(items),
+            'next_cursor': next_cursor
         })
+        response.set_etag(etag)
+        # Il client può tenere la risposta ma deve sempre rivalidarla
+        response.headers['Cache-Control'] = 'no-cache'
+        return response
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+def stream_listing(target_path, relative_dir):
+    """Listing in streaming NDJSON, un elemento per riga.
+
+    Se il listing è in cache gli elementi escono già ordinati, altrimenti
+    nell'ordine di scansione: la memoria resta costante anche per directory
+    enormi e il primo elemento parte subito.
+    """
+    cached = listing_cache.peek(target_path)
+    if cached is not None:
+        items = cached
+    else:
+        items = iter_directory(target_path, relative_dir, is_internal_path, metrics)
+    
+    def generate():
+        for item in items:
+            yield json.dumps(item) + '\n'
+    
+    return Response(generate(), mimetype='application/x-ndjson')
+
+@app.route('/download', defaults={'filepath': ''}, methods=['GET'])
 @app.route('/download/<path:filepath>', methods=['GET'])
 def download_file(filepath):
     """Scarica un file"""
@@ -95,20 +496,102 @@ def download_file(filepath):
         full_path = os.path.join(BASE_DIR, filepath)
         
         # Verifica sicurezza del path
-        if not os.path.abspath(full_path).startswith(os.path.abspath(BASE_DIR)):
+        if not is_allowed_path(full_path):
             return jsonify({'error': 'Accesso negato'}), 403
             
         if not os.path.exists(full_path):
             return jsonify({'error': 'File non trovato'}), 404
             
         if os.path.isdir(full_path):
-            return jsonify({'error': 'Impossibile scaricare una directory'}), 400
+            return download_directory(full_path)
         
-        return send_file(full_path, as_attachment=True)
+        stat_result = timed_stat(full_path)
+        mimetype = mimetypes.guess_type(full_path)[0] or 'application/octet-stream'
+        
+        if DOWNLOAD_BACKEND in OFFLOAD_BACKENDS:
+            # Il proxy segue i link simbolici: il path reale deve restare nella base
+            if not is_inside(full_path, BASE_DIR):
+                return jsonify({'error': 'Accesso negato'}), 403
+            if DOWNLOAD_BACKEND == 'x-accel-redirect':
+                relative_path = os.path.relpath(full_path, BASE_DIR).replace(os.sep, '/')
+                return accel_redirect(relative_path, X_ACCEL_PREFIX, mimetype,
+                                      os.path.basename(full_path))
+            # X-Sendfile: Range e richieste condizionali li gestisce il proxy
+            return send_whole_file(full_path, request.environ, stat_result, DOWNLOAD_BACKEND)
+        
+        # Richiesta Range: 206 con uno o più intervalli, 416 se non soddisfacibile.
+        # Con If-Range non corrispondente si serve il file intero.
+        range_header = request.headers.get('Range')
+        if range_header and (
+                request.if_range is None or if_range_matches(request.if_range, stat_result)):
+            requested = parse_ranges(range_header)
+            if requested is None or len(requested) > MAX_RANGES:
+                return range_not_satisfiable(stat_result.st_size)
+            ranges = satisfiable_ranges(requested, stat_result.st_size)
+            if ranges is None:
+                return range_not_satisfiable(stat_result.st_size)
+            environ = request.environ if DOWNLOAD_BACKEND == 'sendfile' else None
+            return partial_content(full_path, ranges, stat_result.st_size,
+                                   mimetype, stat_result, environ)
+        
+        if is_compressible(mimetype) and stat_result.st_size >= MIN_SIZE:
+            codec = negotiate(request.accept_encodings)
+            if codec is not None:
+                return send_compressed(full_path, stat_result, mimetype, codec)
+        
+        response = send_whole_file(full_path, request.environ, stat_result, DOWNLOAD_BACKEND)
+        if is_compressible(mimetype):
+            response.vary.add('Accept-Encoding')
+        # Digest già noto: il client verifica il download senza rileggere il file
+        digest = checksum_store.get(stat_result)
+        if digest is not None:
+            response.headers['Repr-Digest'] = digest_header(digest)
+        return response
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+def send_compressed(full_path, stat_result, mimetype, codec):
+    """Download compresso: dalla cache se la variante esiste, altrimenti in streaming"""
+    etag = f"{file_etag(stat_result)}-{codec}"
+    name = os.path.basename(full_path)
+    
+    cached = compression_cache.lookup(full_path, stat_result, codec)
+    if cached is not None:
+        response = send_whole_file(cached, request.environ, stat_result, DOWNLOAD_BACKEND,
+                                   download_name=name, mimetype=mimetype, etag=etag)
+    elif request.if_none_match.contains(etag):
+        response = Response(status=304)
+        response.set_etag(etag)
+    else:
+        response = Response(compression_cache.stream(full_path, stat_result, codec),
+                            mimetype=mimetype)
+        response.set_etag(etag)
+        response.last_modified = stat_result.st_mtime
+        response.headers['Content-Disposition'] = content_disposition(name)
+    
+    response.headers['Content-Encoding'] = codec
+    response.vary.add('Accept-Encoding')
+    # Gli intervalli si riferiscono alla rappresentazione non compressa
+    response.headers['Accept-Ranges'] = 'bytes'
+    return response
+
+def download_directory(full_path):
+    """Scarica una directory come archivio generato al volo (?format=zip|tar|tar.zst)"""
+    fmt = request.args.get('format')
+    if fmt is None:
+        return jsonify({'error': 'Impossibile scaricare una directory',
+                        'formats': available_formats()}), 400
+    if fmt not in available_formats():
+        return jsonify({'error': 'Formato archivio non supportato',
+                        'formats': available_formats()}), 400
+    
+    mimetype, extension = FORMATS[fmt]
+    name = os.path.basename(os.path.normpath(full_path)) + extension
+    response = Response(stream_archive(full_path, fmt, is_internal_path), mimetype=mimetype)
+    response.headers['Content-Disposition'] = f'attachment; filename="{secure_filename(name) or "archive" + extension}"'
+    return response
+
 @app.route('/upload', methods=['POST'])
 def upload_file():
     """Carica un file"""
@@ -132,14 +615,21 @@ def upload_file():
             upload_path = os.path.join(BASE_DIR, target_dir) if target_dir else BASE_DIR
             
             # Verifica sicurezza del path
-            if not os.path.abspath(upload_path).startswith(os.path.abspath(BASE_DIR)):
+            if not is_allowed_path(upload_path):
                 return jsonify({'error': 'Accesso negato'}), 403
             
             # Crea la directory se non esiste
             os.makedirs(upload_path, exist_ok=True)
             
+            # Digest calcolati durante la ricezione, senza rileggere il file
             file_path = os.path.join(upload_path, filename)
-            file.save(file_path)
+            if blob_store is not None:
+                temp_path, digests = blob_store.receive(file.stream)
+                blob_store.store(temp_path, file_path, digests['sha256'])
+            else:
+                digests = save_stream(file.stream, file_path)
+            record_checksums(file_path, digests)
+            file_uploaded(file_path)
             
             file_info = get_file_info(file_path)
             return jsonify({
@@ -150,6 +640,302 @@ def upload_file():
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@app.route('/uploads', methods=['POST'])
+def create_upload_session():
+    """Crea una sessione di upload a blocchi"""
+    try:
+        data = request.get_json(silent=True)
+        if not data or 'name' not in data or 'size' not in data:
+            return jsonify({'error': 'Nome e dimensione del file richiesti'}), 400
+        
+        filename = secure_filename(data['name'])
+        if not filename:
+            return jsonify({'error': 'Nome file non valido'}), 400
+        
+        size = data['size']
+        if not isinstance(size, int) or size < 0:
+            return jsonify({'error': 'Dimensione non valida'}), 400
+        if size > MAX_UPLOAD_SIZE:
+            return jsonify({'error': 'File troppo grande'}), 413
+        
+        target_dir = data.get('path', '')
+        upload_path = os.path.join(BASE_DIR, target_dir) if target_dir else BASE_DIR
+        file_path = os.path.join(upload_path, filename)
+        
+        # Verifica sicurezza del path
+        if not is_allowed_path(file_path):
+            return jsonify({'error': 'Accesso negato'}), 403
+        
+        sha256 = data.get('sha256')
+        if sha256 is not None:
+            sha256 = str(sha256).lower()
+            if not is_digest(sha256):
+                return jsonify({'error': 'Digest sha256 non valido'}), 400
+            
+            # Contenuto già presente: upload completato senza trasferire il corpo
+            if blob_store is not None and blob_store.size(sha256) == size:
+                os.makedirs(upload_path, exist_ok=True)
+                if blob_store.link(sha256, file_path):
+                    file_uploaded(file_path)
+                    return jsonify({
+                        'message': 'File caricato con successo',
+                        'complete': True,
+                        'file_info': get_file_info(file_path)
+                    })
+        
+        session = upload_sessions.create(os.path.abspath(file_path), size, sha256)
+        return jsonify({
+            'session_id': session['id'],
+            'size': size,
+            'received': session['received'],
+            'chunk_size': UPLOAD_CHUNK_SIZE
+        }), 201
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/uploads/<session_id>', methods=['GET'])
+def upload_session_status(session_id):
+    """Stato di una sessione di upload: intervalli già ricevuti"""
+    try:
+        session = upload_sessions.status(session_id)
+        return jsonify({
+            'session_id': session['id'],
+            'size': session['size'],
+            'received': session['received']
+        })
+    except UploadSessionError as e:
+        return jsonify({'error': str(e)}), e.status
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/uploads/<session_id>', methods=['PUT'])
+def upload_chunk(session_id):
+    """Scrivi un blocco della sessione all'offset indicato (?offset=)"""
+    try:
+        offset = request.args.get('offset', type=int)
+        if offset is None:
+            return jsonify({'error': 'Parametro offset richiesto'}), 400
+        
+        length = request.content_length
+        if length is None:
+            return jsonify({'error': 'Content-Length richiesto'}), 411
+        
+        session = upload_sessions.write(session_id, offset, request.stream, length)
+        return jsonify({
+            'session_id': session['id'],
+            'size': session['size'],
+            'received': session['received']
+        })
+    except UploadSessionError as e:
+        return jsonify({'error': str(e)}), e.status
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/uploads/<session_id>/commit', methods=['POST'])
+def commit_upload(session_id):
+    """Completa una sessione di upload spostando il file nella destinazione"""
+    try:
+        session = upload_sessions.commit(session_id, place_upload)
+        file_path = session['target']
+        if session.get('checksums'):
+            record_checksums(file_path, session['checksums'])
+        listing_cache.invalidate(os.path.dirname(file_path))
+        path_changed(file_path)
+        
+        file_info = get_file_info(file_path)
+        return jsonify({
+            'message': 'File caricato con successo',
+            'file_info': file_info
+        })
+    except UploadSessionError as e:
+        return jsonify({'error': str(e)}), e.status
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+def place_upload(part_path, session):
+    """Sposta il file completato nella destinazione, verificando il digest dichiarato"""
+    if blob_store is None and not session.get('sha256'):
+        os.replace(part_path, session['target'])
+        return
+    # Blocchi arrivati fuori ordine: i digest si calcolano rileggendo il file
+    if session.get('checksums') is None:
+        session['checksums'] = hash_file(part_path)[0]
+    digest = session['checksums']['sha256']
+    if session.get('sha256') and digest != session['sha256']:
+        raise UploadSessionError('Il digest sha256 non corrisponde al contenuto ricevuto', 422)
+    if blob_store is not None:
+        blob_store.store(part_path, session['target'], digest)
+    else:
+        os.replace(part_path, session['target'])
+
+def file_uploaded(file_path):
+    """Aggiorna cache, indice ed eventi dopo aver scritto un file"""
+    upload_path = os.path.dirname(file_path)
+    # Sovrascrivere un file non cambia l'mtime della directory: lo
+    # aggiorniamo per invalidare anche le cache degli altri worker
+    os.utime(upload_path)
+    listing_cache.invalidate(upload_path)
+    path_changed(file_path)
+
+@app.route('/uploads/<session_id>', methods=['DELETE'])
+def abort_upload(session_id):
+    """Annulla una sessione di upload"""
+    try:
+        upload_sessions.abort(session_id)
+        return jsonify({'message': 'Upload annullato'})
+    except UploadSessionError as e:
+        return jsonify({'error': str(e)}), e.status
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+def check_mkdir(parent_path, name):
+    """Valida la creazione di una directory; restituisce (parent, nuova directory)"""
+    dir_name = secure_filename(name or '')
+    if not dir_name:
+        raise OperationError('Nome directory non valido', 400)
+    
+    # Crea il path completo
+    base_path = os.path.join(BASE_DIR, parent_path) if parent_path else BASE_DIR
+    new_dir_path = os.path.join(base_path, dir_name)
+    
+    # Verifica sicurezza del path
+    if not is_allowed_path(new_dir_path):
+        raise OperationError('Accesso negato', 403)
+    
+    if os.path.exists(new_dir_path):
+        raise OperationError('Directory già esistente', 400)
+    return base_path, new_dir_path
+
+def make_directory(parent_path, name):
+    """Crea una directory (e i parent mancanti); undo rimuove ciò che è stato creato"""
+    base_path, new_dir_path = check_mkdir(parent_path, name)
+    
+    # Directory che non esistevano, dalla più esterna
+    created = []
+    current = new_dir_path
+    while not os.path.exists(current):
+        created.insert(0, current)
+        current = os.path.dirname(current)
+    
+    os.makedirs(new_dir_path)
+    listing_cache.invalidate(base_path)
+    path_changed(new_dir_path)
+    
+    def undo():
+        for path in reversed(created):
+            os.rmdir(path)
+        listing_cache.invalidate(os.path.dirname(created[0]))
+        path_removed(created[0])
+    
+    return Change({
+        'message': 'Directory creata con successo',
+        'directory_info': get_file_info(new_dir_path)
+    }, undo=undo)
+
+def check_delete(filepath):
+    """Valida l'eliminazione di un path; restituisce il path assoluto"""
+    full_path = os.path.join(BASE_DIR, filepath)
+    
+    # Verifica sicurezza del path
+    if not is_allowed_path(full_path):
+        raise OperationError('Accesso negato', 403)
+        
+    if not os.path.lexists(full_path):
+        raise OperationError('File o directory non trovata', 404)
+    
+    if os.path.abspath(full_path) == os.path.abspath(BASE_DIR):
+        raise OperationError('Impossibile eliminare la directory base', 403)
+    return full_path
+
+def delete_path(filepath, staged=False):
+    """Elimina un file o una directory.
+    
+    Con `staged` anche i file vengono solo spostati nel cestino: undo li
+    rimette al loro posto, commit avvia l'eliminazione definitiva.
+    """
+    full_path = check_delete(filepath)
+    parent_dir = os.path.dirname(os.path.abspath(full_path))
+    is_tree = os.path.isdir(full_path) and not os.path.islink(full_path)
+    
+    if not is_tree and not staged:
+        if blob_store is not None:
+            blob_store.unlink(full_path)
+        else:
+            os.remove(full_path)
+        listing_cache.invalidate(parent_dir)
+        path_removed(full_path)
+        return Change({'message': 'Eliminato con successo'})
+    
+    # La directory sparisce subito spostandola nel cestino interno,
+    # il contenuto viene eliminato da un job in background
+    trash_dir = data_path('trash')
+    os.makedirs(trash_dir, exist_ok=True)
+    trash_path = os.path.join(trash_dir, uuid.uuid4().hex)
+    try:
+        os.rename(full_path, trash_path)
+    except OSError:
+        if staged:
+            raise OperationError('Impossibile spostare nel cestino: eliminazione non annullabile', 409)
+        # Filesystem diverso (mount point): eliminazione sul posto
+        trash_path = os.path.abspath(full_path)
+    listing_cache.invalidate(full_path)
+    listing_cache.invalidate(parent_dir)
+    path_removed(full_path)
+    
+    def undo():
+        os.rename(trash_path, full_path)
+        listing_cache.invalidate(parent_dir)
+        path_changed(full_path)
+    
+    def purge():
+        if not is_tree:
+            if blob_store is not None:
+                blob_store.unlink(trash_path)
+            else:
+                os.remove(trash_path)
+            return None
+        return job_queue.submit('delete', filepath, remove_tree, trash_path,
+                                on_done=lambda job: deleted_tree(parent_dir))
+    
+    if staged:
+        if not is_tree:
+            return Change({'message': 'Eliminato con successo'}, undo=undo, commit=purge)
+        change = Change({'message': 'Eliminazione avviata'}, status=202, undo=undo)
+        
+        def commit():
+            job = purge()
+            change.result.update({'job_id': job.id, 'job': job.to_dict()})
+        
+        change.commit = commit
+        return change
+    
+    job = purge()
+    return Change({
+        'message': 'Eliminazione avviata',
+        'job_id': job.id,
+        'job': job.to_dict()
+    }, status=202)
+
+def deleted_tree(parent_dir):
+    """Fine dell'eliminazione di una directory: i suoi blob possono essere liberi"""
+    listing_cache.invalidate(parent_dir)
+    collect_blobs()
+
+def stat_path(filepath):
+    """Informazioni su un path, come negli elementi del listing"""
+    full_path = os.path.join(BASE_DIR, filepath) if filepath else BASE_DIR
+    
+    # Verifica sicurezza del path
+    if not is_allowed_path(full_path):
+        raise OperationError('Accesso negato', 403)
+    
+    info = get_file_info(full_path)
+    if info is None:
+        raise OperationError('File o directory non trovata', 404)
+    info['relative_path'] = filepath.strip('/')
+    return Change(info)
+
 @app.route('/mkdir', methods=['POST'])
 def create_directory():
     """Crea una nuova directory"""
@@ -158,61 +944,472 @@ def create_directory():
         if not data or 'name' not in data:
             return jsonify({'error': 'Nome directory richiesto'}), 400
         
-        dir_name = secure_filename(data['name'])
-        parent_path = data.get('path', '')
+        change = make_directory(data.get('path', ''), data['name'])
+        return jsonify(change.result)
         
-        if not dir_name:
-            return jsonify({'error': 'Nome directory non valido'}), 400
+    except OperationError as e:
+        return jsonify({'error': str(e)}), e.status
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/delete/<path:filepath>', methods=['DELETE'])
+def delete_item(filepath):
+    """Elimina un file o directory"""
+    try:
+        change = delete_path(filepath)
+        response = jsonify(change.result)
+        response.status_code = change.status
+        if 'job_id' in change.result:
+            response.headers['Location'] = f"/jobs/{change.result['job_id']}"
+        return response
         
-        # Crea il path completo
-        base_path = os.path.join(BASE_DIR, parent_path) if parent_path else BASE_DIR
-        new_dir_path = os.path.join(base_path, dir_name)
+    except OperationError as e:
+        return jsonify({'error': str(e)}), e.status
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+# Operazioni di /batch: (controllo preliminare, esecuzione)
+BATCH_HANDLERS = {
+    'stat': (lambda op: stat_path(op.get('path', '')),
+             lambda op, atomic: stat_path(op.get('path', ''))),
+    'mkdir': (lambda op: check_mkdir(op.get('path', ''), op.get('name')),
+              lambda op, atomic: make_directory(op.get('path', ''), op.get('name'))),
+    'delete': (lambda op: check_delete(op.get('path', '')),
+               lambda op, atomic: delete_path(op.get('path', ''), staged=atomic)),
+}
+
+@app.route('/batch', methods=['POST'])
+def batch_operations():
+    """Esegui più operazioni (stat, mkdir, delete) in una sola richiesta"""
+    try:
+        data = request.get_json(silent=True)
+        operations = data.get('operations') if isinstance(data, dict) else None
+        if not isinstance(operations, list) or not operations:
+            return jsonify({'error': 'Lista operations richiesta'}), 400
+        if len(operations) > BATCH_MAX_OPERATIONS:
+            return jsonify({'error': f"Massimo {BATCH_MAX_OPERATIONS} operazioni per batch"}), 400
+        if not all(isinstance(op, dict) for op in operations):
+            return jsonify({'error': 'Operazione non valida'}), 400
+        
+        atomic = bool(data.get('atomic', False))
+        results, completed = run_batch(operations, BATCH_HANDLERS, BATCH_WORKERS, atomic)
+        failed = sum(1 for result in results if 'error' in result)
+        # In modalità tutto-o-niente un fallimento non lascia modifiche
+        status = 409 if atomic and not completed else 200
+        return jsonify({
+            'atomic': atomic,
+            'completed': completed,
+            'succeeded': len(results) - failed,
+            'failed': failed,
+            'results': results
+        }), status
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/search', methods=['GET'])
+def search_files():
+    """Cerca file e cartelle per nome (?q=...&path=...)"""
+    try:
+        query = request.args.get('q', '').strip()
+        if not query:
+            return jsonify({'error': 'Parametro q richiesto'}), 400
+        
+        subpath = request.args.get('path', '').strip('/')
+        target_path = os.path.join(BASE_DIR, subpath) if subpath else BASE_DIR
         
         # Verifica sicurezza del path
-        if not os.path.abspath(new_dir_path).startswith(os.path.abspath(BASE_DIR)):
+        if not is_allowed_path(target_path):
             return jsonify({'error': 'Accesso negato'}), 403
         
-        if os.path.exists(new_dir_path):
-            return jsonify({'error': 'Directory già esistente'}), 400
+        limit = min(request.args.get('limit', 100, type=int), SEARCH_MAX_RESULTS)
+        items = search_index.search(query, subpath, max(limit, 1))
+        return jsonify({
+            'query': query,
+            'path': subpath,
+            'items': items,
+            'total': len(items)
+        })
         
-        os.makedirs(new_dir_path)
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/tree', methods=['GET'])
+@app.route('/tree/<path:subpath>', methods=['GET'])
+def get_tree(subpath=''):
+    """Albero con dimensioni ricorsive (?depth=&limit=), dall'indice"""
+    try:
+        target_path = os.path.join(BASE_DIR, subpath) if subpath else BASE_DIR
         
-        dir_info = get_file_info(new_dir_path)
-        return jsonify({
-            'message': 'Directory creata con successo',
-            'directory_info': dir_info
+        # Verifica sicurezza del path
+        if not is_allowed_path(target_path):
+            return jsonify({'error': 'Accesso negato'}), 403
+        
+        if not os.path.exists(target_path):
+            return jsonify({'error': 'Path non trovato'}), 404
+        
+        depth = min(max(request.args.get('depth', 1, type=int), 0), TREE_MAX_DEPTH)
+        limit = min(max(request.args.get('limit', 100, type=int), 1), TREE_MAX_CHILDREN)
+        
+        tree = search_index.tree(subpath, depth, limit)
+        if tree is None or (tree['is_directory'] and not search_index.reconciled(subpath)):
+            # Sottoalbero non ancora visitato (update() aggiunge solo gli antenati,
+            # con totali parziali): viene indicizzato in background
+            job = submit_file_job('index', target_path, timed_stat(target_path), index_tree)
+            response = jsonify({
+                'message': 'Indicizzazione in corso',
+                'job_id': job.id,
+                'job': job.to_dict()
+            })
+            response.headers['Retry-After'] = '1'
+            return response, 202
+        return jsonify(tree)
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/events', methods=['GET'])
+def get_events():
+    """Modifiche ai figli di una cartella (?path=&since=): stream SSE o long-poll JSON"""
+    try:
+        subpath = request.args.get('path', '').strip('/')
+        target_path = os.path.join(BASE_DIR, subpath) if subpath else BASE_DIR
+        
+        # Verifica sicurezza del path
+        if not is_allowed_path(target_path):
+            return jsonify({'error': 'Accesso negato'}), 403
+        
+        # Ripresa dall'ultimo evento ricevuto, altrimenti solo gli eventi nuovi
+        since = request.args.get('since', request.headers.get('Last-Event-ID'), type=int)
+        if since is None:
+            since = event_log.latest()
+        
+        if request.accept_mimetypes.best == 'application/json':
+            wait = min(request.args.get('wait', 25, type=float), EVENTS_MAX_WAIT)
+            events = event_log.since(since, subpath)
+            if events == [] and wait > 0:
+                # L'attesa occupa un thread del worker come uno stream SSE
+                if not event_streams.acquire(blocking=False):
+                    return events_busy()
+                try:
+                    events = wait_events(since, subpath, time.monotonic() + wait)
+                finally:
+                    event_streams.release()
+            if events is None:
+                return jsonify({'events': [], 'last_seq': event_log.latest(), 'reset': True})
+            last_seq = events[-1]['seq'] if events else since
+            return jsonify({'events': events, 'last_seq': last_seq, 'reset': False})
+        
+        # Ogni stream occupa un thread del worker per tutta la sua durata
+        if not event_streams.acquire(blocking=False):
+            return events_busy()
+        
+        response = Response(stream_events(subpath, since), mimetype='text/event-stream',
+                            headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+        response.call_on_close(event_streams.release)
+        return response
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+def events_busy():
+    response = jsonify({'error': 'Troppe attese di eventi aperte'})
+    response.headers['Retry-After'] = str(EVENTS_BUSY_RETRY)
+    return response, 503
+
+def wait_events(since, subpath, deadline):
+    """Eventi dopo `since` (None se non più disponibili), attendendo fino a `deadline`"""
+    while True:
+        events = event_log.since(since, subpath)
+        if events or events is None or time.monotonic() >= deadline:
+            return events
+        time.sleep(EVENTS_POLL_INTERVAL)
+
+def stream_events(subpath, since):
+    """Genera gli eventi SSE a partire dal numero di sequenza `since`"""
+    last_ping = time.monotonic()
+    yield 'retry: 3000\n\n'
+    while True:
+        latest = event_log.latest()
+        events = event_log.since(since, subpath)
+        if events is None:
+            # Il client è troppo indietro: deve ricaricare il listing
+            since = latest
+            yield f"id: {since}\nevent: reset\ndata: {{}}\n\n"
+            continue
+        for event in events:
+            since = event['seq']
+            yield f"id: {since}\nevent: {event['type']}\ndata: {json.dumps(event)}\n\n"
+        if events:
+            continue
+        if time.monotonic() - last_ping >= EVENTS_PING_INTERVAL:
+            # Il ping fa avanzare l'id di ripresa anche senza eventi per questa cartella
+            since = max(since, latest)
+            last_ping = time.monotonic()
+            yield f"id: {since}\nevent: ping\ndata: {{}}\n\n"
+        time.sleep(EVENTS_POLL_INTERVAL)
+
+@app.route('/checksum/<path:filepath>', methods=['GET'])
+def get_checksum(filepath):
+    """Checksum di un file (?algorithm=): salvato, oppure calcolato in background"""
+    try:
+        algorithm = request.args.get('algorithm', 'sha256')
+        if algorithm not in available_algorithms():
+            return jsonify({'error': 'Algoritmo non supportato',
+                            'algorithms': available_algorithms()}), 400
+        
+        full_path = os.path.join(BASE_DIR, filepath)
+        
+        # Verifica sicurezza del path
+        if not is_allowed_path(full_path):
+            return jsonify({'error': 'Accesso negato'}), 403
+            
+        if not os.path.exists(full_path):
+            return jsonify({'error': 'File non trovato'}), 404
+            
+        if os.path.isdir(full_path):
+            return jsonify({'error': 'Checksum disponibile solo per i file'}), 400
+        
+        stat_result = timed_stat(full_path)
+        digest = checksum_store.get(stat_result, algorithm)
+        if digest is None:
+            # 202: il client riprova dopo Retry-After o segue il job
+            job = compute_checksums(full_path, stat_result)
+            response = jsonify({
+                'message': 'Calcolo del checksum avviato',
+                'job_id': job.id,
+                'job': job.to_dict()
+            })
+            response.headers['Retry-After'] = '1'
+            return response, 202
+        
+        response = jsonify({
+            'path': filepath,
+            'algorithm': algorithm,
+            'digest': digest,
+            'size': stat_result.st_size,
+            'modified': datetime.fromtimestamp(stat_result.st_mtime).isoformat()
         })
+        response.set_etag(file_etag(stat_result))
+        return response.make_conditional(request)
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
-@app.route('/delete/<path:filepath>', methods=['DELETE'])
-def delete_item(filepath):
-    """Elimina un file o directory"""
+@app.route('/signature/<path:filepath>', methods=['GET'])
+def get_signature(filepath):
+    """Firma dei blocchi di un file per la sincronizzazione delta (formato in delta.py)"""
     try:
         full_path = os.path.join(BASE_DIR, filepath)
         
         # Verifica sicurezza del path
-        if not os.path.abspath(full_path).startswith(os.path.abspath(BASE_DIR)):
+        if not is_allowed_path(full_path):
             return jsonify({'error': 'Accesso negato'}), 403
             
         if not os.path.exists(full_path):
-            return jsonify({'error': 'File o directory non trovata'}), 404
+            return jsonify({'error': 'File non trovato'}), 404
+            
+        if os.path.isdir(full_path):
+            return jsonify({'error': 'Firma disponibile solo per i file'}), 400
+        
+        stat_result = timed_stat(full_path)
+        signature = signature_cache.get(stat_result)
+        if signature is None:
+            # 202: il client riprova dopo Retry-After o segue il job
+            job = submit_file_job('signature', full_path, stat_result, signature_file)
+            response = jsonify({
+                'message': 'Calcolo della firma avviato',
+                'job_id': job.id,
+                'job': job.to_dict()
+            })
+            response.headers['Retry-After'] = '1'
+            return response, 202
+        
+        response = Response(signature, mimetype='application/octet-stream')
+        # La delta va inviata con If-Match: questo ETag
+        response.set_etag(file_etag(stat_result))
+        response.headers['X-Delta-Max-Bytes'] = str(MAX_CONTENT_LENGTH)
+        return response.make_conditional(request)
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/delta/<path:filepath>', methods=['POST'])
+def apply_file_delta(filepath):
+    """Aggiorna un file con una delta rispetto alla versione indicata da If-Match"""
+    temp_path = None
+    try:
+        full_path = os.path.join(BASE_DIR, filepath)
+        
+        # Verifica sicurezza del path
+        if not is_allowed_path(full_path):
+            return jsonify({'error': 'Accesso negato'}), 403
+            
+        if not os.path.isfile(full_path):
+            return jsonify({'error': 'File non trovato'}), 404
+        
+        stat_result = timed_stat(full_path)
+        if not request.if_match.contains(file_etag(stat_result)):
+            return jsonify({'error': 'Il file è cambiato: richiedere una nuova firma'}), 412
+        
+        # Ricostruzione nella directory dei dati (stesso filesystem), poi sostituzione atomica
+        os.makedirs(data_path('delta'), exist_ok=True)
+        temp_path = data_path('delta', f"{uuid.uuid4().hex}.part")
+        digests = apply_delta(request.stream, full_path, temp_path, stat_result)
+        if blob_store is not None:
+            blob_store.store(temp_path, full_path, digests['sha256'])
+        else:
+            os.chmod(temp_path, stat.S_IMODE(stat_result.st_mode))
+            os.replace(temp_path, full_path)
+        temp_path = None
+        record_checksums(full_path, digests)
+        file_uploaded(full_path)
+        
+        return jsonify({
+            'message': 'File aggiornato con successo',
+            'file_info': get_file_info(full_path)
+        })
+    except DeltaError as e:
+        return jsonify({'error': str(e)}), e.status
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+    finally:
+        if temp_path is not None and os.path.exists(temp_path):
+            os.remove(temp_path)
+
+@app.route('/preview/<path:filepath>', methods=['GET'])
+def get_preview(filepath):
+    """Anteprima di un file senza scaricarlo (vedi previews.py).
+
+    Immagini: miniatura con lato lungo ?size= pixel. Testi: primi ?bytes=
+    byte, oppure le righe ?lines=inizio-fine. Altri file: solo i metadati
+    in JSON. L'header X-Preview-Kind indica quale dei tre.
+    """
+    try:
+        full_path = os.path.join(BASE_DIR, filepath)
         
+        # Verifica sicurezza del path
+        if not is_allowed_path(full_path):
+            return jsonify({'error': 'Accesso negato'}), 403
+            
+        if not os.path.exists(full_path):
+            return jsonify({'error': 'File non trovato'}), 404
+            
         if os.path.isdir(full_path):
-            import shutil
-            shutil.rmtree(full_path)
+            return jsonify({'error': 'Anteprima disponibile solo per i file'}), 400
+        
+        stat_result = timed_stat(full_path)
+        mimetype = mimetypes.guess_type(full_path)[0]
+        kind = preview_kind(full_path, mimetype)
+        max_bytes = request.args.get('bytes', TEXT_PREVIEW_BYTES, type=int)
+        if max_bytes <= 0:
+            return jsonify({'error': 'Numero di byte non valido'}), 400
+        max_bytes = min(max_bytes, MAX_TEXT_PREVIEW_BYTES)
+        lines = request.args.get('lines')
+        try:
+            lines = parse_line_range(lines) if lines else None
+        except ValueError:
+            return jsonify({'error': 'Intervallo di righe non valido'}), 400
+        
+        if kind == 'image':
+            size = thumbnail_size(request.args.get('size', type=int))
+            variant = f"thumbnail-{size}"
+        elif kind == 'text':
+            variant = f"lines-{lines[0]}-{lines[1]}-{max_bytes}" if lines else f"head-{max_bytes}"
         else:
-            os.remove(full_path)
+            return metadata_preview(full_path, mimetype)
+        
+        etag = f"{file_etag(stat_result)}-{variant}"
+        if request.if_none_match.contains(etag):
+            response = Response(status=304)
+            response.set_etag(etag)
+            return response
         
-        return jsonify({'message': 'Eliminato con successo'})
+        if kind == 'text' and lines is None:
+            # L'inizio del file costa una lettura limitata: niente pool né cache
+            result = text_head(full_path, max_bytes)
+        else:
+            if kind == 'image':
+                future = preview_cache.get(full_path, stat_result, variant, make_thumbnail,
+                                           full_path, size)
+            else:
+                future = preview_cache.get(full_path, stat_result, variant, text_lines,
+                                           full_path, lines[0], lines[1], max_bytes)
+            try:
+                result = future.result(timeout=PREVIEW_WAIT)
+            except FutureTimeoutError:
+                # Generazione ancora in corso (pool occupato): il risultato resta in cache
+                response = jsonify({'message': 'Anteprima in preparazione'})
+                response.headers['Retry-After'] = '1'
+                return response, 202
+        
+        preview_mimetype, headers, data = result
+        if preview_mimetype is None:
+            return metadata_preview(full_path, mimetype)
+        response = Response(data, mimetype=preview_mimetype, headers=headers)
+        response.headers['X-Preview-Kind'] = kind
+        response.set_etag(etag)
+        response.last_modified = stat_result.st_mtime
+        return response
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+def metadata_preview(full_path, mimetype):
+    """Anteprima dei file senza contenuto mostrabile: solo i metadati"""
+    response = jsonify({
+        'kind': 'metadata',
+        'mimetype': mimetype,
+        'file_info': get_file_info(full_path)
+    })
+    response.headers['X-Preview-Kind'] = 'metadata'
+    return response
+
+@app.route('/jobs', methods=['GET'])
+def list_jobs():
+    """Lista dei job in background recenti"""
+    jobs = job_queue.jobs()
+    return jsonify({'jobs': jobs, 'total': len(jobs)})
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def job_status(job_id):
+    """Stato e avanzamento di un job in background"""
+    job = job_queue.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Job non trovato'}), 404
+    return jsonify(job)
+
+@app.route('/bandwidth', methods=['GET'])
+def get_bandwidth():
+    """Trasferimenti in corso e velocità per client (somma di tutti i worker)"""
+    if bandwidth is None:
+        return jsonify({'error': 'Limiti di banda disattivati'}), 404
+    try:
+        clients = [dict(values, client=client)
+                   for client, values in bandwidth.collect(data_path('bandwidth')).items()]
+        clients.sort(key=lambda item: item['rate_in'] + item['rate_out'], reverse=True)
+        return jsonify({
+            'total_rate': BANDWIDTH_TOTAL_RATE,
+            'client_rate': BANDWIDTH_CLIENT_RATE,
+            'clients': clients,
+        })
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    """Metriche di tutti i worker in formato Prometheus"""
+    if metrics is None:
+        return jsonify({'error': 'Metriche disattivate'}), 404
+    try:
+        return Response(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
 @app.errorhandler(413)
 def too_large(e):
-    return jsonify({'error': 'File troppo grande (max 16MB)'}), 413
+    max_mb = MAX_CONTENT_LENGTH // (1024 * 1024)
+    return jsonify({'error': f'File troppo grande (max {max_mb}MB, usare /uploads per file più grandi)'}), 413
 
 if __name__ == '__main__':
     print(f"Server avviato. Directory base: {BASE_DIR}")
@@ -220,8 +1417,22 @@ if __name__ == '__main__':
     print("  GET  /files - Lista file")
     print("  GET  /download/<path> - Scarica file")
     print("  POST /upload - Carica file")
+    print("  POST /uploads - Upload a blocchi ripristinabile")
     print("  POST /mkdir - Crea directory")
     print("  DELETE /delete/<path> - Elimina file/directory")
+    print("  POST /batch - Operazioni multiple in una richiesta")
+    print("  GET  /jobs/<id> - Stato dei job in background")
+    print("  GET  /search?q= - Cerca file per nome")
+    print("  GET  /tree/<path> - Dimensioni ricorsive delle cartelle")
+    print("  GET  /events?path= - Stream delle modifiche")
+    print("  GET  /checksum/<path> - Checksum di un file")
+    print("  GET  /signature/<path> - Firma dei blocchi per la sincronizzazione delta")
+    print("  GET  /preview/<path> - Anteprima: miniatura, inizio del testo o metadati")
+    print("  POST /delta/<path> - Aggiorna un file inviando solo i blocchi cambiati")
+    print("  GET  /bandwidth - Velocità dei trasferimenti per client")
+    print("  GET  /metrics - Metriche Prometheus")
+    
+    print("Server di sviluppo: in produzione usare serve.py")
     
     # Avvia il server su tutte le interfacce per permettere connessioni esterne
-    app.run(host='0.0.0.0', port=5000, debug=True)
\ No newline at end of file
+    app.run(host=settings['host'], port=settings['port'], debug=settings['debug'])
\ No newline at end of file
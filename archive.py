@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+"""Archivi zip/tar generati al volo dalla visita di una directory, senza file temporanei"""
+import mimetypes
+import os
+import queue
+import tarfile
+import threading
+import zipfile
+
+try:
+    import zstandard
+except ImportError:  # dipendenza opzionale, serve solo per tar.zst
+    zstandard = None
+
+# Formato -> (MIME type, estensione)
+FORMATS = {
+    'zip': ('application/zip', '.zip'),
+    'tar': ('application/x-tar', '.tar'),
+    'tar.zst': ('application/zstd', '.tar.zst'),
+}
+
+# Dimensione dei blocchi letti dai file e passati al client
+CHUNK_SIZE = 64 * 1024
+# Blocchi in coda tra il thread che scrive l'archivio e la risposta:
+# limita la memoria e rallenta la compressione se il client è lento
+QUEUE_CHUNKS = 16
+# Livello di compressione zstd: veloce, pesa poco anche sui dati già compressi
+ZSTD_LEVEL = 3
+
+# Formati già compressi: nello zip vengono memorizzati senza ricompressione
+COMPRESSED_EXTENSIONS = {
+    '.zip', '.gz', '.tgz', '.bz2', '.xz', '.zst', '.7z', '.rar', '.lz4', '.br',
+    '.jpg', '.jpeg', '.png', '.gif', '.webp', '.heic', '.avif',
+    '.mp3', '.m4a', '.aac', '.ogg', '.opus', '.flac',
+    '.mp4', '.m4v', '.mkv', '.mov', '.avi', '.webm',
+    '.apk', '.jar', '.docx', '.xlsx', '.pptx', '.odt', '.ods', '.epub', '.pdf',
+}
+UNCOMPRESSED_MEDIA = {'image/bmp', 'image/svg+xml', 'image/tiff', 'audio/x-wav', 'audio/wav'}
+
+
+def available_formats():
+    """Formati utilizzabili con le dipendenze installate"""
+    return [fmt for fmt in FORMATS if fmt != 'tar.zst' or zstandard is not None]
+
+
+def is_compressed(path):
+    """Vero se il file è in un formato già compresso"""
+    if os.path.splitext(path)[1].lower() in COMPRESSED_EXTENSIONS:
+        return True
+    mimetype = mimetypes.guess_type(path)[0]
+    if mimetype is None or mimetype in UNCOMPRESSED_MEDIA:
+        return False
+    return mimetype.split('/')[0] in ('image', 'audio', 'video')
+
+
+def walk(directory, hidden=None):
+    """Genera (path, nome nell'archivio, è_directory) senza seguire i link simbolici"""
+    root_name = os.path.basename(os.path.normpath(directory))
+    yield directory, root_name, True
+    for current, dirs, files in os.walk(directory):
+        dirs[:] = sorted(d for d in dirs
+                         if not os.path.islink(os.path.join(current, d))
+                         and not (hidden and hidden(os.path.join(current, d))))
+        relative = os.path.relpath(current, directory)
+        prefix = root_name if relative == '.' else f"{root_name}/{relative.replace(os.sep, '/')}"
+        for name in dirs:
+            yield os.path.join(current, name), f"{prefix}/{name}", True
+        for name in sorted(files):
+            path = os.path.join(current, name)
+            if os.path.islink(path) or (hidden and hidden(path)):
+                continue
+            yield path, f"{prefix}/{name}", False
+
+
+class ArchiveCancelled(Exception):
+    """Il client ha chiuso la connessione durante lo streaming"""
+
+
+class _QueueWriter:
+    """Oggetto file in sola scrittura che passa i dati a una coda limitata"""
+
+    def __init__(self, chunks, cancelled):
+        self._chunks = chunks
+        self._cancelled = cancelled
+
+    def write(self, data):
+        if data:
+            while True:
+                if self._cancelled.is_set():
+                    raise ArchiveCancelled()
+                try:
+                    self._chunks.put(bytes(data), timeout=1)
+                    break
+                except queue.Full:
+                    continue
+        return len(data)
+
+    def flush(self):
+        pass
+
+
+def _write_zip(sink, entries):
+    with zipfile.ZipFile(sink, 'w', allowZip64=True) as archive:
+        for path, arcname, is_directory in entries:
+            try:
+                info = zipfile.ZipInfo.from_file(path, arcname, strict_timestamps=False)
+                if is_directory:
+                    archive.writestr(info, b'')
+                    continue
+                info.compress_type = zipfile.ZIP_STORED if is_compressed(path) else zipfile.ZIP_DEFLATED
+                with open(path, 'rb') as src, archive.open(info, 'w', force_zip64=True) as dst:
+                    while True:
+                        data = src.read(CHUNK_SIZE)
+                        if not data:
+                            break
+                        dst.write(data)
+            except (FileNotFoundError, PermissionError):
+                # File rimossi o non leggibili durante la visita vengono saltati
+                continue
+
+
+def _write_tar(sink, entries):
+    with tarfile.open(fileobj=sink, mode='w|', bufsize=CHUNK_SIZE) as archive:
+        for path, arcname, is_directory in entries:
+            try:
+                info = archive.gettarinfo(path, arcname)
+                if is_directory:
+                    archive.addfile(info)
+                    continue
+                with open(path, 'rb') as src:
+                    archive.addfile(info, src)
+            except (FileNotFoundError, PermissionError):
+                continue
+
+
+def _write_archive(fmt, sink, entries):
+    if fmt == 'zip':
+        _write_zip(sink, entries)
+    elif fmt == 'tar':
+        _write_tar(sink, entries)
+    else:
+        compressor = zstandard.ZstdCompressor(level=ZSTD_LEVEL, threads=-1)
+        with compressor.stream_writer(sink, closefd=False) as writer:
+            _write_tar(writer, entries)
+
+
+def stream_archive(directory, fmt, hidden=None):
+    """Genera i byte dell'archivio della directory nel formato richiesto.
+
+    L'archivio viene scritto da un thread separato in una coda limitata, così
+    la memoria resta costante qualunque sia la dimensione della directory.
+    """
+    chunks = queue.Queue(maxsize=QUEUE_CHUNKS)
+    cancelled = threading.Event()
+    done = object()
+    errors = []
+
+    def produce():
+        try:
+            _write_archive(fmt, _QueueWriter(chunks, cancelled), walk(directory, hidden))
+        except ArchiveCancelled:
+            return
+        except Exception as e:
+            errors.append(e)
+        # Segnala la fine senza bloccarsi se il client è andato via
+        while not cancelled.is_set():
+            try:
+                chunks.put(done, timeout=1)
+                return
+            except queue.Full:
+                continue
+
+    producer = threading.Thread(target=produce, daemon=True)
+    producer.start()
+    try:
+        while True:
+            chunk = chunks.get()
+            if chunk is done:
+                break
+            yield chunk
+        if errors:
+            raise errors[0]
+    finally:
+        cancelled.set()
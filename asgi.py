@@ -0,0 +1,280 @@
+#!/usr/bin/env python3
+"""Variante asincrona (ASGI) del server, con le stesse route e risposte di Server.py.
+
+Le route restano quelle dell'app Flask: ogni richiesta viene eseguita in un
+executor con un numero limitato di thread, che serve solo per il lavoro su
+disco e in Python. L'attesa dei client invece non occupa thread:
+    - il corpo della richiesta viene ricevuto in modo asincrono (in memoria
+      fino a SPOOL_MEMORY, oltre in un file temporaneo) e l'app parte solo
+      quando è arrivato per intero, quindi un upload lento non blocca nulla;
+    - la risposta viene prodotta a blocchi nell'executor e ogni blocco
+      inviato con await send(): il blocco successivo si legge solo quando il
+      client ha ricevuto il precedente (backpressure).
+I file (wsgi.file_wrapper, usato da send_file e dai download con Range)
+vengono letti a blocchi di STREAM_CHUNK byte.
+
+Avvio: python serve_async.py (vedi serve_async.py, richiede uvicorn).
+"""
+import asyncio
+import io
+import os
+import sys
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+import Server
+from shaping import ShapingMiddleware, ThrottledBody
+
+# Byte del corpo di una richiesta tenuti in memoria prima di usare un file temporaneo
+SPOOL_MEMORY = 1024 * 1024
+# Byte letti dal disco per ogni blocco inviato al client
+STREAM_CHUNK = 256 * 1024
+
+# Fine del corpo della risposta
+_DONE = object()
+
+
+class FileBody:
+    """wsgi.file_wrapper: il file viene letto a blocchi nell'executor invece che iterato"""
+
+    def __init__(self, file, block_size=8192):
+        self.file = file
+        self.block_size = max(block_size, STREAM_CHUNK)
+
+    def __iter__(self):
+        while True:
+            data = self.file.read(self.block_size)
+            if not data:
+                return
+            yield data
+
+    def read_block(self):
+        return self.file.read(self.block_size) or _DONE
+
+    def close(self):
+        close = getattr(self.file, 'close', None)
+        if close is not None:
+            close()
+
+
+class RequestBody:
+    """Corpo della richiesta: in memoria fino a SPOOL_MEMORY byte, poi in un file temporaneo"""
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.size = 0
+        self._buffer = io.BytesIO()
+        self._file = None
+
+    async def write(self, run, data):
+        self.size += len(data)
+        if self._file is None and self.size <= SPOOL_MEMORY:
+            self._buffer.write(data)
+            return
+        if self._file is None:
+            self._file = await run(self._spill)
+        await run(self._file.write, data)
+
+    def _spill(self):
+        f = tempfile.TemporaryFile(dir=self.directory)
+        f.write(self._buffer.getvalue())
+        self._buffer = None
+        return f
+
+    def stream(self):
+        stream = self._file if self._file is not None else self._buffer
+        stream.seek(0)
+        return stream
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+
+
+def build_environ(scope):
+    """Environ WSGI per una richiesta HTTP ASGI"""
+    root_path = scope.get('root_path', '')
+    path = scope['path']
+    if root_path and path.startswith(root_path):
+        path = path[len(root_path):]
+    server = scope.get('server') or ('localhost', 80)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': root_path.encode('utf-8').decode('latin-1'),
+        'PATH_INFO': path.encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+        'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+        'SERVER_NAME': str(server[0]),
+        'SERVER_PORT': str(server[1]) if server[1] is not None else '80',
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input_terminated': True,
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+        'wsgi.file_wrapper': FileBody,
+    }
+    if scope.get('client'):
+        environ['REMOTE_ADDR'] = str(scope['client'][0])
+        environ['REMOTE_PORT'] = str(scope['client'][1])
+    for name, value in scope['headers']:
+        key = name.decode('latin-1').upper().replace('-', '_')
+        value = value.decode('latin-1')
+        if key == 'CONTENT_LENGTH':
+            continue
+        if key != 'CONTENT_TYPE':
+            key = 'HTTP_' + key
+        environ[key] = f"{environ[key]},{value}" if key in environ else value
+    return environ
+
+
+class AsyncFileServer:
+    """App ASGI che serve un'app WSGI senza tenere thread occupati durante l'I/O di rete"""
+
+    def __init__(self, wsgi_app, threads, spool_dir, max_content_length):
+        self.wsgi_app = wsgi_app
+        self.threads = threads
+        self.spool_dir = spool_dir
+        self.max_content_length = max_content_length
+        self.executor = None
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self._lifespan(receive, send)
+        elif scope['type'] == 'http':
+            if self.executor is None:
+                os.makedirs(self.spool_dir, exist_ok=True)
+                self.executor = ThreadPoolExecutor(self.threads, thread_name_prefix='asgi-io')
+            await self._handle(scope, receive, send)
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                if self.executor is not None:
+                    self.executor.shutdown(wait=False)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def _handle(self, scope, receive, send):
+        loop = asyncio.get_running_loop()
+
+        def run(func, *args):
+            return loop.run_in_executor(self.executor, func, *args)
+
+        declared = 0
+        for name, value in scope['headers']:
+            if name.lower() == b'content-length' and value.isdigit():
+                declared = int(value)
+
+        body = RequestBody(self.spool_dir)
+        watcher = None
+        environ = build_environ(scope)
+        # Upload con limiti di banda: si rallenta la ricezione, senza occupare thread
+        upload = None
+        if Server.bandwidth is not None and Server.is_bulk_upload(environ):
+            upload = Server.bandwidth.open(Server.bandwidth_client(environ), 'in')
+            environ[ShapingMiddleware.INPUT_SHAPED] = True
+        try:
+            # Oltre il limite non si legge altro: Flask risponde 413 dalla lunghezza
+            if declared <= self.max_content_length:
+                while True:
+                    message = await receive()
+                    if message['type'] == 'http.disconnect':
+                        return
+                    data = message.get('body', b'')
+                    await body.write(run, data)
+                    if upload is not None and data:
+                        wait = upload.charge(len(data))
+                        if wait > 0:
+                            await asyncio.sleep(wait)
+                    if body.size > self.max_content_length or not message.get('more_body'):
+                        break
+            if upload is not None:
+                upload.close()
+
+            disconnected = asyncio.Event()
+            watcher = asyncio.ensure_future(self._watch_disconnect(receive, disconnected))
+            environ['wsgi.input'] = body.stream()
+            environ['CONTENT_LENGTH'] = str(max(declared, body.size))
+            await self._respond(environ, send, run, disconnected)
+        finally:
+            if upload is not None:
+                upload.close()
+            if watcher is not None:
+                watcher.cancel()
+            body.close()
+
+    async def _watch_disconnect(self, receive, disconnected):
+        while True:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                disconnected.set()
+                return
+
+    async def _respond(self, environ, send, run, disconnected):
+        response = {}
+
+        def start_response(status, headers, exc_info=None):
+            response['status'] = int(status.split(' ', 1)[0])
+            response['headers'] = headers
+            return response.setdefault('written', []).append
+
+        def start():
+            # App e primo blocco nello stesso passaggio nell'executor
+            app_iter = self.wsgi_app(environ, start_response)
+            if isinstance(app_iter, FileBody):
+                read = app_iter.read_block
+            elif isinstance(app_iter, ThrottledBody):
+                # (blocco, attesa): l'attesa avviene nel loop, non nel thread
+                def read():
+                    return app_iter.next_block() or _DONE
+            else:
+                iterator = iter(app_iter)
+
+                def read():
+                    return next(iterator, _DONE)
+            return app_iter, read, read()
+
+        def close(app_iter):
+            close = getattr(app_iter, 'close', None)
+            if close is not None:
+                close()
+
+        try:
+            app_iter, read, chunk = await run(start)
+        except Exception:
+            # Flask gestisce gli errori delle route: qui arrivano solo quelli del server
+            await send({'type': 'http.response.start', 'status': 500,
+                        'headers': [(b'content-type', b'text/plain; charset=utf-8')]})
+            await send({'type': 'http.response.body', 'body': b'Errore interno del server'})
+            raise
+        try:
+            await send({
+                'type': 'http.response.start',
+                'status': response['status'],
+                'headers': [(name.lower().encode('latin-1'), value.encode('latin-1'))
+                            for name, value in response['headers']],
+            })
+            for data in response.get('written', ()):
+                await send({'type': 'http.response.body', 'body': data, 'more_body': True})
+            while chunk is not _DONE:
+                if disconnected.is_set():
+                    return
+                if isinstance(chunk, tuple):
+                    chunk, wait = chunk
+                    if wait > 0:
+                        await asyncio.sleep(wait)
+                if chunk:
+                    await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+                chunk = await run(read)
+            await send({'type': 'http.response.body', 'body': b'', 'more_body': False})
+        finally:
+            await run(close, app_iter)
+
+
+app = AsyncFileServer(Server.app, Server.settings['asgi_threads'], Server.data_path('spool'),
+                      Server.MAX_CONTENT_LENGTH)
@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+"""Esecuzione di più operazioni sui file in una sola richiesta"""
+from concurrent.futures import ThreadPoolExecutor
+
+
+class OperationError(Exception):
+    """Errore di una singola operazione, con il codice HTTP da restituire"""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+class Change:
+    """Esito di un'operazione applicata.
+
+    `undo` annulla l'effetto (modalità tutto-o-niente), `commit` completa
+    il lavoro rimandato quando tutte le operazioni sono riuscite.
+    """
+
+    def __init__(self, result, status=200, undo=None, commit=None):
+        self.result = result
+        self.status = status
+        self.undo = undo
+        self.commit = commit
+
+
+def target_path(op):
+    """Path su cui agisce un'operazione (per mkdir la nuova cartella)"""
+    path = str(op.get('path', '')).strip('/')
+    if op.get('name'):
+        path = f"{path}/{op['name']}" if path else str(op['name'])
+    return path
+
+
+def overlapping(paths):
+    """Indici dei path che coincidono con un altro o ne contengono un altro"""
+    by_path = {}
+    for index, path in enumerate(paths):
+        by_path.setdefault(path, []).append(index)
+    conflicts = set()
+    for path, indexes in by_path.items():
+        if len(indexes) > 1:
+            conflicts.update(indexes)
+        parts = path.split('/') if path else []
+        for depth in range(len(parts)):
+            ancestor = '/'.join(parts[:depth])
+            if ancestor in by_path:
+                conflicts.update(indexes)
+                conflicts.update(by_path[ancestor])
+    return conflicts
+
+
+def run_batch(operations, handlers, workers=8, atomic=False):
+    """Esegui le operazioni in parallelo; restituisce (risultati, completato).
+
+    `handlers` associa il nome dell'operazione a una coppia (check, apply):
+    check(op) solleva OperationError se l'operazione non è valida, apply(op,
+    atomic) la esegue e restituisce un Change. In modalità `atomic` nessuna
+    operazione viene applicata se un controllo fallisce, e quelle applicate
+    vengono annullate se un'altra fallisce.
+    """
+    results = [{'index': index, 'op': op.get('op'), 'path': op.get('path', '')}
+               for index, op in enumerate(operations)]
+
+    def fail(index, error):
+        status = error.status if isinstance(error, OperationError) else 500
+        results[index].update({'status': status, 'error': str(error)})
+
+    def check(index):
+        op = operations[index]
+        handler = handlers.get(op.get('op'))
+        if handler is None:
+            raise OperationError(f"Operazione sconosciuta: {op.get('op')}")
+        handler[0](op)
+        return handler
+
+    def execute(index):
+        try:
+            handler = check(index)
+            return handler[1](operations[index], atomic)
+        except Exception as e:
+            fail(index, e)
+            return None
+
+    if atomic:
+        conflicts = overlapping([target_path(op) for op in operations])
+        for index in range(len(operations)):
+            try:
+                if index in conflicts:
+                    raise OperationError('Operazioni in conflitto sullo stesso path', 409)
+                check(index)
+            except Exception as e:
+                fail(index, e)
+        if any('error' in result for result in results):
+            for result in results:
+                result.setdefault('status', 424)
+                result.setdefault('error', 'Non eseguita')
+            return results, False
+
+    with ThreadPoolExecutor(max_workers=max(1, min(workers, len(operations)))) as pool:
+        changes = list(pool.map(execute, range(len(operations))))
+
+    completed = all(change is not None for change in changes)
+    if atomic and not completed:
+        # Annulla in ordine inverso quanto è già stato applicato
+        for index in reversed(range(len(changes))):
+            change = changes[index]
+            if change is None:
+                continue
+            if change.undo is not None:
+                try:
+                    change.undo()
+                except Exception as e:
+                    results[index].update({'status': 500,
+                                           'error': f"Annullamento fallito: {e}"})
+                    continue
+            results[index].update({'status': 424, 'error': 'Annullata'})
+        return results, False
+
+    for index, change in enumerate(changes):
+        if change is None:
+            continue
+        results[index].update({'status': change.status, 'result': change.result})
+        if change.commit is not None:
+            try:
+                change.commit()
+            except Exception as e:
+                results[index]['warning'] = str(e)
+    return results, completed
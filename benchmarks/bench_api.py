@@ -0,0 +1,374 @@
+#!/usr/bin/env python3
+"""Benchmark riproducibile dell'API: listing, download e upload.
+
+Genera in una directory temporanea un BASE_DIR sintetico (una directory
+larga, un albero profondo, tanti file piccoli, pochi file grandi) sempre
+uguale a parità di parametri, poi esegue ogni scenario con client
+concorrenti in due modalità:
+    inprocess - Flask test client nello stesso processo (solo il codice
+                dell'app, senza rete né server HTTP)
+    socket    - serve.py (gunicorn) su una porta locale, client in processi
+                separati; senza gunicorn si usa il server di sviluppo
+Per ogni scenario riporta p50/p95/p99 della latenza, richieste/s e MB/s.
+Con --output i risultati vengono salvati in JSON; con --baseline vengono
+confrontati con un'esecuzione precedente e le regressioni oltre
+--tolerance fanno terminare lo script con codice 1.
+
+Esempio:
+    python benchmarks/bench_api.py --output base.json
+    python benchmarks/bench_api.py --baseline base.json --output new.json
+"""
+import argparse
+import http.client
+import json
+import os
+import platform
+import random
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+
+from load_test import ROOT, free_port, wait_for_port
+
+try:
+    import gunicorn
+except ImportError:  # senza gunicorn la modalità socket usa il server di sviluppo
+    gunicorn = None
+
+MODES = ('inprocess', 'socket')
+# Byte scritti per volta generando i file grandi
+WRITE_CHUNK = 1024 * 1024
+
+
+def build_tree(directory, args):
+    """BASE_DIR sintetico; a parità di argomenti il contenuto è sempre lo stesso"""
+    rng = random.Random(args.seed)
+
+    wide = os.path.join(directory, 'wide')
+    os.mkdir(wide)
+    for i in range(args.wide_files):
+        with open(os.path.join(wide, f"file_{i:06d}.txt"), 'wb') as f:
+            f.write(b'x' * rng.randrange(1, 4096))
+
+    deep = os.path.join(directory, 'deep')
+    for level in range(args.depth):
+        deep = os.path.join(deep, f"level_{level:02d}")
+        os.makedirs(deep)
+        for i in range(10):
+            with open(os.path.join(deep, f"file_{i}.txt"), 'wb') as f:
+                f.write(b'y' * 100)
+
+    small = os.path.join(directory, 'small')
+    for i in range(args.small_files):
+        folder = os.path.join(small, f"dir_{i // 1000:03d}")
+        if i % 1000 == 0:
+            os.makedirs(folder)
+        with open(os.path.join(folder, f"file_{i:06d}.bin"), 'wb') as f:
+            f.write(rng.randbytes(rng.randrange(1, args.small_size + 1)))
+
+    huge = os.path.join(directory, 'huge')
+    os.mkdir(huge)
+    for i in range(args.huge_files):
+        with open(os.path.join(huge, f"blob_{i}.bin"), 'wb') as f:
+            remaining = args.huge_size
+            while remaining > 0:
+                f.write(rng.randbytes(min(WRITE_CHUNK, remaining)))
+                remaining -= WRITE_CHUNK
+
+    os.mkdir(os.path.join(directory, 'uploads'))
+    # Directory già "vecchie": il listing può usare la cache da subito
+    past = time.time() - 10
+    for root, dirs, _ in os.walk(directory):
+        for name in dirs:
+            os.utime(os.path.join(root, name), (past, past))
+    return os.path.relpath(deep, directory)
+
+
+def multipart(name, content):
+    """Corpo multipart/form-data per POST /upload"""
+    boundary = uuid.uuid4().hex
+    body = (f"--{boundary}\r\n"
+            f'Content-Disposition: form-data; name="path"\r\n\r\nuploads\r\n'
+            f"--{boundary}\r\n"
+            f'Content-Disposition: form-data; name="file"; filename="{name}"\r\n'
+            f"Content-Type: application/octet-stream\r\n\r\n").encode() + content + \
+        f"\r\n--{boundary}--\r\n".encode()
+    return body, {'Content-Type': f"multipart/form-data; boundary={boundary}"}
+
+
+def scenarios(deep_path, args):
+    """Scenari: nome -> funzione che dato un numero progressivo restituisce la richiesta.
+
+    Una richiesta è (metodo, path, corpo, header, stato atteso).
+    """
+    small_count = args.small_files
+    upload_small = os.urandom(4096)
+    upload_large = os.urandom(args.upload_size)
+
+    def small_file(i):
+        index = (i * 7919) % small_count
+        return f"/download/small/dir_{index // 1000:03d}/file_{index:06d}.bin"
+
+    def upload(content, prefix):
+        def make(i):
+            body, headers = multipart(f"{prefix}_{uuid.uuid4().hex}.bin", content)
+            return 'POST', '/upload', body, headers, 200
+        return make
+
+    return {
+        'list_wide': lambda i: ('GET', '/files/wide', None, {}, 200),
+        'list_wide_page': lambda i: ('GET', '/files/wide?limit=500', None, {}, 200),
+        'list_deep': lambda i: ('GET', f"/files/{deep_path}", None, {}, 200),
+        'download_small': lambda i: ('GET', small_file(i), None, {}, 200),
+        'download_huge': lambda i: ('GET', f"/download/huge/blob_{i % args.huge_files}.bin",
+                                    None, {}, 200),
+        'download_range': lambda i: ('GET', f"/download/huge/blob_{i % args.huge_files}.bin",
+                                     None, {'Range': f"bytes={i * 65536 % args.huge_size}-"
+                                                     f"{i * 65536 % args.huge_size + 65535}"},
+                                     206),
+        'upload_small': upload(upload_small, 'small'),
+        'upload_large': upload(upload_large, 'large'),
+    }
+
+
+def request_count(name, args):
+    # I trasferimenti grandi durano di più: meno ripetizioni
+    if name in ('download_huge', 'upload_large'):
+        return max(args.clients, args.requests // 20)
+    return args.requests
+
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    index = min(len(values) - 1, max(0, int(round(fraction * len(values))) - 1))
+    return values[index]
+
+
+def summarize(latencies, received, sent, elapsed):
+    latencies = sorted(latencies)
+    return {
+        'requests': len(latencies),
+        'rps': len(latencies) / elapsed,
+        'mbps': (received + sent) / elapsed / (1024 * 1024),
+        'p50_ms': percentile(latencies, 0.50) * 1000,
+        'p95_ms': percentile(latencies, 0.95) * 1000,
+        'p99_ms': percentile(latencies, 0.99) * 1000,
+    }
+
+
+def run_inprocess(app, make_request, count, clients):
+    """Client in thread con il test client di Flask"""
+    latencies = []
+    totals = {'received': 0, 'sent': 0}
+    lock = threading.Lock()
+    counter = iter(range(count))
+
+    def worker():
+        client = app.test_client()
+        local, received, sent = [], 0, 0
+        while True:
+            with lock:
+                i = next(counter, None)
+            if i is None:
+                break
+            method, path, body, headers, expected = make_request(i)
+            start = time.perf_counter()
+            response = client.open(path, method=method, data=body, headers=headers)
+            data = response.get_data()
+            response.close()
+            local.append(time.perf_counter() - start)
+            if response.status_code != expected:
+                raise RuntimeError(f"{method} {path}: HTTP {response.status_code}")
+            received += len(data)
+            sent += len(body or b'')
+        with lock:
+            latencies.extend(local)
+            totals['received'] += received
+            totals['sent'] += sent
+
+    threads = [threading.Thread(target=worker) for _ in range(clients)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return summarize(latencies, totals['received'], totals['sent'], time.perf_counter() - start)
+
+
+def socket_client(port, requests):
+    """Un client con connessione keep-alive: restituisce (latenze, byte ricevuti, byte inviati)"""
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=120)
+    latencies = []
+    received = sent = 0
+    for method, path, body, headers, expected in requests:
+        start = time.perf_counter()
+        conn.request(method, path, body=body, headers=headers)
+        response = conn.getresponse()
+        while True:
+            data = response.read(WRITE_CHUNK)
+            if not data:
+                break
+            received += len(data)
+        latencies.append(time.perf_counter() - start)
+        if response.status != expected:
+            raise RuntimeError(f"{method} {path}: HTTP {response.status}")
+        sent += len(body or b'')
+    conn.close()
+    return latencies, received, sent
+
+
+def run_socket(pool, port, make_request, count, clients):
+    """Client in processi separati, ognuno con la sua parte delle richieste"""
+    requests = [make_request(i) for i in range(count)]
+    shares = [requests[k::clients] for k in range(clients)]
+    start = time.perf_counter()
+    results = list(pool.map(socket_client, [port] * clients, shares))
+    elapsed = time.perf_counter() - start
+    latencies = [latency for result in results for latency in result[0]]
+    return summarize(latencies, sum(r[1] for r in results), sum(r[2] for r in results), elapsed)
+
+
+def start_server(base_dir, args):
+    port = free_port()
+    env = dict(os.environ, FILESERVER_BASE_DIR=base_dir, FILESERVER_INDEX_RECONCILE_INTERVAL='0',
+               FILESERVER_HOST='127.0.0.1', FILESERVER_PORT=str(port))
+    if gunicorn is not None:
+        command = [sys.executable, os.path.join(ROOT, 'serve.py'),
+                   '--bind', f"127.0.0.1:{port}", '--workers', str(args.workers),
+                   '--threads', str(args.threads)]
+    else:
+        command = [sys.executable, os.path.join(ROOT, 'Server.py')]
+    server = subprocess.Popen(command, cwd=ROOT, env=env,
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    wait_for_port(port)
+    return server, port
+
+
+def run_mode(mode, base_dir, selected, args):
+    results = {}
+    if mode == 'inprocess':
+        # Server.py legge la configurazione all'import
+        os.environ['FILESERVER_BASE_DIR'] = base_dir
+        os.environ['FILESERVER_INDEX_RECONCILE_INTERVAL'] = '0'
+        sys.path.insert(0, ROOT)
+        from Server import app
+        for name, make_request in selected.items():
+            count = request_count(name, args)
+            run_inprocess(app, make_request, min(count, args.clients * 2), args.clients)
+            results[name] = run_inprocess(app, make_request, count, args.clients)
+            report(mode, name, results[name])
+        return results
+
+    server, port = start_server(base_dir, args)
+    try:
+        with ProcessPoolExecutor(max_workers=args.clients) as pool:
+            for name, make_request in selected.items():
+                count = request_count(name, args)
+                run_socket(pool, port, make_request, min(count, args.clients * 2), args.clients)
+                results[name] = run_socket(pool, port, make_request, count, args.clients)
+                report(mode, name, results[name])
+    finally:
+        server.send_signal(signal.SIGTERM)
+        server.wait(timeout=30)
+    return results
+
+
+def report(mode, name, result):
+    print(f"{mode:<10} {name:<16} {result['requests']:>8} {result['rps']:>10.1f} "
+          f"{result['mbps']:>9.1f} {result['p50_ms']:>9.2f} {result['p95_ms']:>9.2f} "
+          f"{result['p99_ms']:>9.2f}", flush=True)
+
+
+def compare(results, baseline, tolerance):
+    """Regressioni rispetto al baseline: richieste/s più basse o p95 più alto oltre la tolleranza"""
+    regressions = []
+    for mode, scenarios_results in results.items():
+        for name, result in scenarios_results.items():
+            previous = baseline.get(mode, {}).get(name)
+            if previous is None:
+                continue
+            if result['rps'] < previous['rps'] * (1 - tolerance):
+                regressions.append(f"{mode}/{name}: req/s {previous['rps']:.1f} -> {result['rps']:.1f}")
+            if result['p95_ms'] > previous['p95_ms'] * (1 + tolerance):
+                regressions.append(f"{mode}/{name}: p95 {previous['p95_ms']:.2f} ms "
+                                   f"-> {result['p95_ms']:.2f} ms")
+    return regressions
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--modes', default=','.join(MODES), help='modalità da eseguire')
+    parser.add_argument('--scenarios', help='scenari da eseguire, separati da virgola (predefinito: tutti)')
+    parser.add_argument('--clients', type=int, default=8, help='client concorrenti')
+    parser.add_argument('--requests', type=int, default=400, help='richieste per scenario')
+    parser.add_argument('--workers', type=int, default=2, help='processi worker (modalità socket)')
+    parser.add_argument('--threads', type=int, default=4, help='thread per worker (modalità socket)')
+    parser.add_argument('--seed', type=int, default=1, help='seme per il contenuto dei file')
+    parser.add_argument('--wide-files', type=int, default=10000, help='file nella directory larga')
+    parser.add_argument('--depth', type=int, default=30, help='livelli dell\'albero profondo')
+    parser.add_argument('--small-files', type=int, default=20000, help='numero di file piccoli')
+    parser.add_argument('--small-size', type=int, default=16 * 1024, help='byte massimi di un file piccolo')
+    parser.add_argument('--huge-files', type=int, default=2, help='numero di file grandi')
+    parser.add_argument('--huge-size', type=int, default=256 * 1024 * 1024, help='byte di un file grande')
+    parser.add_argument('--upload-size', type=int, default=8 * 1024 * 1024, help='byte di un upload grande')
+    parser.add_argument('--output', help='file JSON in cui salvare i risultati')
+    parser.add_argument('--baseline', help='risultati JSON di riferimento con cui confrontare')
+    parser.add_argument('--tolerance', type=float, default=0.15,
+                        help='peggioramento relativo tollerato rispetto al baseline')
+    args = parser.parse_args()
+
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        start = time.perf_counter()
+        deep_path = build_tree(tmp, args)
+        print(f"Albero generato in {time.perf_counter() - start:.1f}s in {tmp}")
+        available = scenarios(deep_path, args)
+        names = args.scenarios.split(',') if args.scenarios else list(available)
+        selected = {name: available[name] for name in names}
+
+        print(f"{'modalità':<10} {'scenario':<16} {'richieste':>8} {'req/s':>10} {'MB/s':>9} "
+              f"{'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+        for mode in args.modes.split(','):
+            results[mode] = run_mode(mode, tmp, selected, args)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({
+                'revision': git_revision(),
+                'python': platform.python_version(),
+                'platform': platform.platform(),
+                'cpus': os.cpu_count(),
+                'server': 'gunicorn' if gunicorn is not None else 'werkzeug',
+                'args': vars(args),
+                'results': results,
+            }, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline['results'], args.tolerance)
+        if regressions:
+            print(f"Regressioni rispetto a {args.baseline} (revisione {baseline.get('revision')}):")
+            for regression in regressions:
+                print(f"  {regression}")
+            sys.exit(1)
+        print(f"Nessuna regressione rispetto a {args.baseline}")
+
+
+if __name__ == '__main__':
+    main()
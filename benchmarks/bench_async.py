@@ -0,0 +1,221 @@
+#!/usr/bin/env python3
+"""Confronto tra la versione WSGI (serve.py) e quella asincrona (serve_async.py).
+
+Per ogni server misura:
+    1. richieste/s e latenze di listing e download con client veloci;
+    2. le stesse latenze del listing mentre --slow client lenti tengono
+       aperta una connessione ciascuno: metà scaricano un file grande
+       leggendo pochi byte al secondo, metà caricano un file inviandone
+       pochi byte al secondo. Con WSGI ogni client lento occupa un thread
+       del worker; con ASGI solo una connessione.
+Le richieste veloci che non ricevono risposta entro --timeout contano come
+errori. Con molti client lenti può servire alzare il limite dei file aperti
+(ulimit -n). Servono gunicorn e uvicorn; senza gunicorn la versione WSGI
+usa il server di sviluppo.
+"""
+import argparse
+import http.client
+import os
+import resource
+import selectors
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from bench_api import percentile
+from load_test import ROOT, build_tree, free_port, wait_for_port
+
+try:
+    import gunicorn
+except ImportError:
+    gunicorn = None
+
+try:
+    import uvicorn
+except ImportError:
+    uvicorn = None
+
+# Byte letti o inviati da un client lento a ogni passo
+SLOW_STEP = 1024
+
+
+def start_server(kind, base_dir, args):
+    port = free_port()
+    env = dict(os.environ, FILESERVER_BASE_DIR=base_dir, FILESERVER_INDEX_RECONCILE_INTERVAL='0',
+               FILESERVER_HOST='127.0.0.1', FILESERVER_PORT=str(port))
+    if kind == 'asgi':
+        command = [sys.executable, os.path.join(ROOT, 'serve_async.py'),
+                   '--workers', str(args.workers), '--threads', str(args.threads)]
+    elif gunicorn is not None:
+        command = [sys.executable, os.path.join(ROOT, 'serve.py'),
+                   '--bind', f"127.0.0.1:{port}", '--workers', str(args.workers),
+                   '--threads', str(args.threads)]
+    else:
+        command = [sys.executable, os.path.join(ROOT, 'Server.py')]
+    server = subprocess.Popen(command, cwd=ROOT, env=env,
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    wait_for_port(port)
+    return server, port
+
+
+def fast_client(port, path, count, timeout):
+    """Richieste in sequenza su una connessione keep-alive: (latenze, byte, errori)"""
+    latencies = []
+    received = errors = 0
+    conn = None
+    for _ in range(count):
+        if conn is None:
+            conn = http.client.HTTPConnection('127.0.0.1', port, timeout=timeout)
+        start = time.perf_counter()
+        try:
+            conn.request('GET', path)
+            response = conn.getresponse()
+            received += len(response.read())
+            if response.status != 200:
+                raise RuntimeError(f"HTTP {response.status}")
+        except (OSError, http.client.HTTPException, RuntimeError):
+            errors += 1
+            conn.close()
+            conn = None
+            continue
+        latencies.append(time.perf_counter() - start)
+    if conn is not None:
+        conn.close()
+    return latencies, received, errors
+
+
+def measure(pool, port, path, args):
+    clients = args.clients
+    start = time.perf_counter()
+    results = list(pool.map(fast_client, [port] * clients, [path] * clients,
+                            [args.requests // clients] * clients, [args.timeout] * clients))
+    elapsed = time.perf_counter() - start
+    latencies = sorted(latency for result in results for latency in result[0])
+    return {
+        'rps': len(latencies) / elapsed,
+        'mbps': sum(result[1] for result in results) / elapsed / (1024 * 1024),
+        'p50_ms': percentile(latencies, 0.50) * 1000,
+        'p99_ms': percentile(latencies, 0.99) * 1000,
+        'errors': sum(result[2] for result in results),
+    }
+
+
+class SlowClients:
+    """Connessioni lente gestite da un solo thread con un selettore"""
+
+    def __init__(self, port, count, file_size, interval):
+        self.port = port
+        self.count = count
+        self.file_size = file_size
+        self.interval = interval
+        self.connected = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        selector = selectors.DefaultSelector()
+        uploads = []
+        for i in range(self.count):
+            try:
+                sock = socket.create_connection(('127.0.0.1', self.port), timeout=5)
+            except OSError:
+                continue
+            sock.setblocking(False)
+            self.connected += 1
+            if i % 2 == 0:
+                sock.send(b"GET /download/blob.bin HTTP/1.1\r\nHost: localhost\r\n\r\n")
+                selector.register(sock, selectors.EVENT_READ)
+            else:
+                boundary = 'slowclient'
+                sock.send((f"POST /upload HTTP/1.1\r\nHost: localhost\r\n"
+                           f"Content-Type: multipart/form-data; boundary={boundary}\r\n"
+                           f"Content-Length: {self.file_size}\r\n\r\n"
+                           f"--{boundary}\r\nContent-Disposition: form-data; name=\"file\"; "
+                           f"filename=\"slow_{i}.bin\"\r\n\r\n").encode())
+                uploads.append(sock)
+        while not self._stop.is_set():
+            # Pochi byte per connessione a ogni intervallo: il server deve aspettare
+            for key, _ in selector.select(timeout=0):
+                try:
+                    key.fileobj.recv(SLOW_STEP)
+                except OSError:
+                    pass
+            for sock in uploads:
+                try:
+                    sock.send(b'x' * SLOW_STEP)
+                except OSError:
+                    pass
+            self._stop.wait(self.interval)
+        for key in list(selector.get_map().values()):
+            key.fileobj.close()
+        for sock in uploads:
+            sock.close()
+
+
+def raise_file_limit():
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft < hard:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--servers', default='wsgi,asgi', help='server da confrontare')
+    parser.add_argument('--workers', type=int, default=1, help='processi worker')
+    parser.add_argument('--threads', type=int, default=8, help='thread per worker')
+    parser.add_argument('--clients', type=int, default=8, help='client veloci concorrenti')
+    parser.add_argument('--requests', type=int, default=800, help='richieste veloci per misura')
+    parser.add_argument('--slow', type=int, default=1000, help='client lenti')
+    parser.add_argument('--slow-interval', type=float, default=1.0,
+                        help='secondi tra due passi di un client lento')
+    parser.add_argument('--timeout', type=float, default=10, help='attesa massima di una richiesta veloce')
+    parser.add_argument('--files', type=int, default=2000, help='file nella directory del listing')
+    parser.add_argument('--file-size', type=int, default=64 * 1024 * 1024, help='byte del file grande')
+    args = parser.parse_args()
+    raise_file_limit()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        build_tree(tmp, args.files, args.file_size)
+        print(f"{'server':<6} {'carico':<14} {'endpoint':<12} {'req/s':>9} {'MB/s':>8} "
+              f"{'p50 ms':>9} {'p99 ms':>9} {'errori':>7}")
+        with ProcessPoolExecutor(max_workers=args.clients) as pool:
+            for kind in args.servers.split(','):
+                if kind == 'asgi' and uvicorn is None:
+                    print("asgi: uvicorn non installato, saltato")
+                    continue
+                server, port = start_server(kind, tmp, args)
+                try:
+                    for label, path in (('listing', '/files/wide'), ('download', '/download/blob.bin')):
+                        result = measure(pool, port, path, args)
+                        print(f"{kind:<6} {'nessuno':<14} {label:<12} {result['rps']:>9.1f} "
+                              f"{result['mbps']:>8.1f} {result['p50_ms']:>9.2f} "
+                              f"{result['p99_ms']:>9.2f} {result['errors']:>7}", flush=True)
+
+                    slow = SlowClients(port, args.slow, args.file_size, args.slow_interval)
+                    slow.start()
+                    time.sleep(max(2.0, args.slow_interval * 2))
+                    result = measure(pool, port, '/files/wide', args)
+                    slow.stop()
+                    print(f"{kind:<6} {f'{slow.connected} lenti':<14} {'listing':<12} "
+                          f"{result['rps']:>9.1f} {result['mbps']:>8.1f} {result['p50_ms']:>9.2f} "
+                          f"{result['p99_ms']:>9.2f} {result['errors']:>7}", flush=True)
+                finally:
+                    server.send_signal(signal.SIGTERM)
+                    server.wait(timeout=30)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+"""Benchmark della compressione: rapporto, CPU e tempo totale su un link lento.
+
+Misura per ogni codec disponibile il rapporto di compressione e la velocità
+di compressione di un log testuale e di un listing JSON, poi il download via
+Flask con cache fredda (compressione in streaming) e calda (variante già su
+disco). Il tempo sul link è stimato come byte trasferiti / banda.
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from compression import (CACHE_LEVELS, LIVE_LEVELS, available_codecs,  # noqa: E402
+                         compress_bytes)
+
+
+def sample_log(size):
+    """Log sintetico con la ripetitività tipica dei log applicativi"""
+    lines = []
+    total = i = 0
+    while total < size:
+        line = (f"2026-01-01 12:{i // 60 % 60:02d}:{i % 60:02d} INFO worker-{i % 8} "
+                f"GET /files/dir_{i % 300}/file_{i}.txt 200 {i % 997} ms\n")
+        lines.append(line)
+        total += len(line)
+        i += 1
+    return ''.join(lines).encode()[:size]
+
+
+def sample_listing(items):
+    return json.dumps({'items': [{
+        'name': f"file_{i:06d}.txt",
+        'path': f"/home/mottu/file/dir/file_{i:06d}.txt",
+        'is_directory': False,
+        'size': i * 37,
+        'modified': '2026-01-01T12:00:00.000000',
+        'permissions': '644',
+        'relative_path': f"dir/file_{i:06d}.txt",
+    } for i in range(items)]}).encode()
+
+
+def measure(data, codec, level, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        compressed = compress_bytes(data, codec, level)
+        best = min(best, time.perf_counter() - start)
+    return len(compressed), best
+
+
+def link_seconds(nbytes, mbit):
+    return nbytes * 8 / (mbit * 1_000_000)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--size', type=int, default=32 * 1024 * 1024, help='byte del log')
+    parser.add_argument('--items', type=int, default=5000, help='elementi del listing JSON')
+    parser.add_argument('--link', type=float, default=10, help='banda del link in Mbit/s')
+    parser.add_argument('--repeat', type=int, default=3, help='ripetizioni per misura')
+    args = parser.parse_args()
+
+    log = sample_log(args.size)
+    listing = sample_listing(args.items)
+    print(f"{'dati':<10} {'codec':<8} {'livello':>7} {'ratio':>7} {'MB/s':>9} "
+          f"{'CPU ms':>9} {'link s':>8}")
+    for label, data, levels in (('listing', listing, LIVE_LEVELS), ('log', log, CACHE_LEVELS)):
+        print(f"{label:<10} {'identity':<8} {'-':>7} {1:>7.2f} {'-':>9} {0:>9.1f} "
+              f"{link_seconds(len(data), args.link):>8.2f}")
+        for codec in available_codecs():
+            size, seconds = measure(data, codec, levels[codec], args.repeat)
+            print(f"{label:<10} {codec:<8} {levels[codec]:>7} {len(data) / size:>7.2f} "
+                  f"{len(data) / seconds / 1024 / 1024:>9.1f} {seconds * 1000:>9.1f} "
+                  f"{link_seconds(size, args.link):>8.2f}")
+
+    # Download end-to-end: prima richiesta (compressione) e successive (cache)
+    with tempfile.TemporaryDirectory() as tmp:
+        with open(os.path.join(tmp, 'app.log'), 'wb') as f:
+            f.write(log)
+        os.environ['FILESERVER_BASE_DIR'] = tmp
+        os.environ['FILESERVER_INDEX_RECONCILE_INTERVAL'] = '0'
+        os.environ['FILESERVER_DOWNLOAD_BACKEND'] = 'python'
+        import Server
+        client = Server.app.test_client()
+
+        print()
+        print(f"{'download':<10} {'codec':<8} {'cache':<6} {'server ms':>10} {'byte':>12} "
+              f"{'totale s':>9}")
+        for codec in ['identity'] + available_codecs():
+            for cache in ('fredda', 'calda'):
+                start = time.perf_counter()
+                response = client.get('/download/app.log', headers={'Accept-Encoding': codec})
+                body = response.get_data()
+                seconds = time.perf_counter() - start
+                total = seconds + link_seconds(len(body), args.link)
+                print(f"{'app.log':<10} {codec:<8} {cache:<6} {seconds * 1000:>10.1f} "
+                      f"{len(body):>12} {total:>9.2f}")
+
+
+if __name__ == '__main__':
+    main()
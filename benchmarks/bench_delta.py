@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+"""Byte inviati dall'upload delta rispetto all'upload completo.
+
+Per ogni modifica tipica di un file già presente sul server (blocco
+sovrascritto, byte inseriti o rimossi, dati aggiunti in coda, file
+accorciato) aggiorna il file con DeltaUpload del client e riporta i byte
+inviati, la quota rispetto alla dimensione del file, i byte riutilizzati
+dalla versione sul server e il tempo (firma compresa). Alla fine di ogni
+caso il file sul server deve essere identico a quello locale.
+"""
+import argparse
+import hashlib
+import os
+import random
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+
+from load_test import ROOT, free_port, wait_for_port
+
+sys.path.insert(0, os.path.join(ROOT, 'filemanager_app'))
+
+from delta import DeltaUpload  # noqa: E402
+
+
+def edit(data, rng):
+    offset = len(data) // 2
+    return data[:offset] + rng.randbytes(4096) + data[offset + 4096:]
+
+
+def insert(data, rng):
+    offset = len(data) // 3
+    return data[:offset] + rng.randbytes(100) + data[offset:]
+
+
+def delete(data, rng):
+    offset = len(data) // 3
+    return data[:offset] + data[offset + 10 * 1024:]
+
+
+def append(data, rng):
+    return data + rng.randbytes(1024 * 1024)
+
+
+def truncate(data, rng):
+    return data[:len(data) - len(data) // 10]
+
+
+SCENARIOS = {'edit': edit, 'insert': insert, 'delete': delete, 'append': append,
+             'truncate': truncate}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--size', type=int, default=64 * 1024 * 1024, help='byte del file')
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS), help='modifiche da provare')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+    rng = random.Random(args.seed)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        base_dir = os.path.join(tmp, 'server')
+        local_dir = os.path.join(tmp, 'local')
+        os.mkdir(base_dir)
+        os.mkdir(local_dir)
+        port = free_port()
+        env = dict(os.environ, FILESERVER_BASE_DIR=base_dir, FILESERVER_INDEX_RECONCILE_INTERVAL='0',
+                   FILESERVER_HOST='127.0.0.1', FILESERVER_PORT=str(port))
+        server = subprocess.Popen([sys.executable, os.path.join(ROOT, 'Server.py')], cwd=ROOT,
+                                  env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            wait_for_port(port)
+            original = rng.randbytes(args.size)
+            print(f"{'modifica':<10} {'MB file':>8} {'KB inviati':>11} {'% file':>7} "
+                  f"{'MB copiati':>11} {'secondi':>8}")
+            for name in args.scenarios.split(','):
+                with open(os.path.join(base_dir, 'data.bin'), 'wb') as f:
+                    f.write(original)
+                modified = SCENARIOS[name](original, rng)
+                local_path = os.path.join(local_dir, 'data.bin')
+                with open(local_path, 'wb') as f:
+                    f.write(modified)
+
+                upload = DeltaUpload(f"http://127.0.0.1:{port}", local_path, '')
+                start = time.perf_counter()
+                result = upload.run()
+                elapsed = time.perf_counter() - start
+                if result is None:
+                    print(f"{name:<10} delta non conveniente: servirebbe l'upload completo")
+                    continue
+                with open(os.path.join(base_dir, 'data.bin'), 'rb') as f:
+                    if hashlib.sha256(f.read()).digest() != hashlib.sha256(modified).digest():
+                        sys.exit(f"{name}: file sul server diverso da quello locale")
+                print(f"{name:<10} {len(modified) / 1024 / 1024:>8.1f} {upload.sent / 1024:>11.1f} "
+                      f"{upload.sent / len(modified) * 100:>6.2f}% "
+                      f"{upload.copied / 1024 / 1024:>11.1f} {elapsed:>8.2f}", flush=True)
+        finally:
+            server.send_signal(signal.SIGTERM)
+            server.wait(timeout=30)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+"""Benchmark dei backend di download: python, sendfile, x-sendfile, x-accel-redirect.
+
+Avvia serve.py con ciascun backend e misura richieste/s e MB/s su un file
+grande. Per le modalità con proxy non c'è un proxy davanti: il benchmark
+usa HEAD e misura solo il lavoro del worker Flask, cioè il tempo che il
+worker resta occupato per ogni download mentre i byte li invia il proxy.
+"""
+import argparse
+import os
+import signal
+import subprocess
+import sys
+import tempfile
+
+from load_test import ROOT, free_port, run_load, wait_for_port
+
+BACKENDS = ('python', 'sendfile', 'x-sendfile', 'x-accel-redirect')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--backends', default=','.join(BACKENDS), help='backend da provare')
+    parser.add_argument('--workers', type=int, default=2, help='processi worker')
+    parser.add_argument('--threads', type=int, default=4, help='thread per worker')
+    parser.add_argument('--clients', type=int, default=8, help='client concorrenti')
+    parser.add_argument('--duration', type=float, default=5, help='secondi per misura')
+    parser.add_argument('--file-size', type=int, default=64 * 1024 * 1024, help='byte del file')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        with open(os.path.join(tmp, 'blob.bin'), 'wb') as f:
+            f.write(os.urandom(args.file_size))
+
+        print(f"{'backend':<18} {'req/s':>10} {'MB/s':>10}")
+        for backend in args.backends.split(','):
+            port = free_port()
+            env = dict(os.environ, FILESERVER_BASE_DIR=tmp, FILESERVER_DOWNLOAD_BACKEND=backend)
+            server = subprocess.Popen(
+                [sys.executable, os.path.join(ROOT, 'serve.py'),
+                 '--bind', f"127.0.0.1:{port}", '--workers', str(args.workers),
+                 '--threads', str(args.threads)],
+                cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            try:
+                wait_for_port(port)
+                method = 'HEAD' if backend in ('x-sendfile', 'x-accel-redirect') else 'GET'
+                rps, mbps = run_load(port, '/download/blob.bin', args.clients,
+                                     args.duration, method)
+                print(f"{backend:<18} {rps:>10.1f} {mbps:>10.1f}")
+            finally:
+                server.send_signal(signal.SIGTERM)
+                server.wait(timeout=30)
+
+
+if __name__ == '__main__':
+    main()
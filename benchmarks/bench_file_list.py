@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+"""Benchmark della lista file del client Kivy: tempo di costruzione, frame e memoria.
+
+Per 1k/10k/100k elementi confronta la lista virtualizzata (FileListView,
+solo le righe visibili esistono come widget) con la costruzione di una riga
+per elemento in un BoxLayout, come faceva la lista prima della
+RecycleView. Per ogni caso misura il tempo per mostrare la lista (in una
+volta e a pagine da LISTING_PAGE_SIZE), la durata media e il 95° percentile
+dei frame durante uno scorrimento completo, e la memoria residente in più.
+Richiede Kivy e una finestra (su Linux senza display: xvfb-run).
+"""
+import argparse
+import gc
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'filemanager_app'))
+
+os.environ.setdefault('KIVY_NO_ARGS', '1')
+
+from kivy.clock import Clock  # noqa: E402
+from kivy.uix.boxlayout import BoxLayout  # noqa: E402
+from kivy.uix.scrollview import ScrollView  # noqa: E402
+
+from main import LISTING_PAGE_SIZE, FileItem, FileListView, FileManagerApp  # noqa: E402
+
+# Frame usati per scorrere la lista dall'inizio alla fine
+SCROLL_FRAMES = 120
+# Frame di attesa dopo la costruzione, prima di misurare
+SETTLE_FRAMES = 10
+
+
+def rss_mb():
+    """Memoria residente del processo in MB"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 1024 / 1024
+    except OSError:
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def sample_items(count):
+    directories = count // 20
+    return [{
+        'name': f"dir_{i:06d}" if i < directories else f"file_{i:06d}.txt",
+        'path': f"/data/file_{i:06d}",
+        'is_directory': i < directories,
+        'size': 0 if i < directories else i * 37,
+        'modified': '2026-01-01T12:00:00',
+        'permissions': '755' if i < directories else '644',
+        'relative_path': f"bench/file_{i:06d}",
+    } for i in range(count)]
+
+
+def build_virtual(container, items, paged):
+    view = FileListView()
+    container.add_widget(view)
+    if paged:
+        for start in range(0, len(items), LISTING_PAGE_SIZE):
+            view.data.extend({'file_info': item}
+                             for item in items[start:start + LISTING_PAGE_SIZE])
+    else:
+        view.data = [{'file_info': item} for item in items]
+    return view
+
+
+def build_eager(container, items, paged):
+    # Una riga per elemento, come la lista prima della virtualizzazione
+    layout = BoxLayout(orientation='vertical', size_hint_y=None)
+    layout.bind(minimum_height=layout.setter('height'))
+    scroll = ScrollView()
+    scroll.add_widget(layout)
+    container.add_widget(scroll)
+    for index, item in enumerate(items):
+        row = FileItem(size_hint_y=None, height='48dp')
+        row.refresh_view_attrs(None, index, {'file_info': item})
+        layout.add_widget(row)
+    return scroll
+
+
+class BenchApp(FileManagerApp):
+    """App che esegue i casi del benchmark uno dopo l'altro e stampa i risultati"""
+
+    def __init__(self, cases, **kwargs):
+        super().__init__(**kwargs)
+        self.cases = list(cases)
+        self.results = []
+
+    def build(self):
+        self.container = BoxLayout()
+        Clock.schedule_once(self.next_case, 0.5)
+        return self.container
+
+    def next_case(self, dt):
+        if not self.cases:
+            self.stop()
+            return
+        mode, count, paged = self.cases.pop(0)
+        self.container.clear_widgets()
+        gc.collect()
+        items = sample_items(count)
+        memory_before = rss_mb()
+
+        start = time.perf_counter()
+        builder = build_virtual if mode == 'virtual' else build_eager
+        view = builder(self.container, items, paged)
+        state = {'frame': 0, 'frames': [], 'last': None, 'first_frame': None}
+
+        def step(dt):
+            now = time.perf_counter()
+            if state['first_frame'] is None:
+                # Il primo frame include il layout delle righe create
+                state['first_frame'] = now - start
+            frame = state['frame']
+            state['frame'] += 1
+            if frame < SETTLE_FRAMES:
+                state['last'] = now
+                return True
+            state['frames'].append(now - state['last'])
+            state['last'] = now
+            scrolled = frame - SETTLE_FRAMES + 1
+            if scrolled <= SCROLL_FRAMES:
+                view.scroll_y = max(0, 1 - scrolled / SCROLL_FRAMES)
+                return True
+            frames = sorted(state['frames'])
+            self.results.append((mode, count, 'pagine' if paged else 'intera',
+                                 state['first_frame'] * 1000,
+                                 sum(frames) / len(frames) * 1000,
+                                 frames[int(len(frames) * 0.95) - 1] * 1000,
+                                 rss_mb() - memory_before))
+            Clock.schedule_once(self.next_case, 0.2)
+            return False
+
+        Clock.schedule_interval(step, 0)
+
+    def on_stop(self):
+        super().on_stop()
+        print(f"{'lista':<8} {'elementi':>9} {'caricamento':<11} {'primo frame ms':>15} "
+              f"{'frame ms':>9} {'p95 ms':>8} {'RSS MB':>8}")
+        for mode, count, loading, first, mean, p95, memory in self.results:
+            print(f"{mode:<8} {count:>9} {loading:<11} {first:>15.1f} {mean:>9.2f} "
+                  f"{p95:>8.2f} {memory:>8.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--sizes', default='1000,10000,100000',
+                        help='numero di elementi da provare, separati da virgola')
+    parser.add_argument('--eager-max', type=int, default=10000,
+                        help='dimensione massima provata con una riga per elemento')
+    args = parser.parse_args()
+
+    cases = []
+    for count in (int(size) for size in args.sizes.split(',')):
+        cases.append(('virtual', count, False))
+        cases.append(('virtual', count, True))
+        if count <= args.eager_max:
+            cases.append(('eager', count, False))
+    BenchApp(cases).run()
+
+
+if __name__ == '__main__':
+    main()
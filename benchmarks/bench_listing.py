@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+"""Benchmark del listing: os.listdir + stat contro scandir con cache fredda e calda"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from listing import DirectoryCache, scan_directory  # noqa: E402
+
+
+def legacy_listing(directory):
+    """Listing come nella versione originale di list_files"""
+    from datetime import datetime
+    items = []
+    for item in os.listdir(directory):
+        item_path = os.path.join(directory, item)
+        stat_result = os.stat(item_path)
+        items.append({
+            'name': item,
+            'path': item_path,
+            'is_directory': os.path.isdir(item_path),
+            'size': stat_result.st_size if not os.path.isdir(item_path) else 0,
+            'modified': datetime.fromtimestamp(stat_result.st_mtime).isoformat(),
+            'permissions': oct(stat_result.st_mode)[-3:],
+            'relative_path': os.path.relpath(item_path, directory),
+        })
+    items.sort(key=lambda x: (not x['is_directory'], x['name'].lower()))
+    return items
+
+
+def build_tree(directory, files, dirs):
+    """Crea un albero sintetico con molti file vuoti e qualche sottodirectory"""
+    for i in range(dirs):
+        os.mkdir(os.path.join(directory, f"dir_{i:06d}"))
+    for i in range(files):
+        with open(os.path.join(directory, f"file_{i:07d}.dat"), 'wb'):
+            pass
+    # Porta l'mtime fuori dalla finestra "racy" della cache
+    past = time.time() - 10
+    os.utime(directory, (past, past))
+
+
+def timed(label, func, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        best = min(best, time.perf_counter() - start)
+    print(f"{label:<28} {best * 1000:10.1f} ms  ({len(result)} elementi)")
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--files', type=int, default=100_000, help='numero di file')
+    parser.add_argument('--dirs', type=int, default=100, help='numero di sottodirectory')
+    parser.add_argument('--repeat', type=int, default=3, help='ripetizioni per misura')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        print(f"Creazione di {args.files} file e {args.dirs} directory in {tmp}...")
+        build_tree(tmp, args.files, args.dirs)
+
+        legacy = timed('listdir + stat (originale)', lambda: legacy_listing(tmp), args.repeat)
+        cold = timed('scandir (cache fredda)', lambda: scan_directory(tmp, ''), args.repeat)
+
+        cache = DirectoryCache(max_items=args.files + args.dirs)
+        cache.listing(tmp, '')
+        warm = timed('scandir (cache calda)', lambda: cache.listing(tmp, '')[0], args.repeat)
+
+        print(f"\nscandir vs originale: {legacy / cold:6.1f}x")
+        print(f"cache calda vs originale: {legacy / warm:6.0f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+"""Load test di serve.py: throughput di listing e download al variare dei worker"""
+import argparse
+import http.client
+import os
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+
+def build_tree(directory, files, file_size):
+    """Una directory larga per i listing e un file per i download"""
+    wide = os.path.join(directory, 'wide')
+    os.mkdir(wide)
+    for i in range(files):
+        with open(os.path.join(wide, f"file_{i:06d}.txt"), 'wb') as f:
+            f.write(b'x' * 100)
+    with open(os.path.join(directory, 'blob.bin'), 'wb') as f:
+        f.write(os.urandom(file_size))
+    past = time.time() - 10
+    os.utime(wide, (past, past))
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def wait_for_port(port, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=1):
+                return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError(f"Il server non risponde sulla porta {port}")
+
+
+def client(port, path, duration, method='GET'):
+    """Un client con connessione keep-alive: restituisce (richieste, byte)"""
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+    requests = received = 0
+    deadline = time.time() + duration
+    while time.time() < deadline:
+        conn.request(method, path)
+        response = conn.getresponse()
+        received += len(response.read())
+        if response.status != 200:
+            raise RuntimeError(f"{path}: HTTP {response.status}")
+        requests += 1
+    conn.close()
+    return requests, received
+
+
+def run_load(port, path, clients, duration, method='GET'):
+    with ProcessPoolExecutor(max_workers=clients) as pool:
+        results = list(pool.map(client, [port] * clients, [path] * clients,
+                                [duration] * clients, [method] * clients))
+    requests = sum(r for r, _ in results)
+    received = sum(b for _, b in results)
+    return requests / duration, received / duration / (1024 * 1024)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--workers', default='1,2,4', help='numero di worker da provare')
+    parser.add_argument('--threads', type=int, default=4, help='thread per worker')
+    parser.add_argument('--clients', type=int, default=16, help='client concorrenti')
+    parser.add_argument('--duration', type=float, default=5, help='secondi per misura')
+    parser.add_argument('--files', type=int, default=2000, help='file nella directory del listing')
+    parser.add_argument('--file-size', type=int, default=1024 * 1024, help='byte del file scaricato')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        build_tree(tmp, args.files, args.file_size)
+        print(f"{'worker':>6} {'endpoint':<16} {'req/s':>10} {'MB/s':>10}")
+        for workers in [int(w) for w in args.workers.split(',')]:
+            port = free_port()
+            env = dict(os.environ, FILESERVER_BASE_DIR=tmp)
+            server = subprocess.Popen(
+                [sys.executable, os.path.join(ROOT, 'serve.py'),
+                 '--bind', f"127.0.0.1:{port}", '--workers', str(workers),
+                 '--threads', str(args.threads)],
+                cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            try:
+                wait_for_port(port)
+                for label, path in (('/files/wide', '/files/wide'),
+                                    ('/download', '/download/blob.bin')):
+                    rps, mbps = run_load(port, path, args.clients, args.duration)
+                    print(f"{workers:>6} {label:<16} {rps:>10.1f} {mbps:>10.1f}")
+            finally:
+                server.send_signal(signal.SIGTERM)
+                server.wait(timeout=30)
+
+
+if __name__ == '__main__':
+    main()
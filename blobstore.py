@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+"""Archivio dei contenuti per digest SHA-256: i file caricati sono hardlink ai blob"""
+import errno
+import os
+import shutil
+import time
+import uuid
+from contextlib import contextmanager
+
+from checksums import hash_file, save_stream
+
+try:
+    import fcntl
+except ImportError:  # non disponibile su Windows: nessun lock tra processi
+    fcntl = None
+
+# Attributo esteso con il digest, condiviso da tutti gli hardlink di un blob
+DIGEST_XATTR = 'user.fileserver.sha256'
+# File in arrivo più vecchi di così sono residui di processi terminati
+STALE_INCOMING_SECONDS = 24 * 3600
+
+
+def is_digest(value):
+    """Vero se `value` è un digest SHA-256 esadecimale"""
+    return (isinstance(value, str) and len(value) == 64
+            and all(c in '0123456789abcdef' for c in value))
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+class BlobStore:
+    """Contenuti deduplicati: ogni contenuto è salvato una volta sola.
+
+    Il blob vive in <dir>/<2 cifre>/<digest> ed è collegato con un hardlink
+    in ogni path visibile con lo stesso contenuto, quindi il conteggio dei
+    riferimenti è il link count del filesystem: un blob con un solo link non
+    è più usato e può essere eliminato. I blob sono in sola lettura perché
+    una scrittura sul posto modificherebbe tutte le copie; le sostituzioni
+    passano sempre da un rename. L'archivio deve stare sullo stesso
+    filesystem dei file serviti.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def blob_path(self, digest):
+        return os.path.join(self.directory, digest[:2], digest)
+
+    @contextmanager
+    def _locked(self, exclusive=False):
+        # Condiviso per inserimenti e link, esclusivo per la raccolta dei blob
+        if fcntl is None:
+            yield
+            return
+        with open(os.path.join(self.directory, '.lock'), 'a') as f:
+            fcntl.flock(f, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def incoming_path(self):
+        """Path temporaneo per un contenuto in arrivo"""
+        return os.path.join(self.directory, f".incoming-{uuid.uuid4().hex}")
+
+    def receive(self, stream):
+        """Copia uno stream in un file temporaneo; restituisce (path, digest per algoritmo)"""
+        temp_path = self.incoming_path()
+        try:
+            digests = save_stream(stream, temp_path)
+        except BaseException:
+            _remove(temp_path)
+            raise
+        return temp_path, digests
+
+    def size(self, digest):
+        """Dimensione del blob, o None se il contenuto non è nell'archivio"""
+        try:
+            return os.stat(self.blob_path(digest)).st_size
+        except FileNotFoundError:
+            return None
+
+    def store(self, source, target, digest=None):
+        """Sposta il file `source` nell'archivio e collegalo in `target`"""
+        digest = digest or hash_file(source)[0]['sha256']
+        blob = self.blob_path(digest)
+        with self._locked():
+            if os.path.exists(blob):
+                # Contenuto già presente: la copia appena ricevuta non serve
+                os.remove(source)
+            else:
+                os.makedirs(os.path.dirname(blob), exist_ok=True)
+                os.chmod(source, 0o444)
+                try:
+                    os.setxattr(source, DIGEST_XATTR, digest.encode('ascii'))
+                except (AttributeError, OSError):
+                    pass
+                os.replace(source, blob)
+            replaced = self._link(blob, target)
+        self._drop_if_unused(replaced)
+        return digest
+
+    def link(self, digest, target):
+        """Collega in `target` un contenuto già archiviato; False se non esiste"""
+        blob = self.blob_path(digest)
+        with self._locked():
+            if not os.path.exists(blob):
+                return False
+            replaced = self._link(blob, target)
+        self._drop_if_unused(replaced)
+        return True
+
+    def _link(self, blob, target):
+        """Collega il blob in `target`; restituisce il digest del contenuto sostituito"""
+        replaced = self.digest_of(target) if os.path.lexists(target) else None
+        try:
+            try:
+                os.link(blob, target)
+            except FileExistsError:
+                # Sostituzione atomica del file esistente
+                temp_path = os.path.join(os.path.dirname(target), f".{uuid.uuid4().hex}.link")
+                os.link(blob, temp_path)
+                os.replace(temp_path, target)
+        except OSError as e:
+            if e.errno not in (errno.EXDEV, errno.EPERM, errno.EMLINK, errno.ENOTSUP):
+                raise
+            # Hardlink non possibili (altro filesystem o limite di link): copia
+            temp_path = os.path.join(os.path.dirname(target), f".{uuid.uuid4().hex}.copy")
+            shutil.copyfile(blob, temp_path)
+            os.replace(temp_path, target)
+        return replaced if replaced != os.path.basename(blob) else None
+
+    @staticmethod
+    def digest_of(path):
+        """Digest del blob a cui è collegato `path`, se noto"""
+        try:
+            value = os.getxattr(path, DIGEST_XATTR, follow_symlinks=False).decode('ascii')
+        except (AttributeError, OSError, UnicodeDecodeError):
+            return None
+        return value if is_digest(value) else None
+
+    def unlink(self, path):
+        """Elimina un file visibile liberando il blob se era l'ultimo riferimento"""
+        stat_result = os.lstat(path)
+        digest = self.digest_of(path) if stat_result.st_nlink > 1 else None
+        os.remove(path)
+        if digest:
+            self._drop_if_unused(digest)
+        elif stat_result.st_nlink > 1:
+            # Digest non leggibile (filesystem senza xattr): raccolta completa
+            self.collect()
+
+    def _drop_if_unused(self, digest):
+        if not digest:
+            return
+        blob = self.blob_path(digest)
+        with self._locked(exclusive=True):
+            try:
+                if os.stat(blob).st_nlink == 1:
+                    os.remove(blob)
+            except FileNotFoundError:
+                pass
+
+    def collect(self, job=None):
+        """Elimina i blob che nessun file usa più; restituisce i byte liberati"""
+        freed = 0
+        now = time.time()
+        with self._locked(exclusive=True):
+            for current, _dirs, files in os.walk(self.directory):
+                for name in files:
+                    path = os.path.join(current, name)
+                    try:
+                        stat_result = os.stat(path)
+                    except FileNotFoundError:
+                        continue
+                    if name.startswith('.'):
+                        if (name.startswith('.incoming-')
+                                and now - stat_result.st_mtime > STALE_INCOMING_SECONDS):
+                            _remove(path)
+                        continue
+                    if stat_result.st_nlink == 1:
+                        _remove(path)
+                        freed += stat_result.st_size
+                        if job is not None:
+                            job.advance(items=1, nbytes=stat_result.st_size)
+        return freed
@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+"""Checksum dei file calcolati durante la scrittura e conservati per inode, dimensione e mtime"""
+import base64
+import hashlib
+import os
+import sqlite3
+import threading
+
+try:
+    import xxhash
+except ImportError:  # dipendenza opzionale
+    xxhash = None
+
+# Blocchi letti e scritti durante il calcolo
+CHUNK_SIZE = 1024 * 1024
+# Digest conservati: oltre questo numero si eliminano i più vecchi
+CHECKSUMS_KEEP = 1000000
+# Ogni quanti inserimenti eliminare i digest in eccesso
+PRUNE_EVERY = 1000
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS checksums (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    dev INTEGER NOT NULL,
+    ino INTEGER NOT NULL,
+    algorithm TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    digest TEXT NOT NULL,
+    UNIQUE (dev, ino, algorithm)
+);
+"""
+
+
+class ChecksumError(Exception):
+    """Il file è cambiato mentre se ne calcolava il digest"""
+
+
+def available_algorithms():
+    """Algoritmi utilizzabili con le librerie installate; sha256 è sempre presente"""
+    algorithms = ['sha256']
+    if xxhash is not None:
+        algorithms.append('xxh3_128')
+    return algorithms
+
+
+def new_hash(algorithm):
+    if algorithm == 'sha256':
+        return hashlib.sha256()
+    if algorithm == 'xxh3_128' and xxhash is not None:
+        return xxhash.xxh3_128()
+    raise ValueError(f"algoritmo non supportato: {algorithm}")
+
+
+def digest_header(sha256):
+    """Valore dell'header Repr-Digest (RFC 9530) per un digest sha256 esadecimale"""
+    encoded = base64.b64encode(bytes.fromhex(sha256)).decode('ascii')
+    return f"sha-256=:{encoded}:"
+
+
+class Hasher:
+    """Calcola insieme tutti i digest disponibili sugli stessi byte"""
+
+    def __init__(self, algorithms=None):
+        self._hashes = {algorithm: new_hash(algorithm)
+                        for algorithm in (algorithms or available_algorithms())}
+
+    def update(self, data):
+        for hash_object in self._hashes.values():
+            hash_object.update(data)
+
+    def hexdigests(self):
+        return {algorithm: hash_object.hexdigest()
+                for algorithm, hash_object in self._hashes.items()}
+
+
+def save_stream(stream, path):
+    """Scrivi uno stream in `path` calcolandone i digest; restituisce i digest"""
+    hasher = Hasher()
+    with open(path, 'wb') as f:
+        while True:
+            data = stream.read(CHUNK_SIZE)
+            if not data:
+                break
+            hasher.update(data)
+            f.write(data)
+    return hasher.hexdigests()
+
+
+def hash_file(path, job=None):
+    """Digest di un file letto una volta sola; restituisce (digest, stat del file).
+
+    Solleva ChecksumError se il file cambia durante la lettura.
+    """
+    hasher = Hasher()
+    with open(path, 'rb') as f:
+        before = os.fstat(f.fileno())
+        while True:
+            data = f.read(CHUNK_SIZE)
+            if not data:
+                break
+            hasher.update(data)
+            if job is not None:
+                job.advance(nbytes=len(data))
+        after = os.fstat(f.fileno())
+    if (before.st_size, before.st_mtime_ns) != (after.st_size, after.st_mtime_ns):
+        raise ChecksumError('Il file è cambiato durante il calcolo del checksum')
+    return hasher.hexdigests(), before
+
+
+class ChecksumStore:
+    """Digest dei file condivisi tra i worker.
+
+    La chiave è l'inode (con il device): un rename o un hardlink non
+    invalidano il digest, mentre una modifica del contenuto cambia
+    dimensione o mtime e rende il valore salvato inutilizzabile.
+    """
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._local = threading.local()
+        self._recorded = 0
+
+        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        conn = self._conn()
+        with conn:
+            conn.executescript(SCHEMA)
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def get(self, stat_result, algorithm='sha256'):
+        """Digest salvato per il file nello stato `stat_result`, o None"""
+        row = self._conn().execute(
+            "SELECT digest FROM checksums WHERE dev = ? AND ino = ? AND algorithm = ?"
+            " AND size = ? AND mtime_ns = ?",
+            (stat_result.st_dev, stat_result.st_ino, algorithm,
+             stat_result.st_size, stat_result.st_mtime_ns)).fetchone()
+        return row[0] if row else None
+
+    def put(self, stat_result, digests):
+        """Salva i digest calcolati sul contenuto del file nello stato `stat_result`"""
+        conn = self._conn()
+        with conn:
+            for algorithm, digest in digests.items():
+                row_id = conn.execute(
+                    "INSERT OR REPLACE INTO checksums"
+                    "(dev, ino, algorithm, size, mtime_ns, digest)"
+                    " VALUES (?, ?, ?, ?, ?, ?)",
+                    (stat_result.st_dev, stat_result.st_ino, algorithm,
+                     stat_result.st_size, stat_result.st_mtime_ns, digest)).lastrowid
+            self._recorded += 1
+            if digests and self._recorded % PRUNE_EVERY == 0:
+                conn.execute("DELETE FROM checksums WHERE id <= ?", (row_id - CHECKSUMS_KEEP,))
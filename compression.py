@@ -0,0 +1,211 @@
+#!/usr/bin/env python3
+"""Compressione negoziata delle risposte e cache su disco delle varianti compresse"""
+import hashlib
+import mimetypes
+import os
+import time
+import uuid
+import zlib
+
+try:
+    import zstandard
+except ImportError:  # dipendenza opzionale
+    zstandard = None
+
+try:
+    import brotli
+except ImportError:  # dipendenza opzionale
+    brotli = None
+
+# Codec in ordine di preferenza a parità di qualità richiesta dal client
+CODECS = ('zstd', 'br', 'gzip')
+# Sotto questa dimensione la compressione non conviene
+MIN_SIZE = 1024
+# Livelli per le risposte compresse al volo (JSON) e per le varianti in cache
+LIVE_LEVELS = {'zstd': 3, 'br': 4, 'gzip': 5}
+CACHE_LEVELS = {'zstd': 9, 'br': 6, 'gzip': 6}
+# Blocchi letti dal file sorgente
+CHUNK_SIZE = 256 * 1024
+# File temporanei più vecchi di così sono residui di processi terminati
+STALE_TEMP_SECONDS = 3600
+
+# Tipi non text/* che vale la pena comprimere
+COMPRESSIBLE_TYPES = {
+    'application/json',
+    'application/x-ndjson',
+    'application/javascript',
+    'application/xml',
+    'application/x-sh',
+    'application/x-yaml',
+    'application/yaml',
+    'application/sql',
+    'application/x-tex',
+    'application/rtf',
+    'application/x-subrip',
+    'application/postscript',
+    'image/svg+xml',
+    'image/bmp',
+    'image/x-ms-bmp',
+    'application/x-tar',
+}
+
+# Estensioni testuali comuni che il database di mimetypes non conosce
+for _extension, _mimetype in (('.log', 'text/plain'), ('.md', 'text/markdown'),
+                              ('.yml', 'application/x-yaml'), ('.yaml', 'application/x-yaml'),
+                              ('.toml', 'text/plain'), ('.ini', 'text/plain'),
+                              ('.conf', 'text/plain'), ('.jsonl', 'application/x-ndjson'),
+                              ('.ndjson', 'application/x-ndjson')):
+    if mimetypes.guess_type('file' + _extension)[0] is None:
+        mimetypes.add_type(_mimetype, _extension)
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def available_codecs():
+    """Codec utilizzabili con le librerie installate"""
+    return [codec for codec in CODECS
+            if codec == 'gzip'
+            or (codec == 'zstd' and zstandard is not None)
+            or (codec == 'br' and brotli is not None)]
+
+
+def is_compressible(mimetype):
+    """Vero per i tipi testuali; immagini, video, audio e archivi sono già compressi"""
+    if not mimetype:
+        return False
+    mimetype = mimetype.split(';')[0].strip().lower()
+    return (mimetype.startswith('text/') or mimetype in COMPRESSIBLE_TYPES
+            or mimetype.endswith('+json') or mimetype.endswith('+xml'))
+
+
+def negotiate(accept_encodings):
+    """Scegli il codec dall'Accept-Encoding già interpretato da werkzeug, o None"""
+    best, best_quality = None, 0
+    for codec in available_codecs():
+        quality = accept_encodings.quality(codec)
+        if quality > best_quality:
+            best, best_quality = codec, quality
+    return best
+
+
+class _BrotliCompressor:
+    def __init__(self, quality):
+        self._compressor = brotli.Compressor(quality=quality)
+
+    def compress(self, data):
+        return self._compressor.process(data)
+
+    def flush(self):
+        return self._compressor.finish()
+
+
+def compressor(codec, level):
+    """Compressore incrementale con i metodi compress() e flush()"""
+    if codec == 'gzip':
+        return zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    if codec == 'zstd':
+        return zstandard.ZstdCompressor(level=level).compressobj()
+    if codec == 'br':
+        return _BrotliCompressor(level)
+    raise ValueError(f"codec non supportato: {codec}")
+
+
+def compress_bytes(data, codec, level=None):
+    """Comprimi un corpo già in memoria"""
+    level = LIVE_LEVELS[codec] if level is None else level
+    stream = compressor(codec, level)
+    return stream.compress(data) + stream.flush()
+
+
+class PrecompressedCache:
+    """Varianti compresse dei file, chiave path + dimensione + mtime + codec.
+
+    Il primo download comprime in streaming e salva la variante; i
+    successivi la servono da disco senza ricomprimere. Oltre `max_bytes`
+    vengono eliminate le varianti usate meno di recente.
+    """
+
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, path, stat_result, codec):
+        key = f"{os.path.abspath(path)}\0{stat_result.st_size}\0{stat_result.st_mtime_ns}\0{codec}"
+        return os.path.join(self.directory,
+                            hashlib.sha1(key.encode('utf-8', 'surrogateescape')).hexdigest())
+
+    def lookup(self, path, stat_result, codec):
+        """Path della variante compressa se è già in cache"""
+        cached = self._path(path, stat_result, codec)
+        try:
+            # L'mtime della variante registra l'ultimo uso per l'eviction
+            os.utime(cached)
+        except FileNotFoundError:
+            return None
+        return cached
+
+    def stream(self, path, stat_result, codec):
+        """Comprimi il file in streaming, salvando la variante se si arriva in fondo"""
+        store = self.max_bytes > 0 and stat_result.st_size <= self.max_bytes // 2
+        temp_path = os.path.join(self.directory, f".{uuid.uuid4().hex}.tmp")
+        stream = compressor(codec, CACHE_LEVELS[codec])
+        out = open(temp_path, 'wb') if store else None
+        completed = False
+        try:
+            with open(path, 'rb') as f:
+                while True:
+                    chunk = f.read(CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    data = stream.compress(chunk)
+                    if data:
+                        if out:
+                            out.write(data)
+                        yield data
+            data = stream.flush()
+            if out:
+                out.write(data)
+            completed = True
+            yield data
+        finally:
+            if out:
+                out.close()
+                # Il file può essere cambiato durante la compressione
+                try:
+                    unchanged = os.stat(path).st_mtime_ns == stat_result.st_mtime_ns
+                except OSError:
+                    unchanged = False
+                if completed and unchanged:
+                    os.replace(temp_path, self._path(path, stat_result, codec))
+                    self.evict()
+                else:
+                    _remove(temp_path)
+
+    def evict(self):
+        """Elimina le varianti meno usate finché la cache supera max_bytes"""
+        entries = []
+        total = 0
+        now = time.time()
+        for entry in os.scandir(self.directory):
+            try:
+                stat_result = entry.stat()
+            except FileNotFoundError:
+                continue
+            if entry.name.startswith('.'):
+                if now - stat_result.st_mtime > STALE_TEMP_SECONDS:
+                    _remove(entry.path)
+                continue
+            entries.append((stat_result.st_mtime, stat_result.st_size, entry.path))
+            total += stat_result.st_size
+        entries.sort()
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            _remove(path)
+            total -= size
@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+"""Configurazione del server: valori predefiniti, file INI e variabili d'ambiente"""
+import configparser
+import os
+
+# Variabile d'ambiente con il path del file di configurazione
+CONFIG_ENV = 'FILESERVER_CONFIG'
+# Prefisso delle variabili d'ambiente che sovrascrivono le singole chiavi
+ENV_PREFIX = 'FILESERVER_'
+
+DEFAULTS = {
+    # Directory servita e limiti
+    'base_dir': '/home/mottu/file',
+    'max_content_length': 16 * 1024 * 1024,
+    'max_upload_size': 64 * 1024 * 1024 * 1024,
+    'upload_chunk_size': 8 * 1024 * 1024,
+    'listing_cache_max_items': 500_000,
+    'listing_max_page_size': 5000,
+    'job_workers': 2,
+    # Upload deduplicati: contenuti salvati una volta e collegati con hardlink
+    'dedup': False,
+    # Invio dei download: python, sendfile, x-sendfile, x-accel-redirect
+    'download_backend': 'sendfile',
+    'x_accel_prefix': '/protected/',
+    # Spazio su disco per le varianti compresse dei download (0 = non salvarle)
+    'compression_cache_max_bytes': 1024 * 1024 * 1024,
+    # Anteprime (/preview): thread che le generano e spazio su disco (0 = non salvarle)
+    'preview_workers': 2,
+    'preview_cache_max_bytes': 256 * 1024 * 1024,
+    # Secondi tra due riconciliazioni dell'indice di ricerca (0 = disattivata)
+    'index_reconcile_interval': 600,
+    # Stream /events aperti contemporaneamente per worker
+    'events_max_streams': 4,
+    # Metriche Prometheus su /metrics e profilo delle richieste più lente di
+    # metrics_slow_request_seconds (0 = profilatore disattivato)
+    'metrics': True,
+    'metrics_slow_request_seconds': 0.0,
+    # Limiti di banda per worker in byte/s (0 = nessun limite): totale ripartito
+    # tra i client attivi secondo i pesi ("client=peso, ...") e massimo per client
+    'bandwidth_total_rate': 0,
+    'bandwidth_client_rate': 0,
+    'bandwidth_weights': '',
+    # Header che identifica il client (vuoto = indirizzo IP della connessione)
+    'bandwidth_client_header': '',
+    # Quota della banda totale lasciata alle richieste interattive in corso
+    'bandwidth_interactive_reserve': 0.2,
+    # Server HTTP
+    'host': '0.0.0.0',
+    'port': 5000,
+    'debug': False,
+    'workers': 4,
+    'threads': 8,
+    'keepalive': 5,
+    'timeout': 120,
+    'graceful_timeout': 30,
+    'max_requests': 0,
+    # Variante asincrona (serve_async.py): thread per l'I/O su disco e connessioni massime
+    'asgi_threads': 32,
+    'asgi_max_connections': 10000,
+}
+
+
+def _convert(key, value):
+    default = DEFAULTS[key]
+    if isinstance(default, bool):
+        return str(value).strip().lower() in ('1', 'true', 'yes', 'on')
+    if isinstance(default, float):
+        return float(value)
+    if isinstance(default, int):
+        return int(value)
+    return str(value)
+
+
+def load(path=None):
+    """Carica la configurazione.
+
+    Ordine di priorità: variabili d'ambiente FILESERVER_<CHIAVE>, sezione
+    [server] del file INI (path esplicito o FILESERVER_CONFIG), valori
+    predefiniti.
+    """
+    settings = dict(DEFAULTS)
+
+    path = path or os.environ.get(CONFIG_ENV)
+    if path:
+        parser = configparser.ConfigParser()
+        if not parser.read(path):
+            raise FileNotFoundError(f"File di configurazione non trovato: {path}")
+        if parser.has_section('server'):
+            for key, value in parser.items('server'):
+                if key not in DEFAULTS:
+                    raise ValueError(f"Chiave di configurazione sconosciuta: {key}")
+                settings[key] = _convert(key, value)
+
+    for key in DEFAULTS:
+        value = os.environ.get(ENV_PREFIX + key.upper())
+        if value is not None:
+            settings[key] = _convert(key, value)
+
+    return settings
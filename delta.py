@@ -0,0 +1,202 @@
+#!/usr/bin/env python3
+"""Sincronizzazione a blocchi (stile rsync): firme dei blocchi e ricostruzione dei file.
+
+Il client scarica la firma della versione del file sul server (per ogni
+blocco un checksum debole scorrevole, adler32, e uno forte, blake2b a 128
+bit), confronta il file locale e invia una delta: blocchi da copiare dalla
+versione sul server e byte nuovi. Il server ricostruisce il file in un file
+temporaneo e lo sostituisce in modo atomico.
+
+Formato della firma (interi big-endian):
+    SIGNATURE_MAGIC, dimensione del blocco (u32), dimensione del file (u64),
+    poi per ogni blocco adler32 (u32) e blake2b (16 byte)
+Formato della delta:
+    DELTA_MAGIC, dimensione del blocco (u32), poi operazioni:
+    b'C' indice (u32) numero (u32)  copia di blocchi consecutivi della base
+    b'D' lunghezza (u32) byte       byte nuovi
+    b'E' sha256 (32 byte)           fine, con il digest del file risultante
+"""
+import hashlib
+import os
+import struct
+import zlib
+
+from checksums import Hasher
+
+SIGNATURE_MAGIC = b'FSS1'
+DELTA_MAGIC = b'FSD1'
+# Limiti della dimensione dei blocchi, scelta come circa la radice della dimensione del file
+MIN_BLOCK_SIZE = 2 * 1024
+MAX_BLOCK_SIZE = 1024 * 1024
+# Byte del checksum forte di ogni blocco
+STRONG_SIZE = 16
+# Byte copiati per volta dalla base o dalla richiesta
+COPY_CHUNK = 1024 * 1024
+# Ogni quanti salvataggi controllare lo spazio occupato dalle firme
+EVICT_EVERY = 20
+
+_HEADER = struct.Struct('>4sIQ')
+_BLOCK = struct.Struct(f'>I{STRONG_SIZE}s')
+_VERSION = struct.Struct('>QQ')
+
+
+class DeltaError(Exception):
+    """Delta non applicabile; `status` è il codice HTTP da restituire"""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+def block_size_for(size):
+    """Potenza di due vicina alla radice quadrata della dimensione, tra i limiti"""
+    block_size = MIN_BLOCK_SIZE
+    while block_size < MAX_BLOCK_SIZE and block_size * block_size < size:
+        block_size *= 2
+    return block_size
+
+
+def strong_checksum(data):
+    return hashlib.blake2b(data, digest_size=STRONG_SIZE).digest()
+
+
+def compute_signature(path, job=None):
+    """Firma dei blocchi del file; restituisce (firma, stat del file).
+
+    Solleva DeltaError se il file cambia durante la lettura.
+    """
+    with open(path, 'rb') as f:
+        before = os.fstat(f.fileno())
+        block_size = block_size_for(before.st_size)
+        parts = [_HEADER.pack(SIGNATURE_MAGIC, block_size, before.st_size)]
+        while True:
+            data = f.read(block_size)
+            if not data:
+                break
+            parts.append(_BLOCK.pack(zlib.adler32(data), strong_checksum(data)))
+            if job is not None:
+                job.advance(nbytes=len(data))
+        after = os.fstat(f.fileno())
+    if (before.st_size, before.st_mtime_ns) != (after.st_size, after.st_mtime_ns):
+        raise DeltaError('Il file è cambiato durante il calcolo della firma', 409)
+    return b''.join(parts), before
+
+
+class SignatureCache:
+    """Firme salvate su disco per inode, valide finché dimensione e mtime non cambiano"""
+
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._saved = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, stat_result):
+        return os.path.join(self.directory, f"{stat_result.st_dev}-{stat_result.st_ino}.sig")
+
+    def get(self, stat_result):
+        """Firma del file nello stato `stat_result`, o None"""
+        try:
+            with open(self._path(stat_result), 'rb') as f:
+                version = f.read(_VERSION.size)
+                if version != _VERSION.pack(stat_result.st_size, stat_result.st_mtime_ns):
+                    return None
+                return f.read()
+        except OSError:
+            return None
+
+    def put(self, stat_result, signature):
+        path = self._path(stat_result)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(_VERSION.pack(stat_result.st_size, stat_result.st_mtime_ns))
+            f.write(signature)
+        os.replace(tmp_path, path)
+        self._saved += 1
+        if self._saved % EVICT_EVERY == 0:
+            self.evict()
+
+    def evict(self):
+        """Elimina le firme meno recenti oltre max_bytes"""
+        entries = []
+        total = 0
+        for entry in os.scandir(self.directory):
+            try:
+                stat_result = entry.stat()
+            except OSError:
+                continue
+            entries.append((stat_result.st_mtime, stat_result.st_size, entry.path))
+            total += stat_result.st_size
+        entries.sort()
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total -= size
+
+
+def _read_exact(stream, size):
+    parts = []
+    while size > 0:
+        data = stream.read(min(size, COPY_CHUNK))
+        if not data:
+            raise DeltaError('Delta incompleta')
+        parts.append(data)
+        size -= len(data)
+    return b''.join(parts)
+
+
+def apply_delta(stream, base_path, target_path, expected):
+    """Ricostruisci in `target_path` il file descritto dalla delta letta da `stream`.
+
+    `expected` è lo stat della base a cui si riferisce la delta. Restituisce
+    i digest del file ricostruito; solleva DeltaError se la delta non è
+    valida, se la base è cambiata o se il digest finale non corrisponde.
+    """
+    hasher = Hasher()
+    with open(base_path, 'rb') as base, open(target_path, 'wb') as target:
+        base_stat = os.fstat(base.fileno())
+        if ((base_stat.st_ino, base_stat.st_size, base_stat.st_mtime_ns)
+                != (expected.st_ino, expected.st_size, expected.st_mtime_ns)):
+            raise DeltaError('Il file è cambiato: richiedere una nuova firma', 412)
+
+        magic, block_size = struct.unpack('>4sI', _read_exact(stream, 8))
+        if magic != DELTA_MAGIC or block_size != block_size_for(expected.st_size):
+            raise DeltaError('Formato della delta non valido')
+
+        while True:
+            op = _read_exact(stream, 1)
+            if op == b'C':
+                index, count = struct.unpack('>II', _read_exact(stream, 8))
+                start = index * block_size
+                if count == 0 or start + (count - 1) * block_size >= expected.st_size:
+                    raise DeltaError('Blocco della base inesistente')
+                base.seek(start)
+                remaining = min(count * block_size, expected.st_size - start)
+                while remaining > 0:
+                    data = base.read(min(COPY_CHUNK, remaining))
+                    if not data:
+                        raise DeltaError('Il file è cambiato: richiedere una nuova firma', 412)
+                    hasher.update(data)
+                    target.write(data)
+                    remaining -= len(data)
+            elif op == b'D':
+                (length,) = struct.unpack('>I', _read_exact(stream, 4))
+                while length > 0:
+                    data = _read_exact(stream, min(length, COPY_CHUNK))
+                    hasher.update(data)
+                    target.write(data)
+                    length -= len(data)
+            elif op == b'E':
+                sha256 = _read_exact(stream, 32).hex()
+                break
+            else:
+                raise DeltaError('Operazione della delta sconosciuta')
+
+    digests = hasher.hexdigests()
+    if digests['sha256'] != sha256:
+        raise DeltaError('Il digest sha256 non corrisponde al file ricostruito', 422)
+    return digests
@@ -0,0 +1,388 @@
+#!/usr/bin/env python3
+"""Registro delle modifiche ai file e watcher inotify che lo alimenta"""
+import ctypes
+import ctypes.util
+import errno
+import json
+import logging
+import os
+import sqlite3
+import struct
+import sys
+import threading
+import time
+from datetime import datetime
+
+try:
+    import fcntl
+except ImportError:  # non disponibile su Windows
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# Eventi conservati nel registro: un client più indietro riceve 'reset'
+EVENTS_KEEP = 10000
+# Ogni quanti eventi eliminare quelli più vecchi
+PRUNE_EVERY = 500
+# Directory non osservate elencate nello stato del watcher; oltre, nessuna è considerata coperta
+MAX_UNWATCHED = 1000
+
+# Costanti di <sys/inotify.h>
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+IN_CLOEXEC = 0o2000000
+
+WATCH_MASK = (IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+              | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR)
+EVENT_HEADER = struct.Struct('iIII')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS events (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    type TEXT NOT NULL,
+    path TEXT NOT NULL,
+    parent TEXT NOT NULL,
+    item TEXT
+);
+CREATE INDEX IF NOT EXISTS events_parent ON events(parent, seq);
+"""
+
+
+def _load_libc():
+    if not sys.platform.startswith('linux'):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        libc.inotify_init1
+    except (OSError, AttributeError):
+        return None
+    return libc
+
+
+_libc = _load_libc()
+
+
+def inotify_available():
+    """True se la piattaforma supporta inotify"""
+    return _libc is not None
+
+
+def item_info(full_path, relative_path):
+    """Informazioni di un elemento nello stesso formato del listing"""
+    try:
+        stat_result = os.stat(full_path)
+    except OSError:
+        return None
+    is_directory = os.path.isdir(full_path)
+    return {
+        'name': os.path.basename(full_path),
+        'path': full_path,
+        'is_directory': is_directory,
+        'size': 0 if is_directory else stat_result.st_size,
+        'modified': datetime.fromtimestamp(stat_result.st_mtime).isoformat(),
+        'permissions': oct(stat_result.st_mode)[-3:],
+        'relative_path': relative_path,
+    }
+
+
+class EventLog:
+    """Registro condiviso tra i worker delle modifiche sotto la directory base.
+
+    Ogni evento ha un numero di sequenza crescente che i client usano per
+    riprendere lo stream da dove si erano fermati.
+    """
+
+    def __init__(self, db_path, base_dir):
+        self.db_path = db_path
+        self.base_dir = os.path.abspath(base_dir)
+        self._local = threading.local()
+        self._appended = 0
+
+        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        conn = self._conn()
+        with conn:
+            conn.executescript(SCHEMA)
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def relative(self, full_path):
+        relative = os.path.relpath(os.path.abspath(full_path), self.base_dir)
+        return '' if relative == '.' else relative.replace(os.sep, '/')
+
+    def append(self, kind, full_path):
+        """Registra un evento: 'created', 'modified', 'deleted' o 'reset'"""
+        relative = self.relative(full_path) if full_path else ''
+        parent = relative.rsplit('/', 1)[0] if '/' in relative else ''
+        item = None
+        if kind in ('created', 'modified'):
+            item = item_info(full_path, relative)
+            if item is None:
+                return None
+        conn = self._conn()
+        with conn:
+            seq = conn.execute(
+                "INSERT INTO events(type, path, parent, item) VALUES (?, ?, ?, ?)",
+                (kind, relative, parent, json.dumps(item) if item else None)).lastrowid
+            self._appended += 1
+            if self._appended % PRUNE_EVERY == 0:
+                conn.execute("DELETE FROM events WHERE seq <= ?", (seq - EVENTS_KEEP,))
+        return seq
+
+    def latest(self):
+        """Numero di sequenza dell'ultimo evento (0 se il registro è vuoto)"""
+        row = self._conn().execute("SELECT MAX(seq) FROM events").fetchone()
+        return row[0] or 0
+
+    def since(self, seq, path=None, limit=500):
+        """Eventi successivi a `seq`, limitati ai figli diretti di `path`.
+
+        Restituisce None se `seq` è più vecchio degli eventi conservati: il
+        client deve ricaricare il listing completo.
+        """
+        conn = self._conn()
+        oldest, latest = conn.execute("SELECT MIN(seq), MAX(seq) FROM events").fetchone()
+        if oldest is not None and (seq < oldest - 1 or seq > latest):
+            return None
+        if path is None:
+            rows = conn.execute(
+                "SELECT seq, type, path, parent, item FROM events WHERE seq > ? "
+                "ORDER BY seq LIMIT ?", (seq, limit))
+        else:
+            # I reset riguardano tutti i client
+            rows = conn.execute(
+                "SELECT seq, type, path, parent, item FROM events "
+                "WHERE seq > ? AND (parent = ? OR type = 'reset') ORDER BY seq LIMIT ?",
+                (seq, path, limit))
+        return [{
+            'seq': row[0],
+            'type': row[1],
+            'path': row[2],
+            'parent': row[3],
+            'item': json.loads(row[4]) if row[4] else None,
+        } for row in rows]
+
+
+class InotifyWatcher:
+    """Osserva ricorsivamente la directory base e scrive gli eventi nel registro.
+
+    Con `lock_path` solo il processo che ottiene il lock sul file osserva il
+    disco; gli altri worker leggono gli eventi dal registro condiviso.
+    Il watcher attivo descrive in `status_path` cosa sta osservando, così
+    covers() risponde in ogni worker: per i path non coperti (watcher non
+    avviato o terminato, directory senza watch) le route registrano gli
+    eventi da sole.
+    """
+
+    def __init__(self, event_log, base_dir, hidden=None, status_path=None):
+        self.event_log = event_log
+        self.base_dir = os.path.abspath(base_dir)
+        self.hidden = hidden
+        self.status_path = status_path
+        self.fd = None
+        self.watches = {}  # wd -> path assoluto della directory
+        self.unwatched = set()  # directory per cui inotify_add_watch è fallita
+        self.running = False
+        self._thread = None
+        self._status = None
+        self._status_mtime = None
+
+    def _add_watch(self, directory):
+        wd = _libc.inotify_add_watch(self.fd, os.fsencode(directory), WATCH_MASK)
+        if wd < 0:
+            error = ctypes.get_errno()
+            if error == errno.ENOSPC:
+                # Limite fs.inotify.max_user_watches raggiunto
+                logger.warning("inotify: limite di watch raggiunto, %s non osservata", directory)
+            if error != errno.ENOENT:
+                # Né la directory né il suo contenuto produrranno eventi
+                self.unwatched.add(directory)
+                self._save_status()
+            return False
+        self.unwatched.discard(directory)
+        self.watches[wd] = directory
+        return True
+
+    def _save_status(self):
+        if self.status_path is None or not self.running:
+            return
+        status = {
+            'pid': os.getpid(),
+            'partial': len(self.unwatched) > MAX_UNWATCHED,
+            'unwatched': sorted(self.unwatched)[:MAX_UNWATCHED],
+        }
+        tmp_path = f"{self.status_path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, 'w') as f:
+                json.dump(status, f)
+            os.replace(tmp_path, self.status_path)
+        except OSError as e:
+            logger.warning("inotify: stato del watcher non salvato: %s", e)
+
+    def _clear_status(self):
+        if self.status_path is None:
+            return
+        try:
+            os.remove(self.status_path)
+        except FileNotFoundError:
+            pass
+
+    def _read_status(self):
+        """Stato del watcher attivo (anche di un altro worker), o None se nessuno osserva il disco"""
+        if self.status_path is None:
+            if not self.running:
+                return None
+            return {'partial': len(self.unwatched) > MAX_UNWATCHED, 'unwatched': self.unwatched}
+        try:
+            mtime = os.stat(self.status_path).st_mtime_ns
+            if mtime != self._status_mtime:
+                with open(self.status_path) as f:
+                    status = json.load(f)
+                status['unwatched'] = set(status['unwatched'])
+                self._status, self._status_mtime = status, mtime
+        except (OSError, ValueError, KeyError):
+            return None
+        try:
+            # Processo del watcher terminato senza poter togliere lo stato
+            os.kill(self._status['pid'], 0)
+        except ProcessLookupError:
+            return None
+        except OSError:
+            pass
+        return self._status
+
+    def covers(self, path):
+        """True se le modifiche a `path` vengono registrate da un watcher attivo"""
+        status = self._read_status()
+        if status is None or status['partial']:
+            return False
+        directory = os.path.dirname(os.path.abspath(path))
+        while True:
+            if directory in status['unwatched']:
+                return False
+            if directory == self.base_dir or len(directory) <= len(self.base_dir):
+                return True
+            directory = os.path.dirname(directory)
+
+    def _watch_tree(self, directory, announce=False):
+        """Aggiungi i watch a un albero; con `announce` registra anche il contenuto
+        creato prima che il watch fosse attivo"""
+        stack = [directory]
+        while stack:
+            current = stack.pop()
+            if self.hidden is not None and self.hidden(current):
+                continue
+            if not self._add_watch(current):
+                continue
+            try:
+                entries = list(os.scandir(current))
+            except OSError:
+                continue
+            for entry in entries:
+                if self.hidden is not None and self.hidden(entry.path):
+                    continue
+                if announce:
+                    self.event_log.append('created', entry.path)
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(entry.path)
+
+    def _unwatch_tree(self, directory):
+        prefix = directory + os.sep
+        for wd, path in list(self.watches.items()):
+            if path == directory or path.startswith(prefix):
+                _libc.inotify_rm_watch(self.fd, wd)
+                self.watches.pop(wd, None)
+
+    def _handle(self, wd, mask, name):
+        if mask & IN_Q_OVERFLOW:
+            self.event_log.append('reset', None)
+            return
+        directory = self.watches.get(wd)
+        if directory is None:
+            return
+        if mask & IN_IGNORED:
+            self.watches.pop(wd, None)
+            return
+        if mask & (IN_DELETE_SELF | IN_MOVE_SELF) or not name:
+            return
+        full_path = os.path.join(directory, name)
+        if self.hidden is not None and self.hidden(full_path):
+            return
+        if mask & (IN_CREATE | IN_MOVED_TO):
+            self.event_log.append('created', full_path)
+            if mask & IN_ISDIR:
+                self._watch_tree(full_path, announce=True)
+        elif mask & (IN_DELETE | IN_MOVED_FROM):
+            self.event_log.append('deleted', full_path)
+            if mask & IN_ISDIR:
+                self._unwatch_tree(full_path)
+        elif mask & IN_CLOSE_WRITE:
+            self.event_log.append('modified', full_path)
+
+    def run(self):
+        self.fd = _libc.inotify_init1(IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 fallita')
+        self.running = True
+        self._save_status()
+        self._watch_tree(self.base_dir)
+        while True:
+            data = os.read(self.fd, 64 * 1024)
+            offset = 0
+            while offset < len(data):
+                wd, mask, _cookie, length = EVENT_HEADER.unpack_from(data, offset)
+                offset += EVENT_HEADER.size
+                name = data[offset:offset + length].rstrip(b'\0')
+                offset += length
+                try:
+                    self._handle(wd, mask, os.fsdecode(name))
+                except Exception as e:
+                    logger.warning("inotify: errore nella gestione di un evento: %s", e)
+
+    def start(self, lock_path=None):
+        """Avvia il watcher in un thread; con più worker solo uno lo esegue davvero"""
+        if self._thread is not None or not inotify_available():
+            return
+
+        def run():
+            lock_file = None
+            while lock_path and fcntl is not None and lock_file is None:
+                candidate = open(lock_path, 'a')
+                try:
+                    fcntl.flock(candidate, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    lock_file = candidate
+                except OSError:
+                    candidate.close()
+                    # Un altro worker osserva il disco; subentra se termina
+                    time.sleep(5)
+            # Gli eventi persi durante il passaggio non sono ricostruibili
+            self.event_log.append('reset', None)
+            try:
+                self.run()
+            except Exception as e:
+                logger.warning("inotify: watcher terminato, eventi registrati dalle route: %s", e)
+            finally:
+                # Da qui gli eventi vengono dalle route: i client devono ricaricare
+                self.running = False
+                self._clear_status()
+                self.event_log.append('reset', None)
+                if lock_file is not None:
+                    lock_file.close()
+
+        self._thread = threading.Thread(target=run, name='inotify-watcher', daemon=True)
+        self._thread.start()
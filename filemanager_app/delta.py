@@ -0,0 +1,240 @@
+#!/usr/bin/env python3
+"""Upload delta: invia solo i blocchi cambiati di un file già presente sul server.
+
+Il server fornisce la firma della sua versione del file (checksum adler32 e
+blake2b di ogni blocco, vedi delta.py del server). Il file locale viene
+confrontato blocco per blocco: i blocchi uguali diventano istruzioni di
+copia, il resto byte nuovi. Dopo una modifica che sposta i dati
+(inserimento o cancellazione) il checksum scorrevole ritrova l'allineamento
+cercando entro un blocco; la ricerca è in Python, quindi limitata a
+ROLLING_BUDGET byte per file.
+"""
+import hashlib
+import mmap
+import os
+import struct
+import tempfile
+import time
+import zlib
+
+import requests
+
+from transfers import TIMEOUT
+
+SIGNATURE_MAGIC = b'FSS1'
+DELTA_MAGIC = b'FSD1'
+# Sotto questa dimensione si carica sempre l'intero file
+DELTA_MIN_SIZE = 4 * 1024 * 1024
+# Byte esaminati al massimo con il checksum scorrevole per ogni file
+ROLLING_BUDGET = 16 * 1024 * 1024
+# Attesa massima della firma calcolata dal server
+SIGNATURE_WAIT = 120
+# Byte nuovi inviati al massimo in una sola operazione
+LITERAL_CHUNK = 1024 * 1024
+# Oltre questa frazione di byte nuovi conviene l'upload completo
+MAX_LITERAL_RATIO = 0.5
+ADLER_MOD = 65521
+STRONG_SIZE = 16
+
+_HEADER = struct.Struct('>4sIQ')
+_BLOCK = struct.Struct(f'>I{STRONG_SIZE}s')
+
+
+def strong_checksum(data):
+    return hashlib.blake2b(data, digest_size=STRONG_SIZE).digest()
+
+
+class Signature:
+    """Firma dei blocchi di un file sul server"""
+
+    def __init__(self, data):
+        magic, self.block_size, self.size = _HEADER.unpack_from(data)
+        if magic != SIGNATURE_MAGIC:
+            raise ValueError('Formato della firma non valido')
+        self.weak = {}
+        self.strong = {}
+        for index, (weak, strong) in enumerate(_BLOCK.iter_unpack(data[_HEADER.size:])):
+            self.weak.setdefault(weak, set()).add(strong)
+            self.strong.setdefault(strong, index)
+        self.blocks = -(-self.size // self.block_size)
+        # L'ultimo blocco può essere più corto degli altri
+        self.last_size = self.size - (self.blocks - 1) * self.block_size if self.blocks else 0
+
+
+class _DeltaWriter:
+    """Scrive le operazioni della delta unendo le copie di blocchi consecutivi"""
+
+    def __init__(self, out, block_size, max_bytes):
+        self.out = out
+        self.max_bytes = max_bytes
+        self.literal = 0
+        self.copied = 0
+        self._copy = None
+        out.write(DELTA_MAGIC + struct.pack('>I', block_size))
+
+    def copy(self, index, length):
+        self.copied += length
+        if self._copy is not None and self._copy[0] + self._copy[1] == index:
+            self._copy[1] += 1
+            return
+        self._flush_copy()
+        self._copy = [index, 1]
+
+    def data(self, data):
+        if not data:
+            return
+        self._flush_copy()
+        self.literal += len(data)
+        for start in range(0, len(data), LITERAL_CHUNK):
+            chunk = data[start:start + LITERAL_CHUNK]
+            self.out.write(b'D' + struct.pack('>I', len(chunk)))
+            self.out.write(chunk)
+
+    def finish(self, sha256):
+        self._flush_copy()
+        self.out.write(b'E' + sha256)
+
+    def too_large(self):
+        return self.max_bytes and self.out.tell() > self.max_bytes
+
+    def _flush_copy(self):
+        if self._copy is not None:
+            self.out.write(b'C' + struct.pack('>II', *self._copy))
+            self._copy = None
+
+
+def compute_delta(path, signature, out, max_bytes=0):
+    """Scrivi in `out` la delta da `signature` al file locale `path`.
+
+    Restituisce (byte nuovi, byte copiati), oppure None se la delta non
+    conviene: troppi byte nuovi o più di `max_bytes` da inviare.
+    """
+    block_size = signature.block_size
+    writer = _DeltaWriter(out, block_size, max_bytes)
+    with open(path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        if size == 0:
+            writer.finish(hashlib.sha256().digest())
+            return 0, 0
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            max_literal = size * MAX_LITERAL_RATIO
+            budget = ROLLING_BUDGET
+            position = 0
+            literal_start = 0
+            while position < size:
+                length = min(block_size, size - position)
+                index = None
+                if length == block_size or length == signature.last_size:
+                    index = signature.strong.get(strong_checksum(data[position:position + length]))
+                if index is None and length == block_size and budget > 0:
+                    # Blocco non allineato: cerca una corrispondenza entro il blocco successivo
+                    found = _roll(data, position, block_size, size, signature)
+                    budget -= block_size
+                    if found is not None:
+                        position, index = found
+                if index is None:
+                    position += length
+                    if writer.literal + position - literal_start > max_literal:
+                        return None
+                    continue
+                writer.data(data[literal_start:position])
+                writer.copy(index, min(block_size, size - position))
+                position += min(block_size, size - position)
+                literal_start = position
+                if writer.literal > max_literal or writer.too_large():
+                    return None
+            writer.data(data[literal_start:size])
+            writer.finish(hashlib.sha256(data).digest())
+    if writer.literal > max_literal or writer.too_large():
+        return None
+    return writer.literal, writer.copied
+
+
+def _roll(data, position, block_size, size, signature):
+    """(posizione, indice) del primo blocco della firma che inizia dopo `position`"""
+    adler = zlib.adler32(data[position:position + block_size])
+    a = adler & 0xffff
+    b = adler >> 16
+    weak = signature.weak
+    stop = min(position + block_size, size - block_size)
+    while position < stop:
+        out = data[position]
+        inn = data[position + block_size]
+        a = (a - out + inn) % ADLER_MOD
+        b = (b - block_size * out + a - 1) % ADLER_MOD
+        position += 1
+        candidates = weak.get((b << 16) | a)
+        if candidates is not None:
+            strong = strong_checksum(data[position:position + block_size])
+            if strong in candidates:
+                return position, signature.strong[strong]
+    return None
+
+
+class DeltaUpload:
+    """Aggiorna un file sul server inviando solo le differenze dalla sua versione.
+
+    run() restituisce la risposta JSON del server, oppure None quando serve
+    un upload completo: file piccolo o assente sul server, delta non
+    conveniente o file cambiato sul server nel frattempo. Dopo l'upload
+    `literal` e `copied` indicano i byte inviati e quelli riutilizzati.
+    """
+
+    def __init__(self, server_url, local_path, remote_dir, on_progress=None, session=None):
+        self.server_url = server_url
+        self.local_path = local_path
+        self.remote_path = '/'.join(part for part in (remote_dir.strip('/'),
+                                                      os.path.basename(local_path)) if part)
+        self.on_progress = on_progress
+        self.session = session or requests
+        self.literal = 0
+        self.copied = 0
+        self.sent = 0
+
+    def run(self):
+        size = os.path.getsize(self.local_path)
+        if size < DELTA_MIN_SIZE:
+            return None
+        response = self._fetch_signature()
+        if response is None:
+            return None
+        signature = Signature(response.content)
+        max_bytes = int(response.headers.get('X-Delta-Max-Bytes', 0) or 0)
+
+        with tempfile.TemporaryFile() as delta:
+            before = os.stat(self.local_path)
+            result = compute_delta(self.local_path, signature, delta, max_bytes)
+            after = os.stat(self.local_path)
+            if result is None or (before.st_size, before.st_mtime_ns) != (after.st_size, after.st_mtime_ns):
+                return None
+            self.literal, self.copied = result
+            self.sent = delta.tell()
+            delta.seek(0)
+            if self.on_progress:
+                self.on_progress(0, size)
+            response = self.session.post(
+                f"{self.server_url}/delta/{self.remote_path}", data=delta, timeout=TIMEOUT,
+                headers={'If-Match': response.headers['ETag'],
+                         'Content-Type': 'application/octet-stream'})
+        if response.status_code in (404, 412):
+            # File rimosso o cambiato sul server: upload completo
+            return None
+        response.raise_for_status()
+        if self.on_progress:
+            self.on_progress(size, size)
+        return response.json()
+
+    def _fetch_signature(self):
+        """Risposta con la firma, attendendo se il server la sta calcolando; None se assente"""
+        url = f"{self.server_url}/signature/{self.remote_path}"
+        deadline = time.monotonic() + SIGNATURE_WAIT
+        while True:
+            response = self.session.get(url, timeout=TIMEOUT)
+            if response.status_code == 200 and response.headers.get('ETag'):
+                return response
+            if response.status_code in (400, 404, 405):
+                return None
+            response.raise_for_status()
+            if response.status_code != 202 or time.monotonic() >= deadline:
+                return None
+            time.sleep(float(response.headers.get('Retry-After', 1)))
@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+"""Client dello stream /events (Server-Sent Events) con ripresa automatica"""
+import json
+import threading
+
+import requests
+
+# Attesa massima tra due tentativi di riconnessione
+MAX_BACKOFF = 30
+# Senza dati per questo tempo la connessione è considerata persa (il server invia ping)
+READ_TIMEOUT = 45
+
+
+class EventStream:
+    """Segue le modifiche ai figli di una cartella del server.
+
+    `on_event(event)` riceve i dizionari degli eventi ('created', 'modified',
+    'deleted', 'reset'); `on_state(connected)` segnala connessione e
+    disconnessione. I callback sono chiamati dal thread dello stream.
+    """
+
+    def __init__(self, server_url, path, on_event, on_state=None):
+        self.url = f"{server_url}/events"
+        self.path = path
+        self.on_event = on_event
+        self.on_state = on_state
+        self.last_id = None
+        self._stopped = threading.Event()
+        self._response = None
+
+    def start(self):
+        threading.Thread(target=self._run, daemon=True).start()
+        return self
+
+    def stop(self):
+        self._stopped.set()
+        response = self._response
+        if response is not None:
+            response.close()
+
+    def _run(self):
+        backoff = 1
+        while not self._stopped.is_set():
+            try:
+                self._listen()
+                backoff = 1
+            except Exception:
+                # Include gli errori di lettura dopo stop(), che chiude la risposta
+                pass
+            if self._stopped.is_set():
+                break
+            if self.on_state:
+                self.on_state(False)
+            self._stopped.wait(backoff)
+            backoff = min(backoff * 2, MAX_BACKOFF)
+
+    def _listen(self):
+        headers = {'Accept': 'text/event-stream'}
+        if self.last_id is not None:
+            headers['Last-Event-ID'] = str(self.last_id)
+        with requests.get(self.url, params={'path': self.path}, headers=headers,
+                          stream=True, timeout=(10, READ_TIMEOUT)) as response:
+            response.raise_for_status()
+            self._response = response
+            if self.on_state:
+                self.on_state(True)
+            kind, data = 'message', []
+            for line in response.iter_lines(decode_unicode=True):
+                if self._stopped.is_set():
+                    return
+                if not line:
+                    # Riga vuota: fine dell'evento
+                    if data and kind not in ('ping', 'message'):
+                        event = json.loads('\n'.join(data))
+                        event.setdefault('type', kind)
+                        self.on_event(event)
+                    kind, data = 'message', []
+                elif line.startswith('id:'):
+                    self.last_id = int(line[3:].strip())
+                elif line.startswith('event:'):
+                    kind = line[6:].strip()
+                elif line.startswith('data:'):
+                    data.append(line[5:].lstrip())
+        self._response = None
@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+"""Cache LRU delle pagine di listing, in memoria e su disco"""
+import hashlib
+import json
+import os
+from collections import OrderedDict
+
+# Ogni quanti salvataggi controllare lo spazio occupato su disco
+EVICT_EVERY = 50
+
+
+def _digest(text):
+    return hashlib.sha1(text.encode('utf-8', 'surrogateescape')).hexdigest()
+
+
+class ListingCache:
+    """Pagine del listing con il loro ETag, per server, cartella e cursore.
+
+    Le pagine usate più di recente restano in memoria; tutte vengono salvate
+    anche su disco, così le cartelle già visitate si vedono subito anche dopo
+    un riavvio dell'app. Il contenuto può essere vecchio: va sempre
+    rivalidato con If-None-Match.
+    """
+
+    def __init__(self, directory, memory_pages, disk_max_bytes):
+        self.directory = directory
+        self.memory_pages = memory_pages
+        self.disk_max_bytes = disk_max_bytes
+        self._pages = OrderedDict()
+        self._saved = 0
+        os.makedirs(directory, exist_ok=True)
+        self.evict()
+
+    def _file(self, server_url, path, cursor):
+        # Il prefisso comune permette di invalidare tutte le pagine di una cartella
+        folder = _digest(f"{server_url}\0{path}")[:24]
+        return os.path.join(self.directory, f"{folder}-{_digest(cursor or '')[:12]}.json")
+
+    def get(self, server_url, path, cursor=None):
+        """(ETag, risultato) della pagina, o None se non è in cache"""
+        key = (server_url, path, cursor)
+        entry = self._pages.get(key)
+        if entry is not None:
+            self._pages.move_to_end(key)
+            return entry
+        file_path = self._file(server_url, path, cursor)
+        try:
+            with open(file_path) as f:
+                data = json.load(f)
+            entry = (data['etag'], data['result'])
+            # L'mtime del file registra l'ultimo uso per l'eviction
+            os.utime(file_path)
+        except (OSError, ValueError, KeyError):
+            return None
+        self._remember(key, entry)
+        return entry
+
+    def contains(self, server_url, path):
+        """True se la prima pagina della cartella è in cache"""
+        return ((server_url, path, None) in self._pages
+                or os.path.exists(self._file(server_url, path, None)))
+
+    def pages(self, server_url, path):
+        """Pagine consecutive in cache dall'inizio della cartella: lista di (ETag, risultato)"""
+        pages = []
+        cursor = None
+        while True:
+            entry = self.get(server_url, path, cursor)
+            if entry is None:
+                break
+            pages.append(entry)
+            cursor = entry[1].get('next_cursor')
+            if not cursor:
+                break
+        return pages
+
+    def put(self, server_url, path, cursor, etag, result):
+        """Salva una pagina ricevuta dal server"""
+        self._remember((server_url, path, cursor), (etag, result))
+        file_path = self._file(server_url, path, cursor)
+        tmp_path = file_path + '.tmp'
+        try:
+            with open(tmp_path, 'w') as f:
+                json.dump({'etag': etag, 'result': result}, f)
+            os.replace(tmp_path, file_path)
+        except OSError:
+            return
+        self._saved += 1
+        if self._saved % EVICT_EVERY == 0:
+            self.evict()
+
+    def invalidate(self, server_url, path):
+        """Dimentica tutte le pagine di una cartella (es. dopo una modifica locale)"""
+        for key in [key for key in self._pages if key[:2] == (server_url, path)]:
+            del self._pages[key]
+        prefix = os.path.basename(self._file(server_url, path, None)).split('-')[0] + '-'
+        for entry in os.scandir(self.directory):
+            if entry.name.startswith(prefix):
+                try:
+                    os.remove(entry.path)
+                except OSError:
+                    pass
+
+    def evict(self):
+        """Elimina dal disco le pagine usate meno di recente oltre disk_max_bytes"""
+        entries = []
+        total = 0
+        for entry in os.scandir(self.directory):
+            try:
+                stat_result = entry.stat()
+            except OSError:
+                continue
+            entries.append((stat_result.st_mtime, stat_result.st_size, entry.path))
+            total += stat_result.st_size
+        entries.sort()
+        for _, size, file_path in entries:
+            if total <= self.disk_max_bytes:
+                break
+            try:
+                os.remove(file_path)
+            except OSError:
+                pass
+            total -= size
+
+    def _remember(self, key, entry):
+        self._pages[key] = entry
+        self._pages.move_to_end(key)
+        while len(self._pages) > self.memory_pages:
+            self._pages.popitem(last=False)
@@ -4,79 +4,221 @@ from kivy.app import App
 from kivy.uix.boxlayout import BoxLayout
 from kivy.uix.gridlayout import GridLayout
 from kivy.uix.label import Label
+from kivy.uix.image import Image
+from kivy.uix.scrollview import ScrollView
 from kivy.uix.button import Button
+from kivy.uix.checkbox import CheckBox
 from kivy.uix.textinput import TextInput
 from kivy.uix.popup import Popup
 from kivy.uix.filechooser import FileChooserListView
-from kivy.uix.scrollview import ScrollView
+from kivy.uix.recycleview import RecycleView
+from kivy.uix.recycleview.views import RecycleDataViewBehavior
+from kivy.uix.recycleboxlayout import RecycleBoxLayout
 from kivy.clock import Clock
+from kivy.core.image import Image as CoreImage
+from kivy.metrics import dp
 from kivy.network.urlrequest import UrlRequest
 from kivy.utils import platform
 
+import io
 import json
+import mimetypes
 import os
 from functools import partial
+from urllib.parse import urlencode
+
+from delta import DeltaUpload
+from events import EventStream
+from listing_cache import ListingCache
+from previews import PreviewLoader
+from transfer_manager import TransferManager
+from transfers import ChunkedUpload, RangedDownload, stream_to_file
 
 kivy.require('2.0.0')
 
-class FileItem(BoxLayout):
-    """Widget per rappresentare un file o directory"""
+# Elementi richiesti al server per ogni pagina del listing
+LISTING_PAGE_SIZE = 500
+# Pagine di listing tenute in memoria per la rivalidazione con ETag
+LISTING_CACHE_PAGES = 200
+# Spazio massimo su disco delle pagine di listing salvate
+LISTING_DISK_CACHE_BYTES = 32 * 1024 * 1024
+# Cartelle precaricate dopo ogni listing (cartella padre e prime sottocartelle)
+PREFETCH_DIRECTORIES = 6
+# Attesa (secondi) prima di precaricare, e tra due tentativi se la rete è occupata
+PREFETCH_DELAY = 1.0
+# Connessioni parallele per i download di file grandi
+DOWNLOAD_SEGMENTS = 4
+# Trasferimenti eseguiti contemporaneamente; gli altri restano in coda
+TRANSFER_WORKERS = 4
+# Intervallo (secondi) di interrogazione dei job in background
+JOB_POLL_INTERVAL = 1.0
+# Formato degli archivi per il download delle cartelle
+FOLDER_ARCHIVE_FORMAT = 'zip'
+# Risultati massimi richiesti per una ricerca
+SEARCH_LIMIT = 200
+# Lato lungo (pixel) delle miniature nella lista e delle immagini nell'anteprima
+THUMBNAIL_SIZE = 64
+PREVIEW_IMAGE_SIZE = 1024
+# Download contemporanei di miniature e spazio su disco per salvarle
+PREVIEW_WORKERS = 2
+PREVIEW_DISK_CACHE_BYTES = 64 * 1024 * 1024
+
+def sort_key(file_info):
+    """Ordine del listing del server: prima le cartelle, poi per nome"""
+    return (not file_info['is_directory'], file_info['name'].lower(), file_info['name'])
+
+def human_size(nbytes):
+    """Dimensione leggibile (es. 3.2 MB)"""
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if nbytes < 1024 or unit == 'GB':
+            return f"{nbytes:.0f} {unit}" if unit == 'B' else f"{nbytes:.1f} {unit}"
+        nbytes /= 1024
+
+def parent_path(path):
+    """Cartella che contiene `path` ('' per la radice)"""
+    return path.rsplit('/', 1)[0] if '/' in path else ''
+
+def is_image(name):
+    """True per i file con un tipo immagine, per cui il server genera miniature"""
+    mimetype = mimetypes.guess_type(name)[0]
+    return bool(mimetype and mimetype.startswith('image/'))
+
+def image_texture(data):
+    """Texture Kivy da una miniatura JPEG o PNG ricevuta dal server"""
+    ext = 'png' if data.startswith(b'\x89PNG') else 'jpg'
+    return CoreImage(io.BytesIO(data), ext=ext).texture
+
+def response_header(request, name):
+    """Header della risposta di una UrlRequest, senza distinzione di maiuscole"""
+    for key, value in (request.resp_headers or {}).items():
+        if key.lower() == name.lower():
+            return value
+    return None
+
+class FileItem(RecycleDataViewBehavior, BoxLayout):
+    """Riga della lista file, riutilizzata dalla RecycleView per elementi diversi.
+
+    I widget figli vengono creati una volta sola; refresh_view_attrs li
+    aggiorna quando la riga passa a rappresentare un altro elemento.
+    """
     
-    def __init__(self, file_info, app_instance, **kwargs):
+    def __init__(self, **kwargs):
         super().__init__(**kwargs)
         self.orientation = 'horizontal'
-        self.size_hint_y = None
-        self.height = '48dp'
         self.spacing = '10dp'
         self.padding = '10dp'
         
-        self.file_info = file_info
-        self.app_instance = app_instance
+        self.file_info = None
+        self.app_instance = App.get_running_app()
+        
+        # Selezione multipla per le azioni in blocco; on_release scatta solo
+        # al tocco, non quando la riga riciclata aggiorna lo stato
+        self.checkbox = CheckBox(size_hint_x=None, width='30dp')
+        self.checkbox.bind(on_release=self.toggle_selection)
         
-        # Icona (emoji per semplicità)
-        icon = '📁' if file_info['is_directory'] else '📄'
-        icon_label = Label(text=icon, size_hint_x=None, width='30dp')
+        # Icona (emoji per semplicità), sostituita dalla miniatura per le immagini
+        self.icon_box = BoxLayout(size_hint_x=None, width='30dp')
+        self.icon_label = Label()
+        self.thumbnail = Image()
+        self.icon_box.add_widget(self.icon_label)
         
         # Nome file/directory
-        name_label = Label(
-            text=file_info['name'], 
+        self.name_label = Label(
             text_size=(None, None),
             halign='left',
             valign='middle'
         )
         
         # Pulsanti azione
-        actions_layout = BoxLayout(orientation='horizontal', size_hint_x=None, width='120dp')
+        self.actions_layout = BoxLayout(orientation='horizontal', size_hint_x=None, width='120dp')
         
-        if file_info['is_directory']:
-            open_btn = Button(text='Apri', size_hint_x=None, width='60dp')
-            open_btn.bind(on_press=self.open_directory)
-            actions_layout.add_widget(open_btn)
-        else:
-            download_btn = Button(text='↓', size_hint_x=None, width='60dp')
-            download_btn.bind(on_press=self.download_file)
-            actions_layout.add_widget(download_btn)
+        self.open_btn = Button(text='Apri', size_hint_x=None, width='60dp')
+        self.open_btn.bind(on_press=self.open_directory)
+        
+        self.preview_btn = Button(text='👁', size_hint_x=None, width='60dp')
+        self.preview_btn.bind(on_press=self.preview)
         
-        delete_btn = Button(text='🗑', size_hint_x=None, width='60dp')
-        delete_btn.bind(on_press=self.delete_item)
-        actions_layout.add_widget(delete_btn)
+        self.download_btn = Button(text='↓', size_hint_x=None, width='60dp')
+        self.download_btn.bind(on_press=self.download)
         
-        self.add_widget(icon_label)
-        self.add_widget(name_label)
-        self.add_widget(actions_layout)
+        self.delete_btn = Button(text='🗑', size_hint_x=None, width='60dp')
+        self.delete_btn.bind(on_press=self.delete_item)
+        
+        self.add_widget(self.checkbox)
+        self.add_widget(self.icon_box)
+        self.add_widget(self.name_label)
+        self.add_widget(self.actions_layout)
+    
+    def refresh_view_attrs(self, rv, index, data):
+        """Mostra nella riga l'elemento data['file_info']"""
+        super().refresh_view_attrs(rv, index, data)
+        file_info = self.file_info
+        self.checkbox.active = self.app_instance.is_selected(file_info)
+        self.icon_label.text = '📁' if file_info['is_directory'] else '📄'
+        self.name_label.text = file_info['name']
+        self.icon_box.clear_widgets()
+        self.icon_box.add_widget(self.icon_label)
+        # Solo le righe visibili esistono: la miniatura si carica quando la riga viene mostrata
+        if not file_info['is_directory'] and is_image(file_info['name']):
+            self.app_instance.load_thumbnail(self, file_info)
+        else:
+            self.app_instance.previews.cancel(self)
+        
+        self.actions_layout.clear_widgets()
+        self.actions_layout.width = '180dp'
+        if file_info['is_directory']:
+            self.actions_layout.add_widget(self.open_btn)
+        else:
+            self.actions_layout.add_widget(self.preview_btn)
+        self.actions_layout.add_widget(self.download_btn)
+        self.actions_layout.add_widget(self.delete_btn)
+    
+    def show_thumbnail(self, file_info, data):
+        """Mostra la miniatura se la riga rappresenta ancora lo stesso elemento"""
+        if self.file_info is not file_info or not data:
+            return
+        self.thumbnail.texture = image_texture(data)
+        self.icon_box.clear_widgets()
+        self.icon_box.add_widget(self.thumbnail)
+    
+    def toggle_selection(self, instance):
+        """Aggiungi o togli l'elemento dalla selezione"""
+        self.app_instance.set_selected(self.file_info, instance.active)
     
     def open_directory(self, instance):
         """Apri directory"""
         self.app_instance.load_files(self.file_info['relative_path'])
     
-    def download_file(self, instance):
-        """Scarica file"""
-        self.app_instance.download_file(self.file_info['relative_path'])
+    def preview(self, instance):
+        """Mostra l'anteprima del file senza scaricarlo"""
+        self.app_instance.show_preview(self.file_info)
+    
+    def download(self, instance):
+        """Scarica il file, o la cartella come archivio"""
+        if self.file_info['is_directory']:
+            self.app_instance.download_folder(self.file_info['relative_path'])
+        else:
+            self.app_instance.download_file(self.file_info['relative_path'])
     
     def delete_item(self, instance):
         """Elimina file o directory"""
         self.app_instance.show_delete_confirmation(self.file_info)
 
+class FileListView(RecycleView):
+    """Lista file virtualizzata: vengono creati solo i widget delle righe visibili"""
+    
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.viewclass = FileItem
+        layout = RecycleBoxLayout(
+            orientation='vertical',
+            default_size=(None, dp(48)),
+            default_size_hint=(1, None),
+            size_hint_y=None
+        )
+        layout.bind(minimum_height=layout.setter('height'))
+        self.add_widget(layout)
+
 class FileManagerApp(App):
     """App principale per la gestione file"""
     
@@ -84,9 +226,39 @@ class FileManagerApp(App):
         super().__init__(**kwargs)
         self.server_url = "http://100.95.136.3:5000"  # Modifica con l'IP del tuo server
         self.current_path = ""
+        self._listing_generation = 0
+        # Pagine del listing già viste, create in build() (serve user_data_dir)
+        self.listing_cache = None
+        # Path, ETag della prima pagina e cursore delle pagine ancora da caricare
+        # del listing attualmente visualizzato
+        self._displayed_listing = None
+        # Cartelle da precaricare quando la rete è libera
+        self._prefetch_queue = []
+        # Coda di upload e download; risultati degli upload in corso
+        self.transfers = TransferManager(
+            workers=TRANSFER_WORKERS,
+            connections=TRANSFER_WORKERS * DOWNLOAD_SEGMENTS,
+            on_update=lambda: Clock.schedule_once(self.show_transfer_status)
+        )
+        self._upload_results = {'done': 0, 'failed': []}
+        # ETag dei file già scaricati, per URL
+        self._download_etags = None
+        # Stream delle modifiche alla cartella corrente ed elementi visualizzati per path
+        self._event_stream = None
+        self._events_connected = False
+        self._file_items = {}
+        # Elementi selezionati per le azioni in blocco, per path relativo
+        self._selected = {}
+        # Miniature delle righe visibili, create in build() (serve user_data_dir)
+        self.previews = None
         
     def build(self):
         """Costruisci l'interfaccia"""
+        self.listing_cache = ListingCache(os.path.join(self.user_data_dir, 'listings'),
+                                          LISTING_CACHE_PAGES, LISTING_DISK_CACHE_BYTES)
+        self.previews = PreviewLoader(os.path.join(self.user_data_dir, 'previews'),
+                                      PREVIEW_DISK_CACHE_BYTES, PREVIEW_WORKERS)
+        
         main_layout = BoxLayout(orientation='vertical', padding='10dp', spacing='10dp')
         
         # Header con server URL e pulsanti
@@ -120,6 +292,23 @@ class FileManagerApp(App):
         
         main_layout.add_widget(nav_layout)
         
+        # Barra di ricerca
+        search_layout = BoxLayout(orientation='horizontal', size_hint_y=None, height='50dp')
+        
+        self.search_input = TextInput(
+            hint_text='Cerca nella cartella corrente',
+            multiline=False,
+            size_hint_x=0.7
+        )
+        self.search_input.bind(on_text_validate=self.search_files)
+        search_layout.add_widget(self.search_input)
+        
+        search_btn = Button(text='🔍 Cerca', size_hint_x=0.3)
+        search_btn.bind(on_press=self.search_files)
+        search_layout.add_widget(search_btn)
+        
+        main_layout.add_widget(search_layout)
+        
         # Pulsanti azione
         action_layout = BoxLayout(orientation='horizontal', size_hint_y=None, height='50dp')
         
@@ -135,15 +324,15 @@ class FileManagerApp(App):
         mkdir_btn.bind(on_press=self.show_mkdir_dialog)
         action_layout.add_widget(mkdir_btn)
         
-        main_layout.add_widget(action_layout)
+        self.delete_selected_btn = Button(text='🗑 Selezionati', disabled=True)
+        self.delete_selected_btn.bind(on_press=self.show_delete_selected_confirmation)
+        action_layout.add_widget(self.delete_selected_btn)
         
-        # Lista file (scrollabile)
-        self.files_layout = BoxLayout(orientation='vertical', size_hint_y=None)
-        self.files_layout.bind(minimum_height=self.files_layout.setter('height'))
+        main_layout.add_widget(action_layout)
         
-        scroll = ScrollView()
-        scroll.add_widget(self.files_layout)
-        main_layout.add_widget(scroll)
+        # Lista file (scrollabile, righe riciclate)
+        self.files_view = FileListView()
+        main_layout.add_widget(self.files_view)
         
         # Status bar
         self.status_label = Label(text='Pronto', size_hint_y=None, height='30dp')
@@ -159,38 +348,322 @@ class FileManagerApp(App):
         self.load_files()
     
     def load_files(self, path=""):
-        """Carica la lista dei file dal server"""
+        """Carica la lista dei file dal server, una pagina alla volta"""
         self.current_path = path
         self.path_label.text = f"/{path}" if path else "/"
         self.status_label.text = "Caricamento..."
         
+        # Le pagine di un listing precedente vengono ignorate
+        self._listing_generation += 1
+        self._prefetch_queue = []
+        # Cartella già vista: mostrala subito e rivalidala in background
+        displayed = self._displayed_listing
+        if not displayed or displayed[0] != path:
+            self.show_cached_listing(path)
+        self.load_files_page(path, None, self._listing_generation)
+        self.subscribe_events(path)
+    
+    def show_cached_listing(self, path):
+        """Mostra le pagine in cache di una cartella in attesa della risposta del server"""
+        pages = self.listing_cache.pages(self.server_url, path)
+        if not pages:
+            return False
+        self.update_files_list(pages[0][1].get('items', []))
+        for _, result in pages[1:]:
+            self.append_files(result.get('items', []))
+        self._displayed_listing = (path, pages[0][0], pages[-1][1].get('next_cursor'))
+        self.status_label.text = f"{len(self.files_view.data)} elementi (aggiornamento...)"
+        return True
+    
+    def subscribe_events(self, path):
+        """Segui le modifiche della cartella visualizzata invece di ricaricarla"""
+        stream = self._event_stream
+        if stream is not None and stream.path == path and stream.url.startswith(self.server_url):
+            return
+        self.unsubscribe_events()
+        
+        def on_event(event):
+            Clock.schedule_once(partial(self.apply_event, stream, event))
+        
+        def on_state(connected):
+            Clock.schedule_once(lambda dt: self.set_events_connected(stream, connected))
+        
+        stream = EventStream(self.server_url, path, on_event, on_state)
+        self._event_stream = stream.start()
+    
+    def unsubscribe_events(self):
+        """Chiudi lo stream delle modifiche"""
+        if self._event_stream is not None:
+            self._event_stream.stop()
+            self._event_stream = None
+        self._events_connected = False
+    
+    def set_events_connected(self, stream, connected):
+        if stream is self._event_stream:
+            self._events_connected = connected
+    
+    def apply_event(self, stream, event, dt):
+        """Applica una modifica alla lista visualizzata senza ricaricarla"""
+        if stream is not self._event_stream:
+            return
+        if event['type'] == 'reset':
+            self.load_files(self.current_path)
+            return
+        if event.get('parent') != self.current_path:
+            return
+        
+        existing = self._file_items.get(event['path'])
+        # Le pagine in cache della cartella non sono più aggiornate
+        self.listing_cache.invalidate(self.server_url, self.current_path)
+        if existing is not None:
+            self.remove_file_item(existing)
+        if event['type'] == 'deleted' and event['path'] in self._selected:
+            self.set_selected(self._selected[event['path']], False)
+        if event['type'] in ('created', 'modified') and event.get('item'):
+            self.insert_file_item(event['item'])
+        self.status_label.text = f"{len(self._file_items)} elementi"
+    
+    def load_files_page(self, path, cursor, generation):
+        """Richiedi una pagina del listing a partire dal cursore"""
         url = f"{self.server_url}/files"
         if path:
             url += f"/{path}"
+        url += f"?limit={LISTING_PAGE_SIZE}"
+        if cursor:
+            url += f"&cursor={cursor}"
+        
+        server_url = self.server_url
+        cached = self.listing_cache.get(server_url, path, cursor)
+        headers = {'If-None-Match': cached[0]} if cached else {}
         
         def on_success(request, result):
-            self.status_label.text = f"Caricati {result.get('total', 0)} elementi"
-            self.update_files_list(result.get('items', []))
+            if generation != self._listing_generation:
+                return
+            etag = response_header(request, 'ETag')
+            displayed = self._displayed_listing
+            if request.resp_status == 304 and cached:
+                # Listing invariato: se è già a schermo (anche dalla cache)
+                # restano da caricare solo le pagine che mancavano
+                if cursor is None and displayed and displayed[:2] == (path, cached[0]):
+                    if displayed[2]:
+                        self.load_files_page(path, displayed[2], generation)
+                    else:
+                        self.status_label.text = f"Nessuna modifica ({cached[1].get('total', 0)} elementi)"
+                        self.schedule_prefetch(path)
+                    return
+                etag, result = cached
+            elif etag:
+                self.listing_cache.put(server_url, path, cursor, etag, result)
+            
+            items = result.get('items', [])
+            next_cursor = result.get('next_cursor')
+            if cursor is None:
+                # Sostituisce l'eventuale versione in cache senza riportare in cima
+                self.update_files_list(items, scroll_to_top=not displayed or displayed[0] != path)
+                self._displayed_listing = (path, etag, next_cursor)
+            else:
+                self.append_files(items)
+                if displayed and displayed[0] == path:
+                    self._displayed_listing = (path, displayed[1], next_cursor)
+            
+            loaded = len(self.files_view.data)
+            if next_cursor:
+                self.status_label.text = f"Caricati {loaded} di {result.get('total', 0)} elementi..."
+                self.load_files_page(path, next_cursor, generation)
+            else:
+                self.status_label.text = f"Caricati {result.get('total', 0)} elementi"
+                self.schedule_prefetch(path)
         
         def on_error(request, error):
+            if generation != self._listing_generation:
+                return
             self.status_label.text = f"Errore: {error}"
             self.show_popup("Errore", f"Impossibile caricare i file: {error}")
         
+        # Il 304 arriva come redirect (classe 3xx)
+        UrlRequest(url, req_headers=headers, on_success=on_success,
+                   on_redirect=on_success, on_error=on_error)
+    
+    def search_files(self, instance):
+        """Cerca per nome sotto la cartella corrente"""
+        query = self.search_input.text.strip()
+        if not query:
+            self.load_files(self.current_path)
+            return
+        
+        # Le pagine del listing in corso vengono ignorate
+        self._listing_generation += 1
+        generation = self._listing_generation
+        self._displayed_listing = None
+        # I risultati non sono una cartella: niente aggiornamenti dallo stream
+        self.unsubscribe_events()
+        self.status_label.text = f"Ricerca di '{query}'..."
+        
+        params = {'q': query, 'limit': SEARCH_LIMIT}
+        if self.current_path:
+            params['path'] = self.current_path
+        url = f"{self.server_url}/search?{urlencode(params)}"
+        
+        def on_success(request, result):
+            if generation != self._listing_generation:
+                return
+            self.update_files_list(result.get('items', []))
+            self.status_label.text = f"Trovati {result.get('total', 0)} risultati per '{query}'"
+        
+        def on_error(request, error):
+            if generation != self._listing_generation:
+                return
+            self.status_label.text = f"Errore: {error}"
+            self.show_popup("Errore", f"Ricerca fallita: {error}")
+        
         UrlRequest(url, on_success=on_success, on_error=on_error)
     
-    def update_files_list(self, files):
+    def update_files_list(self, files, scroll_to_top=True):
         """Aggiorna la lista dei file nell'interfaccia"""
-        self.files_layout.clear_widgets()
+        self._file_items = {}
+        self.clear_selection()
+        self.files_view.data = []
+        if scroll_to_top:
+            self.files_view.scroll_y = 1
+        self.append_files(files)
+    
+    def schedule_prefetch(self, path):
+        """Precarica in cache le cartelle che è probabile vengano aperte dopo `path`"""
+        candidates = [parent_path(path)] if path else []
+        # Le cartelle sono in cima alla lista: le prime sono quelle visibili
+        for row in self.files_view.data:
+            if len(candidates) >= PREFETCH_DIRECTORIES or not row['file_info']['is_directory']:
+                break
+            candidates.append(row['file_info']['relative_path'])
+        self._prefetch_queue = [candidate for candidate in candidates
+                                if not self.listing_cache.contains(self.server_url, candidate)]
+        if self._prefetch_queue:
+            generation = self._listing_generation
+            Clock.schedule_once(lambda dt: self.prefetch_next(generation), PREFETCH_DELAY)
+    
+    def prefetch_next(self, generation):
+        """Scarica la prima pagina della prossima cartella da precaricare, una alla volta"""
+        if generation != self._listing_generation or not self._prefetch_queue:
+            return
+        if self.transfers.busy():
+            # La rete serve ai trasferimenti: riprova più tardi
+            Clock.schedule_once(lambda dt: self.prefetch_next(generation), PREFETCH_DELAY)
+            return
+        
+        path = self._prefetch_queue.pop(0)
+        server_url = self.server_url
+        url = f"{server_url}/files"
+        if path:
+            url += f"/{path}"
+        url += f"?limit={LISTING_PAGE_SIZE}"
+        
+        def on_success(request, result):
+            etag = response_header(request, 'ETag')
+            if etag:
+                self.listing_cache.put(server_url, path, None, etag, result)
+            self.prefetch_next(generation)
+        
+        def on_error(request, error):
+            # Rete non disponibile: niente altri precaricamenti per questo listing
+            self._prefetch_queue = []
         
+        UrlRequest(url, on_success=on_success, on_error=on_error, on_failure=on_error)
+    
+    def invalidate_listings(self, *paths):
+        """Dimentica le pagine in cache delle cartelle modificate da questo client"""
+        for path in paths:
+            self.listing_cache.invalidate(self.server_url, path)
+    
+    def show_transfer_status(self, dt=None):
+        """Avanzamento dei trasferimenti e velocità totale nella status bar"""
+        summary = self.transfers.summary()
+        counts = summary['counts']
+        active = counts.get('running', 0)
+        waiting = counts.get('queued', 0) + counts.get('retrying', 0)
+        if not active and not waiting:
+            self.transfers.clear_finished()
+            return
+        parts = [f"{active} in corso"]
+        if waiting:
+            parts.append(f"{waiting} in coda")
+        if counts.get('done'):
+            parts.append(f"{counts['done']} completati")
+        parts.append(f"{human_size(summary['speed'])}/s")
+        text = " · ".join(parts)
+        if summary['running']:
+            kind, name, done, total, speed = summary['running'][0]
+            arrow = '↑' if kind == 'upload' else '↓'
+            percent = f"{done * 100 // total}%" if total else human_size(done)
+            text += f" — {arrow} {name} {percent} ({human_size(speed)}/s)"
+        self.status_label.text = text
+    
+    def is_selected(self, file_info):
+        return file_info['relative_path'] in self._selected
+    
+    def set_selected(self, file_info, selected):
+        """Aggiorna la selezione e il pulsante delle azioni in blocco"""
+        if selected:
+            self._selected[file_info['relative_path']] = file_info
+        else:
+            self._selected.pop(file_info['relative_path'], None)
+        count = len(self._selected)
+        self.delete_selected_btn.disabled = count == 0
+        self.delete_selected_btn.text = f"🗑 Selezionati ({count})" if count else '🗑 Selezionati'
+    
+    def clear_selection(self):
+        """Deseleziona tutto"""
+        if not self._selected:
+            return
+        for file_info in list(self._selected.values()):
+            self.set_selected(file_info, False)
+        # Le righe visibili rileggono lo stato delle checkbox
+        self.files_view.refresh_from_data()
+    
+    def append_files(self, files):
+        """Aggiungi elementi in fondo alla lista (es. una nuova pagina del listing)"""
+        rows = []
         for file_info in files:
-            file_item = FileItem(file_info, self)
-            self.files_layout.add_widget(file_item)
+            self._file_items[file_info['relative_path']] = file_info
+            rows.append({'file_info': file_info})
+        # Un solo aggiornamento della vista per tutta la pagina
+        self.files_view.data.extend(rows)
+    
+    def file_item_index(self, key):
+        """Prima posizione nella lista con chiave di ordinamento >= key"""
+        data = self.files_view.data
+        low, high = 0, len(data)
+        while low < high:
+            middle = (low + high) // 2
+            if sort_key(data[middle]['file_info']) < key:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+    
+    def insert_file_item(self, file_info):
+        """Inserisci un elemento rispettando l'ordine del server (prima le cartelle)"""
+        index = self.file_item_index(sort_key(file_info))
+        self._file_items[file_info['relative_path']] = file_info
+        self.files_view.data.insert(index, {'file_info': file_info})
+    
+    def remove_file_item(self, file_info):
+        """Togli un elemento dalla lista"""
+        path = file_info['relative_path']
+        self._file_items.pop(path, None)
+        data = self.files_view.data
+        index = self.file_item_index(sort_key(file_info))
+        if index >= len(data) or data[index]['file_info']['relative_path'] != path:
+            # Lista non ordinata come previsto (es. risultati di ricerca)
+            index = next((i for i, row in enumerate(data)
+                          if row['file_info']['relative_path'] == path), None)
+            if index is None:
+                return
+        del data[index]
     
     def go_back(self, instance):
         """Torna alla directory parent"""
         if self.current_path:
-            parent_path = "/".join(self.current_path.split("/")[:-1])
-            self.load_files(parent_path)
+            self.load_files(parent_path(self.current_path))
         else:
             self.load_files()
     
@@ -198,44 +671,169 @@ class FileManagerApp(App):
         """Ricarica i file"""
         self.load_files(self.current_path)
     
+    def refresh_after_change(self):
+        """Dopo una modifica ricarica la lista solo se lo stream degli eventi non è attivo"""
+        if not self._events_connected:
+            self.refresh_files(None)
+    
+    def downloads_dir(self):
+        """Directory in cui salvare i download"""
+        # Su Android, salva nella directory Downloads
+        if platform == 'android':
+            from android.storage import primary_external_storage_path
+            return os.path.join(primary_external_storage_path(), 'Download')
+        return os.path.expanduser('~/Downloads')
+    
+    def download_etags(self):
+        """ETag dei file già scaricati, caricati dal disco alla prima richiesta"""
+        if self._download_etags is None:
+            try:
+                with open(os.path.join(self.user_data_dir, 'downloads.json')) as f:
+                    self._download_etags = json.load(f)
+            except (OSError, ValueError):
+                self._download_etags = {}
+        return self._download_etags
+    
+    def save_download_etag(self, url, etag):
+        """Ricorda l'ETag di un file scaricato"""
+        etags = self.download_etags()
+        etags[url] = etag
+        try:
+            with open(os.path.join(self.user_data_dir, 'downloads.json'), 'w') as f:
+                json.dump(etags, f)
+        except OSError:
+            pass
+    
     def download_file(self, filepath):
-        """Scarica un file"""
-        self.status_label.text = f"Scaricando {filepath}..."
-        
+        """Accoda il download di un file, che riprende un eventuale download interrotto"""
         url = f"{self.server_url}/download/{filepath}"
+        save_path = os.path.join(self.downloads_dir(), os.path.basename(filepath))
+        known_etag = self.download_etags().get(url)
+        checksum_url = f"{self.server_url}/checksum/{filepath}"
+        
+        def run(session, on_progress):
+            download = RangedDownload(url, save_path, segments=DOWNLOAD_SEGMENTS,
+                                      on_progress=on_progress, known_etag=known_etag,
+                                      checksum_url=checksum_url, session=session)
+            download.run()
+            return download
+        
+        def on_done(transfer, dt):
+            if transfer.error is not None:
+                self.status_label.text = f"Errore download: {transfer.error}"
+                self.show_popup("Errore", f"Errore nel download: {transfer.error}")
+                return
+            download = transfer.result
+            if download.etag:
+                self.save_download_etag(url, download.etag)
+            if download.skipped:
+                self.status_label.text = f"File già aggiornato: {save_path}"
+                return
+            verified = " (checksum verificato)" if download.verified else ""
+            self.status_label.text = f"File salvato: {save_path}{verified}"
+            self.show_popup("Successo", f"File scaricato in: {save_path}{verified}")
+        
+        self.status_label.text = f"Download di {filepath} in coda..."
+        self.transfers.submit('download', os.path.basename(filepath), run,
+                              lambda transfer: Clock.schedule_once(partial(on_done, transfer)))
+    
+    def load_thumbnail(self, item, file_info):
+        """Miniatura di un'immagine per la riga `item`: dal disco o scaricata in background"""
+        url = f"{self.server_url}/preview/{file_info['relative_path']}?size={THUMBNAIL_SIZE}"
+        version = f"{file_info['size']}:{file_info['modified']}"
+        data = self.previews.cached(url, version)
+        if data is not None:
+            self.previews.cancel(item)
+            item.show_thumbnail(file_info, data)
+            return
+        self.previews.request(item, url, version, lambda data: Clock.schedule_once(
+            lambda dt: item.show_thumbnail(file_info, data)))
+    
+    def show_preview(self, file_info):
+        """Anteprima di un file: immagine ridotta, inizio del testo o metadati"""
+        path = file_info['relative_path']
+        url = f"{self.server_url}/preview/{path}?size={PREVIEW_IMAGE_SIZE}"
+        self.status_label.text = f"Anteprima di {file_info['name']}..."
         
         def on_success(request, result):
-            # Su Android, salva nella directory Downloads
-            if platform == 'android':
-                from android.storage import primary_external_storage_path
-                downloads_path = os.path.join(primary_external_storage_path(), 'Download')
+            if request.resp_status == 202:
+                # Il server sta ancora generando l'anteprima
+                Clock.schedule_once(lambda dt: self.show_preview(file_info), 1)
+                return
+            self.status_label.text = "Pronto"
+            kind = response_header(request, 'X-Preview-Kind')
+            if kind == 'image':
+                body = Image(texture=image_texture(result))
+            elif kind == 'text':
+                text = result.decode('utf-8', 'replace') if isinstance(result, bytes) else result
+                if response_header(request, 'X-Preview-Truncated') == '1':
+                    text += "\n…"
+                body = ScrollView()
+                label = Label(text=text, size_hint_y=None, halign='left', valign='top')
+                label.bind(width=lambda widget, width: setattr(widget, 'text_size', (width, None)),
+                           texture_size=lambda widget, size: setattr(widget, 'height', size[1]))
+                body.add_widget(label)
             else:
-                downloads_path = os.path.expanduser('~/Downloads')
-            
-            filename = os.path.basename(filepath)
-            save_path = os.path.join(downloads_path, filename)
-            
-            try:
-                with open(save_path, 'wb') as f:
-                    f.write(result)
-                self.status_label.text = f"File salvato: {save_path}"
-                self.show_popup("Successo", f"File scaricato in: {save_path}")
-            except Exception as e:
-                self.status_label.text = f"Errore salvataggio: {e}"
-                self.show_popup("Errore", f"Errore nel salvare il file: {e}")
+                info = result.get('file_info') or file_info
+                body = Label(text=f"{info['name']}\n{human_size(info['size'])}\n"
+                                  f"Modificato: {info['modified']}\n"
+                                  f"Tipo: {result.get('mimetype') or 'sconosciuto'}")
+            self.show_preview_popup(file_info, body)
         
         def on_error(request, error):
-            self.status_label.text = f"Errore download: {error}"
-            self.show_popup("Errore", f"Errore nel download: {error}")
+            self.status_label.text = f"Errore anteprima: {error}"
         
-        UrlRequest(url, on_success=on_success, on_error=on_error)
+        UrlRequest(url, on_success=on_success, on_error=on_error, on_failure=on_error)
+    
+    def show_preview_popup(self, file_info, body):
+        content = BoxLayout(orientation='vertical', spacing='10dp', padding='10dp')
+        content.add_widget(body)
+        
+        buttons_layout = BoxLayout(orientation='horizontal', size_hint_y=None, height='50dp')
+        download_btn = Button(text='↓ Scarica')
+        close_btn = Button(text='Chiudi')
+        buttons_layout.add_widget(download_btn)
+        buttons_layout.add_widget(close_btn)
+        content.add_widget(buttons_layout)
+        
+        popup = Popup(title=file_info['name'], content=content, size_hint=(0.9, 0.9))
+        
+        def download(instance):
+            self.download_file(file_info['relative_path'])
+            popup.dismiss()
+        
+        download_btn.bind(on_press=download)
+        close_btn.bind(on_press=popup.dismiss)
+        popup.open()
+    
+    def download_folder(self, dirpath):
+        """Accoda il download di una cartella come archivio generato dal server in streaming"""
+        url = f"{self.server_url}/download/{dirpath}?format={FOLDER_ARCHIVE_FORMAT}"
+        filename = f"{os.path.basename(dirpath.rstrip('/'))}.{FOLDER_ARCHIVE_FORMAT}"
+        save_path = os.path.join(self.downloads_dir(), filename)
+        
+        def run(session, on_progress):
+            # La dimensione dell'archivio non è nota in anticipo: avanzamento in byte
+            return stream_to_file(url, save_path, on_progress, session=session)
+        
+        def on_done(transfer, dt):
+            if transfer.error is not None:
+                self.status_label.text = f"Errore download: {transfer.error}"
+                self.show_popup("Errore", f"Errore nel download: {transfer.error}")
+                return
+            self.status_label.text = f"Archivio salvato: {save_path}"
+            self.show_popup("Successo", f"Cartella scaricata in: {save_path}")
+        
+        self.status_label.text = f"Download della cartella {dirpath} in coda..."
+        self.transfers.submit('download', filename, run,
+                              lambda transfer: Clock.schedule_once(partial(on_done, transfer)))
     
     def show_upload_dialog(self, instance):
         """Mostra dialog per upload file"""
         content = BoxLayout(orientation='vertical', spacing='10dp')
         
-        # File chooser
-        filechooser = FileChooserListView()
+        # File chooser (selezione multipla: i file vanno nella coda dei trasferimenti)
+        filechooser = FileChooserListView(multiselect=True)
         content.add_widget(filechooser)
         
         # Pulsanti
@@ -250,44 +848,65 @@ class FileManagerApp(App):
         
         popup = Popup(title='Seleziona file da caricare', content=content, size_hint=(0.9, 0.9))
         
-        def upload_file(instance):
+        def upload_files(instance):
             if filechooser.selection:
-                self.upload_file(filechooser.selection[0])
+                self.upload_files(filechooser.selection)
                 popup.dismiss()
         
         def cancel(instance):
             popup.dismiss()
         
-        upload_btn.bind(on_press=upload_file)
+        upload_btn.bind(on_press=upload_files)
         cancel_btn.bind(on_press=cancel)
         
         popup.open()
     
-    def upload_file(self, filepath):
-        """Carica un file sul server"""
-        self.status_label.text = f"Caricando {os.path.basename(filepath)}..."
-        
-        url = f"{self.server_url}/upload"
-        
-        def on_success(request, result):
-            self.status_label.text = "File caricato con successo"
-            self.refresh_files(None)
-            self.show_popup("Successo", "File caricato con successo!")
-        
-        def on_error(request, error):
-            self.status_label.text = f"Errore upload: {error}"
-            self.show_popup("Errore", f"Errore nel caricamento: {error}")
-        
-        try:
-            with open(filepath, 'rb') as f:
-                files = {'file': (os.path.basename(filepath), f.read())}
-                data = {'path': self.current_path}
-                
-                UrlRequest(url, on_success=on_success, on_error=on_error, 
-                          req_body=files, req_headers={'Content-Type': 'multipart/form-data'})
-        except Exception as e:
-            self.status_label.text = f"Errore lettura file: {e}"
-            self.show_popup("Errore", f"Errore nella lettura del file: {e}")
+    def upload_files(self, filepaths):
+        """Accoda l'upload dei file nella cartella corrente"""
+        remote_dir = self.current_path
+        state_dir = os.path.join(self.user_data_dir, 'uploads')
+        server_url = self.server_url
+        
+        for filepath in filepaths:
+            if os.path.isdir(filepath):
+                continue
+            
+            def run(session, on_progress, filepath=filepath):
+                # Se il file esiste già sul server si inviano solo i blocchi cambiati
+                result = DeltaUpload(server_url, filepath, remote_dir,
+                                     on_progress=on_progress, session=session).run()
+                if result is not None:
+                    return result
+                # Upload a blocchi: un nuovo tentativo riprende la sessione salvata
+                return ChunkedUpload(server_url, filepath, remote_dir, state_dir,
+                                     on_progress=on_progress, session=session).run()
+            
+            self.transfers.submit('upload', os.path.basename(filepath), run,
+                                  partial(self.upload_finished, remote_dir))
+        self.show_transfer_status()
+    
+    def upload_finished(self, remote_dir, transfer):
+        Clock.schedule_once(lambda dt: self.upload_result(remote_dir, transfer))
+    
+    def upload_result(self, remote_dir, transfer):
+        """Conta gli upload terminati; alla fine della coda aggiorna la lista e riassume"""
+        results = self._upload_results
+        if transfer.error is not None:
+            results['failed'].append(f"{transfer.name}: {transfer.error}")
+        else:
+            results['done'] += 1
+        self.invalidate_listings(remote_dir)
+        if self.transfers.pending('upload'):
+            return
+        
+        self._upload_results = {'done': 0, 'failed': []}
+        self.refresh_after_change()
+        if results['failed']:
+            self.status_label.text = f"Caricati {results['done']} file, {len(results['failed'])} errori"
+            self.show_popup("Errore", "Non caricati:\n" + "\n".join(results['failed'][:10]))
+        else:
+            self.status_label.text = f"Caricati {results['done']} file"
+            self.show_popup("Successo", f"{results['done']} file caricati con successo!")
     
     def show_mkdir_dialog(self, instance):
         """Mostra dialog per creare directory"""
@@ -327,12 +946,14 @@ class FileManagerApp(App):
         self.status_label.text = f"Creando cartella {name}..."
         
         url = f"{self.server_url}/mkdir"
-        data = json.dumps({'name': name, 'path': self.current_path})
+        parent = self.current_path
+        data = json.dumps({'name': name, 'path': parent})
         headers = {'Content-Type': 'application/json'}
         
         def on_success(request, result):
             self.status_label.text = "Cartella creata con successo"
-            self.refresh_files(None)
+            self.invalidate_listings(parent)
+            self.refresh_after_change()
             self.show_popup("Successo", "Cartella creata con successo!")
         
         def on_error(request, error):
@@ -379,8 +1000,13 @@ class FileManagerApp(App):
         url = f"{self.server_url}/delete/{path}"
         
         def on_success(request, result):
+            self.invalidate_listings(parent_path(path), path)
+            self.refresh_after_change()
+            if request.resp_status == 202 and result.get('job_id'):
+                # Cartella: l'eliminazione prosegue in background sul server
+                self.poll_job(result['job_id'], f"Eliminando {path}")
+                return
             self.status_label.text = "Eliminato con successo"
-            self.refresh_files(None)
             self.show_popup("Successo", "Elemento eliminato con successo!")
         
         def on_error(request, error):
@@ -389,6 +1015,91 @@ class FileManagerApp(App):
         
         UrlRequest(url, method='DELETE', on_success=on_success, on_error=on_error)
     
+    def show_delete_selected_confirmation(self, instance):
+        """Mostra conferma per l'eliminazione degli elementi selezionati"""
+        if not self._selected:
+            return
+        content = BoxLayout(orientation='vertical', spacing='20dp', padding='20dp')
+        
+        msg = f"Sei sicuro di voler eliminare {len(self._selected)} elementi?"
+        content.add_widget(Label(text=msg))
+        
+        buttons_layout = BoxLayout(orientation='horizontal')
+        
+        cancel_btn = Button(text='Annulla')
+        delete_btn = Button(text='Elimina')
+        
+        buttons_layout.add_widget(cancel_btn)
+        buttons_layout.add_widget(delete_btn)
+        content.add_widget(buttons_layout)
+        
+        popup = Popup(title='Conferma Eliminazione', content=content, size_hint=(0.8, 0.5))
+        
+        def delete_items(instance):
+            self.delete_items(list(self._selected))
+            popup.dismiss()
+        
+        def cancel(instance):
+            popup.dismiss()
+        
+        delete_btn.bind(on_press=delete_items)
+        cancel_btn.bind(on_press=cancel)
+        
+        popup.open()
+    
+    def delete_items(self, paths):
+        """Elimina più elementi con una sola richiesta /batch"""
+        self.status_label.text = f"Eliminando {len(paths)} elementi..."
+        
+        url = f"{self.server_url}/batch"
+        data = json.dumps({'operations': [{'op': 'delete', 'path': path} for path in paths]})
+        headers = {'Content-Type': 'application/json'}
+        
+        def on_success(request, result):
+            self.clear_selection()
+            self.invalidate_listings(*{parent_path(path) for path in paths}, *paths)
+            self.refresh_after_change()
+            jobs = [item['result']['job_id'] for item in result.get('results', [])
+                    if item.get('status') == 202]
+            errors = [f"{item['path']}: {item['error']}"
+                      for item in result.get('results', []) if 'error' in item]
+            text = f"Eliminati {result.get('succeeded', 0)} elementi"
+            if jobs:
+                text += f" ({len(jobs)} cartelle in background)"
+            self.status_label.text = text
+            if errors:
+                self.show_popup("Errore", "Non eliminati:\n" + "\n".join(errors[:10]))
+        
+        def on_error(request, error):
+            self.status_label.text = f"Errore eliminazione: {error}"
+            self.show_popup("Errore", f"Errore nell'eliminazione: {error}")
+        
+        UrlRequest(url, req_body=data, req_headers=headers,
+                   on_success=on_success, on_error=on_error)
+    
+    def poll_job(self, job_id, description):
+        """Segui l'avanzamento di un job del server nella status bar"""
+        url = f"{self.server_url}/jobs/{job_id}"
+        
+        def on_success(request, job):
+            if job.get('status') == 'done':
+                self.status_label.text = f"{description}: completato ({job['items_processed']} elementi)"
+            elif job.get('status') == 'failed':
+                self.status_label.text = f"{description}: errore"
+                self.show_popup("Errore", f"Errore nell'operazione: {job.get('error')}")
+            else:
+                self.status_label.text = f"{description}... {job.get('items_processed', 0)} elementi"
+                Clock.schedule_once(lambda dt: self.poll_job(job_id, description), JOB_POLL_INTERVAL)
+        
+        def on_error(request, error):
+            self.status_label.text = f"{description}: stato non disponibile ({error})"
+        
+        UrlRequest(url, on_success=on_success, on_error=on_error)
+    
+    def on_stop(self):
+        self.unsubscribe_events()
+        self.transfers.shutdown()
+    
     def show_popup(self, title, message):
         """Mostra popup informativo"""
         content = BoxLayout(orientation='vertical', spacing='20dp', padding='20dp')
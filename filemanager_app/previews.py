@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+"""Miniature delle righe visibili della lista file, scaricate in background e salvate su disco"""
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import requests
+
+from transfers import TIMEOUT
+
+# Ogni quanti salvataggi controllare lo spazio occupato su disco
+EVICT_EVERY = 50
+# Tentativi quando il server risponde 202 (anteprima in preparazione)
+PENDING_RETRIES = 5
+
+
+class PreviewLoader:
+    """Scarica le anteprime richieste dalle righe della lista, le più recenti per prime.
+
+    Ogni riga (`owner`) ha al più una richiesta in attesa: quando la
+    RecycleView la riusa per un altro elemento la richiesta precedente
+    viene sostituita, così scorrendo velocemente si scaricano solo le
+    anteprime delle righe rimaste visibili. Le anteprime restano su disco,
+    chiave URL + versione del file (dimensione e data di modifica); b''
+    indica un file senza miniatura, per non richiederla di nuovo.
+
+    `callback(dati)` viene chiamata da un thread del loader.
+    """
+
+    def __init__(self, directory, max_bytes, workers=2):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._pending = OrderedDict()
+        self._condition = threading.Condition()
+        self._saved = 0
+        os.makedirs(directory, exist_ok=True)
+        self.evict()
+        for i in range(workers):
+            threading.Thread(target=self._run, daemon=True, name=f'preview-{i}').start()
+
+    def _file(self, url, version):
+        key = f"{url}\0{version}"
+        return os.path.join(self.directory, hashlib.sha1(key.encode('utf-8', 'surrogateescape')).hexdigest())
+
+    def cached(self, url, version):
+        """Anteprima già su disco, o None"""
+        file_path = self._file(url, version)
+        try:
+            with open(file_path, 'rb') as f:
+                data = f.read()
+            # L'mtime del file registra l'ultimo uso per l'eviction
+            os.utime(file_path)
+        except OSError:
+            return None
+        return data
+
+    def request(self, owner, url, version, callback):
+        """Accoda l'anteprima per `owner`, sostituendo la sua richiesta precedente"""
+        with self._condition:
+            self._pending.pop(owner, None)
+            self._pending[owner] = (url, version, callback)
+            self._condition.notify()
+
+    def cancel(self, owner):
+        with self._condition:
+            self._pending.pop(owner, None)
+
+    def _run(self):
+        session = requests.Session()
+        while True:
+            with self._condition:
+                while not self._pending:
+                    self._condition.wait()
+                _, (url, version, callback) = self._pending.popitem(last=True)
+            data = self.cached(url, version)
+            if data is None:
+                data = self._fetch(session, url)
+                if data is None:
+                    continue
+                self._save(url, version, data)
+            callback(data)
+
+    def _fetch(self, session, url):
+        """Miniatura scaricata, b'' se il file non ne ha, None in caso di errore"""
+        try:
+            for _ in range(PENDING_RETRIES):
+                response = session.get(url, timeout=TIMEOUT)
+                if response.status_code != 202:
+                    break
+                time.sleep(float(response.headers.get('Retry-After', 1)))
+            else:
+                return None
+            if response.status_code == 404:
+                return b''
+            response.raise_for_status()
+        except requests.RequestException:
+            return None
+        if response.headers.get('X-Preview-Kind') != 'image':
+            return b''
+        return response.content
+
+    def _save(self, url, version, data):
+        file_path = self._file(url, version)
+        tmp_path = f"{file_path}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, file_path)
+        except OSError:
+            return
+        self._saved += 1
+        if self._saved % EVICT_EVERY == 0:
+            self.evict()
+
+    def evict(self):
+        """Elimina le anteprime meno usate finché lo spazio su disco supera max_bytes"""
+        entries = []
+        total = 0
+        for entry in os.scandir(self.directory):
+            try:
+                stat_result = entry.stat()
+            except OSError:
+                continue
+            entries.append((stat_result.st_mtime, stat_result.st_size, entry.path))
+            total += stat_result.st_size
+        entries.sort()
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total -= size
@@ -0,0 +1,225 @@
+#!/usr/bin/env python3
+"""Coda dei trasferimenti con parallelismo limitato, ripetizione e misura della velocità"""
+import threading
+import time
+import uuid
+from collections import deque
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from transfers import DownloadError
+
+# Finestra (secondi) su cui si misura la velocità
+RATE_WINDOW = 3.0
+# Intervallo minimo tra due notifiche di avanzamento
+UPDATE_INTERVAL = 0.25
+# Attesa massima tra due tentativi dello stesso trasferimento
+MAX_BACKOFF = 60
+
+
+def retryable(error):
+    """True per gli errori di rete e del server, False per le richieste rifiutate (4xx)"""
+    if isinstance(error, requests.HTTPError) and error.response is not None:
+        status = error.response.status_code
+        return status >= 500 or status in (408, 429)
+    return isinstance(error, (requests.RequestException, DownloadError))
+
+
+class _Rate:
+    """Velocità media negli ultimi RATE_WINDOW secondi di un contatore crescente"""
+
+    def __init__(self):
+        self._samples = deque()
+
+    def add(self, value, now):
+        self._samples.append((now, value))
+        while len(self._samples) > 2 and now - self._samples[0][0] > RATE_WINDOW:
+            self._samples.popleft()
+
+    def per_second(self, now):
+        if len(self._samples) < 2 or now - self._samples[-1][0] > RATE_WINDOW:
+            return 0.0
+        (start, first), (stop, last) = self._samples[0], self._samples[-1]
+        return (last - first) / (stop - start) if stop > start else 0.0
+
+
+class Transfer:
+    """Upload o download in coda.
+
+    `run(session, on_progress)` esegue il trasferimento usando la sessione
+    HTTP condivisa e restituisce il risultato; viene chiamata di nuovo a
+    ogni tentativo, quindi deve saper riprendere da dove si era fermata.
+    """
+
+    def __init__(self, kind, name, run, on_done=None):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.name = name
+        self.status = 'queued'
+        self.done = 0
+        self.total = 0
+        self.attempts = 0
+        self.error = None
+        self.result = None
+        self._run = run
+        self._on_done = on_done
+        self._rate = _Rate()
+        self._reported = None
+
+    def speed(self, now=None):
+        """Byte al secondo negli ultimi secondi"""
+        return self._rate.per_second(time.monotonic() if now is None else now)
+
+
+class TransferManager:
+    """Esegue i trasferimenti in coda con al massimo `workers` alla volta.
+
+    Tutti i trasferimenti condividono una sessione requests, quindi le
+    connessioni keep-alive verso il server vengono riutilizzate invece di
+    aprirne una per richiesta. Un trasferimento fallito per un errore di
+    rete torna in coda con attesa esponenziale fino a `retries` volte.
+    `on_update()` viene chiamata (dai thread dei trasferimenti, al più ogni
+    UPDATE_INTERVAL) quando cambiano stato o avanzamento.
+    """
+
+    def __init__(self, workers=4, retries=5, connections=16, on_update=None):
+        self.workers = workers
+        self.retries = retries
+        self.on_update = on_update
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=connections)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self._queue = deque()
+        self._transfers = []
+        self._condition = threading.Condition()
+        self._threads = []
+        self._stopped = False
+        self._moved = 0
+        self._rate = _Rate()
+        self._notified = 0
+
+    def submit(self, kind, name, run, on_done=None):
+        """Accoda un trasferimento; on_done(transfer) viene chiamata alla fine"""
+        transfer = Transfer(kind, name, run, on_done)
+        with self._condition:
+            self._transfers.append(transfer)
+            self._queue.append(transfer)
+            # I thread partono solo quando servono
+            if len(self._threads) < self.workers:
+                thread = threading.Thread(target=self._worker, daemon=True)
+                self._threads.append(thread)
+                thread.start()
+            self._condition.notify()
+        self._notify(force=True)
+        return transfer
+
+    def pending(self, kind=None):
+        """Trasferimenti non ancora terminati (in coda, in corso o in attesa di ripetizione)"""
+        with self._condition:
+            return sum(1 for transfer in self._transfers
+                       if transfer.status not in ('done', 'failed')
+                       and (kind is None or transfer.kind == kind))
+
+    def busy(self):
+        return self.pending() > 0
+
+    def summary(self):
+        """Stato aggregato: conteggi per stato, velocità totale e trasferimenti in corso"""
+        now = time.monotonic()
+        with self._condition:
+            transfers = list(self._transfers)
+            speed = self._rate.per_second(now)
+        counts = {}
+        for transfer in transfers:
+            counts[transfer.status] = counts.get(transfer.status, 0) + 1
+        running = [(transfer.kind, transfer.name, transfer.done, transfer.total,
+                    transfer.speed(now))
+                   for transfer in transfers if transfer.status == 'running']
+        return {'counts': counts, 'speed': speed, 'running': running}
+
+    def clear_finished(self):
+        """Dimentica i trasferimenti terminati (per i conteggi del riepilogo)"""
+        with self._condition:
+            self._transfers = [transfer for transfer in self._transfers
+                               if transfer.status not in ('done', 'failed')]
+
+    def shutdown(self):
+        """Ferma i thread dopo i trasferimenti in corso; quelli in coda vengono scartati"""
+        with self._condition:
+            self._stopped = True
+            self._queue.clear()
+            self._condition.notify_all()
+        self.session.close()
+
+    def _worker(self):
+        while True:
+            with self._condition:
+                while not self._queue and not self._stopped:
+                    self._condition.wait()
+                if self._stopped:
+                    return
+                transfer = self._queue.popleft()
+                transfer.status = 'running'
+                transfer.attempts += 1
+                transfer._reported = None
+                transfer._rate = _Rate()
+            self._notify(force=True)
+            self._execute(transfer)
+
+    def _execute(self, transfer):
+        def on_progress(done, total):
+            self._progress(transfer, done, total)
+
+        try:
+            transfer.result = transfer._run(self.session, on_progress)
+        except Exception as e:
+            transfer.error = e
+            if retryable(e) and transfer.attempts <= self.retries and not self._stopped:
+                # Di nuovo in coda dopo l'attesa; i trasferimenti riprendono da dove erano
+                transfer.status = 'retrying'
+                delay = min(2 ** transfer.attempts, MAX_BACKOFF)
+                timer = threading.Timer(delay, self._requeue, args=(transfer,))
+                timer.daemon = True
+                timer.start()
+                self._notify(force=True)
+                return
+            transfer.status = 'failed'
+        else:
+            transfer.error = None
+            transfer.status = 'done'
+        self._notify(force=True)
+        if transfer._on_done is not None:
+            transfer._on_done(transfer)
+
+    def _requeue(self, transfer):
+        with self._condition:
+            if self._stopped:
+                return
+            transfer.status = 'queued'
+            self._queue.append(transfer)
+            self._condition.notify()
+
+    def _progress(self, transfer, done, total):
+        now = time.monotonic()
+        with self._condition:
+            # Il primo valore di ogni tentativo include i byte di una ripresa:
+            # non contano nella velocità
+            if transfer._reported is not None and done >= transfer._reported:
+                self._moved += done - transfer._reported
+            transfer._reported = done
+            transfer.done = done
+            transfer.total = total
+            transfer._rate.add(done, now)
+            self._rate.add(self._moved, now)
+        self._notify()
+
+    def _notify(self, force=False):
+        if self.on_update is None:
+            return
+        now = time.monotonic()
+        if not force and now - self._notified < UPDATE_INTERVAL:
+            return
+        self._notified = now
+        self.on_update()
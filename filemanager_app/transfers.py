@@ -0,0 +1,493 @@
+#!/usr/bin/env python3
+"""Trasferimenti ripristinabili: download con richieste Range e upload a blocchi"""
+import base64
+import binascii
+import hashlib
+import json
+import os
+import threading
+import time
+
+import requests
+
+# Dimensione dei blocchi scritti su disco
+CHUNK_SIZE = 64 * 1024
+# Sotto questa dimensione per segmento non conviene dividere il download
+MIN_SEGMENT_SIZE = 4 * 1024 * 1024
+# Ogni quanti byte salvare lo stato del download
+STATE_SAVE_INTERVAL = 1024 * 1024
+# Dimensione massima dei blocchi inviati nelle sessioni di upload
+CHUNKED_UPLOAD_SIZE = 4 * 1024 * 1024
+# Timeout (connessione, lettura) delle richieste
+TIMEOUT = (10, 60)
+# Attesa massima del checksum calcolato dal server dopo un download
+CHECKSUM_WAIT = 60
+
+
+class DownloadError(Exception):
+    """Errore non recuperabile durante un download"""
+
+
+class _RemoteChanged(Exception):
+    """Il file sul server è cambiato durante il download"""
+
+
+def _parse_repr_digest(value):
+    """Digest sha256 esadecimale dall'header Repr-Digest, o None"""
+    for item in (value or '').split(','):
+        name, _, encoded = item.strip().partition('=')
+        if name.lower() == 'sha-256' and len(encoded) > 2 and encoded[0] == encoded[-1] == ':':
+            try:
+                return base64.b64decode(encoded[1:-1], validate=True).hex()
+            except (binascii.Error, ValueError):
+                return None
+    return None
+
+
+class _StreamDigest:
+    """SHA-256 dei byte scritti in ordine dall'inizio del file.
+
+    I blocchi che proseguono la parte già inclusa aggiornano il digest
+    mentre vengono scritti; quelli degli altri segmenti (o scaricati prima di
+    una ripresa) vengono riletti dal file solo alla fine.
+    """
+
+    def __init__(self):
+        self._hash = hashlib.sha256()
+        self._position = 0
+        self._lock = threading.Lock()
+
+    def feed(self, offset, data):
+        with self._lock:
+            if offset == self._position:
+                self._hash.update(data)
+                self._position += len(data)
+
+    def finish(self, path, size):
+        with self._lock, open(path, 'rb') as f:
+            f.seek(self._position)
+            while self._position < size:
+                data = f.read(min(CHUNK_SIZE, size - self._position))
+                if not data:
+                    break
+                self._hash.update(data)
+                self._position += len(data)
+            return self._hash.hexdigest()
+
+
+def _split(size, segments):
+    if size == 0:
+        return []
+    count = max(1, min(segments, size // MIN_SEGMENT_SIZE))
+    step = -(-size // count)
+    return [[start, min(start + step, size), 0] for start in range(0, size, step)]
+
+
+class RangedDownload:
+    """Scarica un URL in un file .part riprendendo dall'offset già presente.
+
+    Lo stato (ETag, dimensione e avanzamento di ogni segmento) viene salvato
+    accanto al file parziale, così un download interrotto riparte da dove si
+    era fermato. Se il file cambia sul server il download ricomincia da zero.
+
+    Il file ricevuto viene confrontato con il digest SHA-256 del server
+    (header Repr-Digest o `checksum_url`); `verified` indica l'esito.
+    Con `session` le richieste riutilizzano le connessioni di una sessione
+    requests condivisa.
+    """
+
+    def __init__(self, url, save_path, segments=1, retries=5, on_progress=None,
+                 known_etag=None, checksum_url=None, session=None):
+        self.url = url
+        self.save_path = save_path
+        self.part_path = save_path + '.part'
+        self.state_path = save_path + '.part.json'
+        self.segments = segments
+        self.retries = retries
+        self.on_progress = on_progress
+        # ETag della copia locale già scaricata, se presente
+        self.known_etag = known_etag
+        self.checksum_url = checksum_url
+        self.session = session
+        self.etag = None
+        self.skipped = False
+        self.verified = False
+        self._expected_digest = None
+        self._digest = None
+        self._lock = threading.Lock()
+        self._state = None
+        self._received = 0
+
+    def run(self):
+        """Esegui il download fino al completamento; solleva DownloadError in caso di errore"""
+        for _ in range(2):
+            try:
+                return self._run()
+            except _RemoteChanged:
+                self._discard()
+        raise DownloadError("Il file è cambiato sul server durante il download")
+
+    def _run(self):
+        size, etag, ranges_ok = self._probe()
+        self.etag = etag
+        if (etag and etag == self.known_etag and os.path.exists(self.save_path)
+                and os.path.getsize(self.save_path) == size):
+            # La copia locale è già aggiornata: nessun byte da trasferire
+            self.skipped = True
+            return self.save_path
+        if size is None or not ranges_ok or not etag:
+            return self._download_whole()
+
+        self._state = self._load_state(size, etag)
+        self._digest = _StreamDigest()
+        self._received = sum(segment[2] for segment in self._state['segments'])
+        self._report()
+
+        errors = []
+        threads = []
+        for segment in self._state['segments']:
+            if segment[0] + segment[2] >= segment[1]:
+                continue
+            thread = threading.Thread(target=self._run_segment, args=(segment, errors))
+            thread.start()
+            threads.append(thread)
+        for thread in threads:
+            thread.join()
+
+        self._save_state()
+        if any(isinstance(e, _RemoteChanged) for e in errors):
+            raise _RemoteChanged()
+        if errors:
+            raise DownloadError(str(errors[0]))
+
+        try:
+            self._verify(self._digest.finish(self.part_path, size))
+        except DownloadError:
+            self._discard()
+            raise
+        os.replace(self.part_path, self.save_path)
+        os.remove(self.state_path)
+        return self.save_path
+
+    def _probe(self):
+        try:
+            # Gli offset dei segmenti si riferiscono al file non compresso
+            response = (self.session or requests).head(self.url, headers={'Accept-Encoding': 'identity'},
+                                     timeout=TIMEOUT, allow_redirects=True)
+            response.raise_for_status()
+        except requests.RequestException:
+            return None, None, False
+        length = response.headers.get('Content-Length')
+        size = int(length) if length and length.isdigit() else None
+        ranges_ok = response.headers.get('Accept-Ranges', '').lower() == 'bytes'
+        self._expected_digest = _parse_repr_digest(response.headers.get('Repr-Digest'))
+        return size, response.headers.get('ETag'), ranges_ok
+
+    def _load_state(self, size, etag):
+        try:
+            with open(self.state_path) as f:
+                state = json.load(f)
+            if (state['etag'] == etag and state['size'] == size
+                    and os.path.getsize(self.part_path) == size):
+                return state
+        except (OSError, ValueError, KeyError):
+            pass
+
+        # Nuovo download: file parziale preallocato alla dimensione finale
+        with open(self.part_path, 'wb') as f:
+            f.truncate(size)
+        state = {'url': self.url, 'etag': etag, 'size': size,
+                 'segments': _split(size, self.segments)}
+        with open(self.state_path, 'w') as f:
+            json.dump(state, f)
+        return state
+
+    def _save_state(self):
+        with self._lock:
+            tmp_path = self.state_path + '.tmp'
+            with open(tmp_path, 'w') as f:
+                json.dump(self._state, f)
+            os.replace(tmp_path, self.state_path)
+
+    def _discard(self):
+        for path in (self.part_path, self.state_path):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def _report(self):
+        if self.on_progress:
+            self.on_progress(self._received, self._state['size'])
+
+    def _advance(self, count):
+        with self._lock:
+            self._received += count
+        self._report()
+
+    def _run_segment(self, segment, errors):
+        attempt = 0
+        session = self.session or requests.Session()
+        try:
+            while segment[0] + segment[2] < segment[1]:
+                before = segment[2]
+                try:
+                    self._fetch_segment(session, segment)
+                except _RemoteChanged as e:
+                    errors.append(e)
+                    return
+                except (requests.RequestException, OSError) as e:
+                    # Riprova con backoff; i tentativi si azzerano se c'è stato avanzamento
+                    attempt = 0 if segment[2] > before else attempt + 1
+                    if attempt > self.retries:
+                        errors.append(e)
+                        return
+                    time.sleep(min(0.5 * 2 ** attempt, 30))
+                except Exception as e:
+                    errors.append(e)
+                    return
+        finally:
+            if session is not self.session:
+                session.close()
+
+    def _fetch_segment(self, session, segment):
+        start, stop, done = segment
+        headers = {
+            'Range': f"bytes={start + done}-{stop - 1}",
+            'If-Range': self._state['etag'],
+            'Accept-Encoding': 'identity',
+        }
+        with session.get(self.url, headers=headers, stream=True, timeout=TIMEOUT) as response:
+            if response.status_code == 200:
+                raise _RemoteChanged()
+            response.raise_for_status()
+            with open(self.part_path, 'r+b') as f:
+                f.seek(start + done)
+                # I byte contano nello stato salvato solo dopo il flush su disco
+                pending = 0
+                try:
+                    for chunk in response.iter_content(CHUNK_SIZE):
+                        chunk = chunk[:stop - start - done - pending]
+                        f.write(chunk)
+                        self._digest.feed(start + done + pending, chunk)
+                        pending += len(chunk)
+                        self._advance(len(chunk))
+                        if pending >= STATE_SAVE_INTERVAL:
+                            f.flush()
+                            with self._lock:
+                                segment[2] += pending
+                            done, pending = segment[2], 0
+                            self._save_state()
+                        if start + done + pending >= stop:
+                            break
+                finally:
+                    f.flush()
+                    with self._lock:
+                        segment[2] += pending
+
+    def _download_whole(self):
+        # Server senza supporto Range: download in streaming senza ripresa
+        digest = hashlib.sha256()
+        stream_to_file(self.url, self.save_path, self.on_progress, digest, self.session)
+        try:
+            self._verify(digest.hexdigest())
+        except DownloadError:
+            os.remove(self.save_path)
+            raise
+        return self.save_path
+
+    def _verify(self, digest):
+        expected = self._expected_digest or self._fetch_checksum()
+        if expected is None:
+            # Il server non ha fornito un digest: download non verificato
+            return
+        if digest != expected:
+            raise DownloadError("Checksum non corrispondente: file danneggiato durante il download")
+        self.verified = True
+
+    def _fetch_checksum(self):
+        """Digest da `checksum_url`, attendendo se il server lo sta ancora calcolando"""
+        if not self.checksum_url:
+            return None
+        deadline = time.monotonic() + CHECKSUM_WAIT
+        try:
+            while True:
+                response = (self.session or requests).get(self.checksum_url, timeout=TIMEOUT)
+                if response.status_code == 200:
+                    # Il digest deve riferirsi alla stessa versione scaricata
+                    etag = response.headers.get('ETag', '')
+                    if etag.startswith('W/'):
+                        etag = etag[2:]
+                    if self.etag and etag != self.etag:
+                        return None
+                    return response.json()['digest']
+                if response.status_code != 202 or time.monotonic() >= deadline:
+                    return None
+                time.sleep(float(response.headers.get('Retry-After', 1)))
+        except (requests.RequestException, ValueError, KeyError):
+            return None
+
+
+def stream_to_file(url, save_path, on_progress=None, digest=None, session=None):
+    """Scarica un URL in streaming su disco, senza ripresa (es. archivi generati al volo).
+
+    `digest` (un oggetto di hashlib) viene aggiornato con i byte scritti.
+    """
+    part_path = save_path + '.part'
+    with (session or requests).get(url, stream=True, timeout=TIMEOUT) as response:
+        response.raise_for_status()
+        length = response.headers.get('Content-Length')
+        total = int(length) if length and length.isdigit() else 0
+        # Con Content-Encoding la lunghezza è quella compressa: l'avanzamento
+        # si misura sui byte ricevuti, non su quelli decompressi
+        encoded = 'Content-Encoding' in response.headers
+        done = 0
+        with open(part_path, 'wb') as f:
+            for chunk in response.iter_content(CHUNK_SIZE):
+                f.write(chunk)
+                if digest is not None:
+                    digest.update(chunk)
+                done = response.raw.tell() if encoded else done + len(chunk)
+                if on_progress:
+                    on_progress(done, total)
+    os.replace(part_path, save_path)
+    return save_path
+
+
+def file_digest(path):
+    """SHA-256 di un file locale, letto a blocchi"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        while True:
+            data = f.read(CHUNK_SIZE)
+            if not data:
+                break
+            digest.update(data)
+    return digest.hexdigest()
+
+
+def missing_ranges(received, size):
+    """Intervalli [start, stop) non ancora ricevuti dal server"""
+    missing = []
+    position = 0
+    for start, stop in received:
+        if start > position:
+            missing.append((position, start))
+        position = max(position, stop)
+    if position < size:
+        missing.append((position, size))
+    return missing
+
+
+class ChunkedUpload:
+    """Carica un file tramite una sessione di upload a blocchi del server.
+
+    Il file viene letto un blocco alla volta, quindi la memoria resta
+    limitata alla dimensione del blocco. L'id della sessione viene salvato in
+    `state_dir`, così un upload interrotto riprende inviando solo gli
+    intervalli che il server non ha ancora ricevuto.
+    """
+
+    def __init__(self, server_url, local_path, remote_dir, state_dir,
+                 retries=5, on_progress=None, session=None):
+        self.server_url = server_url
+        self.local_path = local_path
+        self.remote_dir = remote_dir
+        self.state_dir = state_dir
+        self.retries = retries
+        self.on_progress = on_progress
+        # Una sessione passata dal chiamante resta aperta per altri trasferimenti
+        self._own_session = session is None
+        self.session = session or requests.Session()
+        self._chunk_size = CHUNKED_UPLOAD_SIZE
+
+    def _state_path(self):
+        stat_result = os.stat(self.local_path)
+        key = json.dumps([self.server_url, self.remote_dir, os.path.abspath(self.local_path),
+                          stat_result.st_size, stat_result.st_mtime_ns])
+        return os.path.join(self.state_dir, hashlib.sha1(key.encode('utf-8')).hexdigest() + '.json')
+
+    def run(self):
+        """Esegui l'upload fino al commit; restituisce la risposta JSON del server"""
+        try:
+            size = os.path.getsize(self.local_path)
+            state_path = self._state_path()
+            session_id, received = self._resume(state_path)
+            if session_id is None:
+                session_id, received = self._create(size, file_digest(self.local_path))
+                if session_id is None:
+                    # Contenuto già presente sul server: nessun byte da inviare
+                    if self.on_progress:
+                        self.on_progress(size, size)
+                    return received
+                os.makedirs(self.state_dir, exist_ok=True)
+                with open(state_path, 'w') as f:
+                    json.dump({'session_id': session_id}, f)
+
+            chunk_size = self._chunk_size
+            done = size - sum(stop - start for start, stop in missing_ranges(received, size))
+            with open(self.local_path, 'rb') as f:
+                for start, stop in missing_ranges(received, size):
+                    for offset in range(start, stop, chunk_size):
+                        length = min(chunk_size, stop - offset)
+                        f.seek(offset)
+                        data = f.read(length)
+                        self._retry(lambda: self._put(session_id, offset, data))
+                        done += length
+                        if self.on_progress:
+                            self.on_progress(done, size)
+
+            result = self._retry(lambda: self._commit(session_id))
+            os.remove(state_path)
+            return result
+        finally:
+            if self._own_session:
+                self.session.close()
+
+    def _resume(self, state_path):
+        try:
+            with open(state_path) as f:
+                session_id = json.load(f)['session_id']
+        except (OSError, ValueError, KeyError):
+            return None, None
+        response = self.session.get(f"{self.server_url}/uploads/{session_id}", timeout=TIMEOUT)
+        if response.status_code == 404:
+            return None, None
+        response.raise_for_status()
+        return session_id, response.json()['received']
+
+    def _create(self, size, sha256):
+        """Crea la sessione; (None, risposta) se il server aveva già il contenuto"""
+        response = self.session.post(f"{self.server_url}/uploads", timeout=TIMEOUT, json={
+            'name': os.path.basename(self.local_path),
+            'path': self.remote_dir,
+            'size': size,
+            'sha256': sha256,
+        })
+        response.raise_for_status()
+        result = response.json()
+        if result.get('complete'):
+            return None, result
+        self._chunk_size = min(result.get('chunk_size', CHUNKED_UPLOAD_SIZE), CHUNKED_UPLOAD_SIZE)
+        return result['session_id'], result['received']
+
+    def _put(self, session_id, offset, data):
+        response = self.session.put(f"{self.server_url}/uploads/{session_id}",
+                                    params={'offset': offset}, data=data, timeout=TIMEOUT,
+                                    headers={'Content-Type': 'application/octet-stream'})
+        response.raise_for_status()
+
+    def _commit(self, session_id):
+        response = self.session.post(f"{self.server_url}/uploads/{session_id}/commit",
+                                     timeout=TIMEOUT)
+        response.raise_for_status()
+        return response.json()
+
+    def _retry(self, func):
+        for attempt in range(self.retries + 1):
+            try:
+                return func()
+            except requests.RequestException:
+                if attempt == self.retries:
+                    raise
+                time.sleep(min(0.5 * 2 ** attempt, 30))
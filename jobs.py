@@ -0,0 +1,210 @@
+#!/usr/bin/env python3
+"""Coda di job in background per le operazioni lunghe (eliminazioni ricorsive, copie)"""
+import json
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+# Job terminati conservati per la consultazione dello stato
+MAX_FINISHED_JOBS = 1000
+# Intervallo minimo (secondi) tra due salvataggi dell'avanzamento su disco
+SAVE_INTERVAL = 1.0
+# Stati su disco più vecchi di così vengono eliminati
+STATE_MAX_AGE = 24 * 3600
+
+
+class Job:
+    """Stato e avanzamento di un'operazione in background"""
+
+    def __init__(self, kind, target):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.target = target
+        self.status = 'queued'
+        self.items_processed = 0
+        self.bytes_processed = 0
+        self.error = None
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+        self._lock = threading.Lock()
+        self._saved = 0
+        self._state_path = None
+
+    def advance(self, items=0, nbytes=0):
+        """Aggiorna i contatori di avanzamento"""
+        with self._lock:
+            self.items_processed += items
+            self.bytes_processed += nbytes
+        if time.monotonic() - self._saved >= SAVE_INTERVAL:
+            self.save()
+
+    def save(self):
+        """Salva lo stato su disco, leggibile dagli altri processi worker"""
+        if self._state_path is None:
+            return
+        self._saved = time.monotonic()
+        tmp_path = f"{self._state_path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(self.to_dict(), f)
+        os.replace(tmp_path, self._state_path)
+
+    def to_dict(self):
+        with self._lock:
+            return {
+                'id': self.id,
+                'kind': self.kind,
+                'target': self.target,
+                'status': self.status,
+                'items_processed': self.items_processed,
+                'bytes_processed': self.bytes_processed,
+                'error': self.error,
+                'created': self.created,
+                'started': self.started,
+                'finished': self.finished,
+            }
+
+
+class JobQueue:
+    """Esegue i job su un pool di thread limitato e ne conserva lo stato.
+
+    Con `state_dir` lo stato di ogni job viene salvato anche su disco, così
+    con più processi worker /jobs/<id> risponde qualunque worker riceva la
+    richiesta.
+    """
+
+    def __init__(self, workers=2, state_dir=None):
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='job')
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+        self.state_dir = state_dir
+
+    def submit(self, kind, target, func, *args, on_done=None):
+        """Accoda func(job, *args); on_done(job) viene chiamata al termine"""
+        job = Job(kind, target)
+        if self.state_dir is not None:
+            os.makedirs(self.state_dir, exist_ok=True)
+            self._expire()
+            job._state_path = os.path.join(self.state_dir, job.id + '.json')
+            job.save()
+        with self._lock:
+            self._jobs[job.id] = job
+            self._prune()
+        self._executor.submit(self._run, job, func, args, on_done)
+        return job
+
+    def get(self, job_id):
+        """Restituisci lo stato di un job per id, o None"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is not None:
+            return job.to_dict()
+        return self._load(job_id)
+
+    def jobs(self):
+        """Stato di tutti i job conservati, dal più vecchio"""
+        with self._lock:
+            jobs = {job_id: job.to_dict() for job_id, job in self._jobs.items()}
+        if self.state_dir is not None and os.path.isdir(self.state_dir):
+            for name in os.listdir(self.state_dir):
+                job_id, extension = os.path.splitext(name)
+                if extension == '.json' and job_id not in jobs:
+                    state = self._load(job_id)
+                    if state is not None:
+                        jobs[job_id] = state
+        return sorted(jobs.values(), key=lambda job: job['created'])
+
+    def _load(self, job_id):
+        if self.state_dir is None or not all(c in '0123456789abcdef' for c in job_id):
+            return None
+        try:
+            with open(os.path.join(self.state_dir, job_id + '.json')) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _expire(self):
+        # Stati lasciati da altri processi o da avvii precedenti
+        now = time.time()
+        for name in os.listdir(self.state_dir):
+            path = os.path.join(self.state_dir, name)
+            try:
+                if now - os.path.getmtime(path) > STATE_MAX_AGE:
+                    os.remove(path)
+            except OSError:
+                continue
+
+    def _run(self, job, func, args, on_done):
+        job.status = 'running'
+        job.started = time.time()
+        job.save()
+        try:
+            func(job, *args)
+            job.status = 'done'
+        except Exception as e:
+            job.error = str(e)
+            job.status = 'failed'
+        finally:
+            job.finished = time.time()
+            job.save()
+            if on_done is not None:
+                try:
+                    on_done(job)
+                except Exception:
+                    pass
+
+    def _prune(self):
+        finished = [job_id for job_id, job in self._jobs.items()
+                    if job.status in ('done', 'failed')]
+        for job_id in finished[:max(0, len(finished) - MAX_FINISHED_JOBS)]:
+            job = self._jobs.pop(job_id)
+            if job._state_path is not None:
+                try:
+                    os.remove(job._state_path)
+                except OSError:
+                    pass
+
+    def shutdown(self, wait=True):
+        self._executor.shutdown(wait=wait)
+
+
+def _ignore_missing(func, path):
+    # Un altro processo potrebbe eliminare lo stesso albero (es. pulizia del cestino)
+    try:
+        func(path)
+        return True
+    except FileNotFoundError:
+        return False
+
+
+def remove_tree(job, path):
+    """Elimina ricorsivamente una directory aggiornando l'avanzamento del job"""
+    if os.path.islink(path) or not os.path.isdir(path):
+        # Un file spostato nel cestino (es. /batch atomico interrotto)
+        try:
+            size = os.lstat(path).st_size
+        except FileNotFoundError:
+            return
+        if _ignore_missing(os.unlink, path):
+            job.advance(items=1, nbytes=size)
+        return
+    for current, dirs, files in os.walk(path, topdown=False):
+        for name in files:
+            file_path = os.path.join(current, name)
+            try:
+                size = os.lstat(file_path).st_size
+            except FileNotFoundError:
+                continue
+            if _ignore_missing(os.unlink, file_path):
+                job.advance(items=1, nbytes=size)
+        for name in dirs:
+            dir_path = os.path.join(current, name)
+            # os.walk non segue i link simbolici ma li elenca tra le directory
+            remove = os.unlink if os.path.islink(dir_path) else os.rmdir
+            if _ignore_missing(remove, dir_path):
+                job.advance(items=1)
+    if _ignore_missing(os.rmdir, path):
+        job.advance(items=1)
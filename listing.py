@@ -0,0 +1,221 @@
+#!/usr/bin/env python3
+"""Motore di listing delle directory basato su os.scandir con cache dei metadati"""
+import base64
+import bisect
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+
+from metrics import fs_timer
+
+# Una directory modificata da meno di questo intervallo rispetto alla scansione
+# non viene considerata stabile: su filesystem con timestamp a bassa risoluzione
+# una modifica successiva potrebbe lasciare invariato l'mtime.
+RACY_WINDOW_NS = 1_000_000_000
+
+
+def sort_key(item):
+    """Chiave di ordinamento: prima le directory, poi i file per nome"""
+    return (not item['is_directory'], item['name'].lower(), item['name'])
+
+
+def encode_cursor(item):
+    """Codifica la chiave di ordinamento di un elemento come cursore opaco"""
+    key = [0 if item['is_directory'] else 1, item['name']]
+    raw = json.dumps(key, ensure_ascii=False).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    """Decodifica un cursore nella chiave di ordinamento; ValueError se non valido"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        is_file, name = json.loads(raw.decode('utf-8'))
+    except (TypeError, ValueError, UnicodeDecodeError):
+        raise ValueError('cursore non valido')
+    if is_file not in (0, 1) or not isinstance(name, str):
+        raise ValueError('cursore non valido')
+    return (bool(is_file), name.lower(), name)
+
+
+def paginate(items, cursor=None, limit=None):
+    """Restituisci la pagina di elementi ordinati dopo il cursore e il cursore successivo"""
+    start = 0
+    if cursor:
+        start = bisect.bisect_right(items, decode_cursor(cursor), key=sort_key)
+    if limit is None:
+        return items[start:], None
+    page = items[start:start + limit]
+    next_cursor = None
+    if page and start + limit < len(items):
+        next_cursor = encode_cursor(page[-1])
+    return page, next_cursor
+
+
+def listing_digest(items):
+    """Digest del contenuto di un listing, usato come ETag forte"""
+    digest = hashlib.sha1()
+    for item in items:
+        digest.update(repr((item['name'], item['is_directory'], item['size'],
+                            item['modified'], item['permissions'])).encode('utf-8'))
+    return digest.hexdigest()
+
+
+def entry_info(entry, relative_dir):
+    """Costruisci le informazioni di un elemento a partire da un DirEntry"""
+    try:
+        # DirEntry.stat() viene memorizzato nell'oggetto: una sola syscall
+        stat_result = entry.stat()
+        is_directory = entry.is_dir()
+    except OSError:
+        return None
+    return {
+        'name': entry.name,
+        'path': entry.path,
+        'is_directory': is_directory,
+        'size': 0 if is_directory else stat_result.st_size,
+        'modified': datetime.fromtimestamp(stat_result.st_mtime).isoformat(),
+        'permissions': oct(stat_result.st_mode)[-3:],
+        'relative_path': f"{relative_dir}/{entry.name}" if relative_dir else entry.name,
+    }
+
+
+def iter_directory(directory, relative_dir, hidden=None, metrics=None):
+    """Genera le informazioni degli elementi nell'ordine di scansione.
+
+    Gli elementi il cui path soddisfa `hidden` vengono omessi. Con `metrics`
+    vengono misurate l'apertura della directory e le stat degli elementi,
+    registrate insieme a fine scansione.
+    """
+    with fs_timer(metrics, 'scandir'):
+        entries = os.scandir(directory)
+    stats = 0
+    stat_seconds = 0.0
+    try:
+        with entries:
+            for entry in entries:
+                if hidden is not None and hidden(entry.path):
+                    continue
+                start = time.perf_counter()
+                info = entry_info(entry, relative_dir)
+                stat_seconds += time.perf_counter() - start
+                stats += 1
+                if info:
+                    yield info
+    finally:
+        if metrics is not None and stats:
+            metrics.fs_call('stat', stat_seconds, stats)
+
+
+def scan_directory(directory, relative_dir, hidden=None, metrics=None):
+    """Scansiona una directory e restituisci gli elementi ordinati"""
+    items = list(iter_directory(directory, relative_dir, hidden, metrics))
+    items.sort(key=sort_key)
+    return items
+
+
+class _CachedListing:
+    __slots__ = ('key', 'scanned_ns', 'items', 'digest')
+
+    def __init__(self, key, scanned_ns, items, digest):
+        self.key = key
+        self.scanned_ns = scanned_ns
+        self.items = items
+        self.digest = digest
+
+
+class DirectoryCache:
+    """Cache LRU dei listing, valida finché inode e mtime della directory non cambiano.
+
+    L'mtime di una directory cambia solo quando vengono aggiunti, rimossi o
+    rinominati elementi: le scritture sul posto di un file esistente vanno
+    segnalate con invalidate().
+    """
+
+    def __init__(self, max_items=500_000, hidden=None, metrics=None):
+        self.max_items = max_items
+        self.hidden = hidden
+        self.metrics = metrics
+        self._entries = OrderedDict()
+        self._total_items = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _state(stat_result):
+        return (stat_result.st_dev, stat_result.st_ino, stat_result.st_mtime_ns)
+
+    def _lookup(self, directory):
+        with fs_timer(self.metrics, 'stat'):
+            stat_result = os.stat(directory)
+        key = self._state(stat_result)
+        with self._lock:
+            cached = self._entries.get(directory)
+            if cached is not None and cached.key == key:
+                self._entries.move_to_end(directory)
+                self.hits += 1
+                return key, cached
+            self.misses += 1
+        return key, None
+
+    def listing(self, directory, relative_dir):
+        """Restituisci il listing ordinato di una directory e il suo digest.
+
+        Il listing viene dalla cache se ancora valido; il digest cambia
+        quando cambia il contenuto e può essere usato come ETag.
+        """
+        directory = os.path.abspath(directory)
+        key, cached = self._lookup(directory)
+        if cached is not None:
+            return cached.items, cached.digest
+
+        scanned_ns = time.time_ns()
+        items = scan_directory(directory, relative_dir, self.hidden, self.metrics)
+        digest = listing_digest(items)
+
+        # Non memorizzare directory appena modificate (vedi RACY_WINDOW_NS)
+        if scanned_ns - key[2] >= RACY_WINDOW_NS:
+            self._store(directory, _CachedListing(key, scanned_ns, items, digest))
+        return items, digest
+
+    def peek(self, directory):
+        """Restituisci il listing in cache se ancora valido, senza scansionare"""
+        cached = self._lookup(os.path.abspath(directory))[1]
+        return cached.items if cached is not None else None
+
+    def cached_state(self, directory):
+        """Restituisci lo stato (dev, inode, mtime) del listing in cache, se presente"""
+        with self._lock:
+            cached = self._entries.get(os.path.abspath(directory))
+            return cached.key if cached is not None else None
+
+    def _store(self, directory, listing):
+        if len(listing.items) > self.max_items:
+            return
+        with self._lock:
+            previous = self._entries.pop(directory, None)
+            if previous is not None:
+                self._total_items -= len(previous.items)
+            self._entries[directory] = listing
+            self._total_items += len(listing.items)
+            while self._total_items > self.max_items and self._entries:
+                _, evicted = self._entries.popitem(last=False)
+                self._total_items -= len(evicted.items)
+
+    def invalidate(self, directory):
+        """Rimuovi dalla cache il listing di una directory"""
+        with self._lock:
+            previous = self._entries.pop(os.path.abspath(directory), None)
+            if previous is not None:
+                self._total_items -= len(previous.items)
+
+    def clear(self):
+        """Svuota la cache"""
+        with self._lock:
+            self._entries.clear()
+            self._total_items = 0
@@ -0,0 +1,325 @@
+#!/usr/bin/env python3
+"""Metriche del server in formato Prometheus, aggregate tra i processi worker"""
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# Secondi tra due salvataggi delle metriche del processo su disco
+FLUSH_INTERVAL = 5
+# Metriche di worker non aggiornate da così tanto appartengono a processi terminati
+STALE_SECONDS = 3 * FLUSH_INTERVAL
+# Limiti superiori (secondi) dei bucket dell'istogramma delle latenze
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1, 2.5, 5, 10, 30, 60)
+
+# Nome -> (tipo, descrizione, etichette)
+DEFINITIONS = {
+    'fileserver_requests_total': (
+        'counter', 'Richieste HTTP completate, per route, metodo e codice di stato',
+        ('route', 'method', 'status')),
+    'fileserver_request_duration_seconds': (
+        'histogram', 'Durata delle richieste fino all\'invio dell\'ultimo byte', ('route',)),
+    'fileserver_request_bytes_total': (
+        'counter', 'Byte ricevuti nei corpi delle richieste', ('route',)),
+    'fileserver_response_bytes_total': (
+        'counter', 'Byte inviati nei corpi delle risposte', ('route',)),
+    'fileserver_requests_in_flight': (
+        'gauge', 'Richieste in corso', ('route',)),
+    'fileserver_fs_calls_total': (
+        'counter', 'Chiamate al filesystem misurate dal server (stat, scandir)', ('op',)),
+    'fileserver_fs_seconds_total': (
+        'counter', 'Tempo speso nelle chiamate al filesystem misurate dal server', ('op',)),
+}
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(names, values, extra=None):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class CountingIterable:
+    """Corpo di una risposta in streaming che conta i byte inviati"""
+
+    def __init__(self, iterable):
+        self.iterable = iterable
+        self.count = 0
+
+    def __iter__(self):
+        for chunk in self.iterable:
+            self.count += len(chunk)
+            yield chunk
+
+    def close(self):
+        close = getattr(self.iterable, 'close', None)
+        if close is not None:
+            close()
+
+
+def call_after_close(body, callback):
+    """Chiama callback() dopo la chiusura di un corpo passato intatto al server WSGI.
+
+    Werkzeug non esegue le funzioni di call_on_close per le risposte con
+    direct_passthrough (es. wsgi.file_wrapper per sendfile); l'oggetto non
+    può essere avvolto senza perdere sendfile, quindi se ne sostituisce
+    close(). Restituisce False se il corpo non lo permette.
+    """
+    close = getattr(body, 'close', None)
+
+    def closing():
+        try:
+            if close is not None:
+                close()
+        finally:
+            callback()
+
+    try:
+        body.close = closing
+    except (AttributeError, TypeError):
+        return False
+    return True
+
+
+class Metrics:
+    """Contatori, gauge e istogrammi del processo.
+
+    Gli aggiornamenti prendono un solo lock e non fanno I/O. Con più
+    processi worker ognuno salva periodicamente i propri valori in
+    `directory`; render() somma quelli di tutti i worker attivi.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self._values = {name: {} for name in DEFINITIONS}
+        self._lock = threading.Lock()
+        self._path = os.path.join(directory, f"{os.getpid()}.json")
+        os.makedirs(directory, exist_ok=True)
+
+    def add(self, name, labels, amount=1):
+        with self._lock:
+            values = self._values[name]
+            values[labels] = values.get(labels, 0) + amount
+
+    def request_finished(self, route, method, status, seconds, bytes_in, bytes_out):
+        """Registra una richiesta terminata"""
+        with self._lock:
+            values = self._values
+            key = (route, method, str(status))
+            values['fileserver_requests_total'][key] = \
+                values['fileserver_requests_total'].get(key, 0) + 1
+            histogram = values['fileserver_request_duration_seconds'].get((route,))
+            if histogram is None:
+                histogram = values['fileserver_request_duration_seconds'][(route,)] = \
+                    [[0] * (len(LATENCY_BUCKETS) + 1), 0.0, 0]
+            index = 0
+            while index < len(LATENCY_BUCKETS) and seconds > LATENCY_BUCKETS[index]:
+                index += 1
+            histogram[0][index] += 1
+            histogram[1] += seconds
+            histogram[2] += 1
+            for name, amount in (('fileserver_request_bytes_total', bytes_in),
+                                 ('fileserver_response_bytes_total', bytes_out)):
+                if amount:
+                    values[name][(route,)] = values[name].get((route,), 0) + amount
+            in_flight = values['fileserver_requests_in_flight']
+            in_flight[(route,)] = in_flight.get((route,), 0) - 1
+
+    def fs_call(self, op, seconds, calls=1):
+        """Registra `calls` chiamate al filesystem che hanno impiegato in tutto `seconds`"""
+        with self._lock:
+            counts = self._values['fileserver_fs_calls_total']
+            counts[(op,)] = counts.get((op,), 0) + calls
+            spent = self._values['fileserver_fs_seconds_total']
+            spent[(op,)] = spent.get((op,), 0.0) + seconds
+
+    def snapshot(self):
+        with self._lock:
+            return {name: [[list(labels), value if not isinstance(value, list)
+                            else [list(value[0]), value[1], value[2]]]
+                           for labels, value in values.items()]
+                    for name, values in self._values.items()}
+
+    def flush(self):
+        """Salva i valori del processo per gli altri worker"""
+        tmp_path = f"{self._path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(self.snapshot(), f)
+        os.replace(tmp_path, self._path)
+
+    def start_flusher(self):
+        def run():
+            while True:
+                time.sleep(FLUSH_INTERVAL)
+                try:
+                    self.flush()
+                except OSError as e:
+                    logger.warning("Salvataggio delle metriche fallito: %s", e)
+
+        threading.Thread(target=run, daemon=True, name='metrics-flush').start()
+
+    def _collect(self):
+        # Valori del processo corrente più quelli salvati dagli altri worker
+        snapshots = [self.snapshot()]
+        now = time.time()
+        for entry in os.scandir(self.directory):
+            if not entry.name.endswith('.json') or entry.path == self._path:
+                continue
+            try:
+                if now - entry.stat().st_mtime > STALE_SECONDS:
+                    os.remove(entry.path)
+                    continue
+                with open(entry.path) as f:
+                    snapshots.append(json.load(f))
+            except (OSError, ValueError):
+                continue
+
+        merged = {name: {} for name in DEFINITIONS}
+        for snapshot in snapshots:
+            for name, values in snapshot.items():
+                if name not in merged:
+                    continue
+                target = merged[name]
+                for labels, value in values:
+                    labels = tuple(labels)
+                    if isinstance(value, list):
+                        current = target.setdefault(labels, [[0] * len(value[0]), 0.0, 0])
+                        current[0] = [a + b for a, b in zip(current[0], value[0])]
+                        current[1] += value[1]
+                        current[2] += value[2]
+                    else:
+                        target[labels] = target.get(labels, 0) + value
+        return merged
+
+    def render(self):
+        """Testo per /metrics (formato di esposizione Prometheus 0.0.4)"""
+        lines = []
+        for name, values in self._collect().items():
+            kind, description, label_names = DEFINITIONS[name]
+            lines.append(f"# HELP {name} {description}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, value in sorted(values.items()):
+                if kind != 'histogram':
+                    lines.append(f"{name}{_labels(label_names, labels)} {_format_value(value)}")
+                    continue
+                buckets, total, count = value
+                cumulative = 0
+                for bound, bucket in zip(LATENCY_BUCKETS + (float('inf'),), buckets):
+                    cumulative += bucket
+                    le = f'le="{_format_value(float(bound))}"'
+                    lines.append(f"{name}_bucket{_labels(label_names, labels, le)} {cumulative}")
+                lines.append(f"{name}_sum{_labels(label_names, labels)} {_format_value(total)}")
+                lines.append(f"{name}_count{_labels(label_names, labels)} {count}")
+        return '\n'.join(lines) + '\n'
+
+
+@contextmanager
+def fs_timer(metrics, op):
+    """Misura il blocco come una chiamata al filesystem `op`; con `metrics` None non fa nulla"""
+    if metrics is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        metrics.fs_call(op, time.perf_counter() - start)
+
+
+class SlowRequestProfiler:
+    """Profilatore a campionamento per le richieste lente.
+
+    Un thread campiona ogni `interval` secondi lo stack dei thread che
+    servono una richiesta da più di `threshold` secondi. A fine richiesta
+    gli stack raccolti vengono salvati in `directory` nel formato "collapsed"
+    (una riga per stack con il numero di campioni), leggibile da
+    flamegraph.pl e speedscope. Le richieste veloci costano solo due
+    accessi a un dizionario.
+    """
+
+    def __init__(self, threshold, directory, interval=0.01, keep=100):
+        self.threshold = threshold
+        self.directory = directory
+        self.interval = interval
+        self.keep = keep
+        # id del thread -> [id del thread, route, inizio, campioni]
+        self._active = {}
+        self._thread = None
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def begin(self, route):
+        """Inizia a seguire la richiesta servita dal thread corrente; restituisce il profilo per end()"""
+        profile = [threading.get_ident(), route, time.monotonic(), Counter()]
+        self._active[profile[0]] = profile
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, daemon=True,
+                                                    name='slow-request-profiler')
+                    self._thread.start()
+        return profile
+
+    def end(self, profile):
+        """Fine della richiesta, anche da un altro thread (es. la chiusura della risposta)"""
+        thread_id, route, started, samples = profile
+        # Il thread può essere già passato a un'altra richiesta
+        if self._active.get(thread_id) is profile:
+            self._active.pop(thread_id, None)
+        if not samples:
+            return
+        try:
+            self._save(route, time.monotonic() - started, samples)
+        except OSError as e:
+            logger.warning("Salvataggio del profilo fallito: %s", e)
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            now = time.monotonic()
+            frames = None
+            for thread_id, profile in list(self._active.items()):
+                if now - profile[2] < self.threshold:
+                    continue
+                if frames is None:
+                    frames = sys._current_frames()
+                frame = frames.get(thread_id)
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                    frame = frame.f_back
+                if stack:
+                    profile[3][';'.join(reversed(stack))] += 1
+
+    def _save(self, route, duration, samples):
+        name = f"{time.strftime('%Y%m%d-%H%M%S')}-{route}-{int(duration * 1000)}ms.txt"
+        path = os.path.join(self.directory, name)
+        with open(path, 'w') as f:
+            for stack, count in samples.most_common():
+                f.write(f"{stack} {count}\n")
+        logger.warning("Richiesta lenta (%s, %.2fs): profilo in %s", route, duration, path)
+
+        profiles = sorted(os.scandir(self.directory), key=lambda entry: entry.stat().st_mtime)
+        for entry in profiles[:max(0, len(profiles) - self.keep)]:
+            try:
+                os.remove(entry.path)
+            except OSError:
+                pass
@@ -0,0 +1,290 @@
+#!/usr/bin/env python3
+"""Anteprime dei file di dimensione limitata, per vedere cosa contiene un file senza scaricarlo.
+
+    - immagini: miniatura JPEG/PNG con il lato lungo tra THUMBNAIL_SIZES
+      (richiede Pillow; i JPEG vengono decodificati già ridotti);
+    - testi: i primi byte del file, oppure un intervallo di righe;
+    - tutto il resto (e le immagini senza Pillow): solo i metadati.
+Le miniature e gli intervalli di righe vengono generati da un pool di
+thread limitato e salvati su disco, chiave path + dimensione + mtime +
+variante; oltre `max_bytes` si eliminano quelli usati meno di recente.
+"""
+import codecs
+import hashlib
+import io
+import json
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from compression import is_compressible
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # dipendenza opzionale: senza Pillow le immagini hanno solo i metadati
+    Image = None
+
+# Lati lunghi delle miniature: la richiesta viene arrotondata al successivo
+THUMBNAIL_SIZES = (64, 128, 256, 512, 1024)
+DEFAULT_THUMBNAIL_SIZE = 256
+# Immagini più grandi di così (in pixel) non vengono decodificate
+MAX_IMAGE_PIXELS = 100_000_000
+JPEG_QUALITY = 80
+# Byte di testo restituiti: predefiniti e massimi
+TEXT_PREVIEW_BYTES = 16 * 1024
+MAX_TEXT_PREVIEW_BYTES = 256 * 1024
+# Righe massime di un intervallo (?lines=)
+MAX_PREVIEW_LINES = 1000
+# Byte letti per riconoscere un file di testo senza tipo noto
+SNIFF_BYTES = 4096
+# Byte letti per volta contando le righe
+READ_CHUNK = 1024 * 1024
+# Ogni quanti salvataggi controllare lo spazio occupato
+EVICT_EVERY = 50
+# File temporanei abbandonati (es. worker terminato) più vecchi di così vengono eliminati
+STALE_TEMP_SECONDS = 3600
+
+
+def preview_kind(path, mimetype):
+    """'image', 'text' o 'metadata'"""
+    if mimetype and mimetype.startswith('image/') and Image is not None:
+        return 'image'
+    if is_compressible(mimetype):
+        return 'text'
+    if mimetype is None:
+        # Tipo sconosciuto (es. .log): testo se l'inizio è UTF-8 senza byte nulli
+        with open(path, 'rb') as f:
+            head = f.read(SNIFF_BYTES)
+        if b'\0' not in head:
+            try:
+                codecs.getincrementaldecoder('utf-8')().decode(head, final=False)
+                return 'text'
+            except UnicodeDecodeError:
+                pass
+    return 'metadata'
+
+
+def thumbnail_size(requested):
+    """Dimensione di THUMBNAIL_SIZES da usare per il lato lungo richiesto"""
+    if not requested:
+        return DEFAULT_THUMBNAIL_SIZE
+    for size in THUMBNAIL_SIZES:
+        if size >= requested:
+            return size
+    return THUMBNAIL_SIZES[-1]
+
+
+def parse_line_range(value):
+    """'10-20' -> (10, 20), '10' -> (10, 10), '10-' -> fino a MAX_PREVIEW_LINES righe"""
+    start, dash, end = value.partition('-')
+    start = int(start)
+    end = int(end) if end else (start + MAX_PREVIEW_LINES - 1 if dash else start)
+    if start < 1 or end < start:
+        raise ValueError(f"Intervallo di righe non valido: {value}")
+    return start, min(end, start + MAX_PREVIEW_LINES - 1)
+
+
+def make_thumbnail(path, size):
+    """(mimetype, header, dati) della miniatura, o None se l'immagine non è leggibile"""
+    try:
+        with Image.open(path) as image:
+            width, height = image.size
+            if width * height > MAX_IMAGE_PIXELS:
+                return None
+            # JPEG: decodifica direttamente a 1/2, 1/4 o 1/8 della risoluzione
+            image.draft('RGB', (size, size))
+            image = ImageOps.exif_transpose(image)
+            image.thumbnail((size, size))
+            out = io.BytesIO()
+            if image.mode in ('RGBA', 'LA', 'PA') or 'transparency' in image.info:
+                image.convert('RGBA').save(out, 'PNG')
+                mimetype = 'image/png'
+            else:
+                image.convert('RGB').save(out, 'JPEG', quality=JPEG_QUALITY)
+                mimetype = 'image/jpeg'
+    except (OSError, ValueError, SyntaxError, Image.DecompressionBombError):
+        return None
+    return mimetype, {'X-Image-Width': str(width), 'X-Image-Height': str(height)}, out.getvalue()
+
+
+def _decode(data):
+    # Un carattere spezzato alla fine del blocco resta fuori dall'anteprima
+    return codecs.getincrementaldecoder('utf-8')('replace').decode(data, final=False)
+
+
+def text_head(path, max_bytes):
+    """(mimetype, header, dati) con i primi `max_bytes` byte del file"""
+    with open(path, 'rb') as f:
+        data = f.read(max_bytes + 1)
+    truncated = len(data) > max_bytes
+    text = _decode(data[:max_bytes]) if truncated else data.decode('utf-8', 'replace')
+    return ('text/plain; charset=utf-8', {'X-Preview-Truncated': '1' if truncated else '0'},
+            text.encode('utf-8'))
+
+
+def _seek_line(f, number):
+    """Posiziona `f` all'inizio della riga `number` (da 1); False se il file è più corto"""
+    line = 1
+    offset = 0
+    while line < number:
+        chunk = f.read(READ_CHUNK)
+        if not chunk:
+            return False
+        count = chunk.count(b'\n')
+        if line + count < number:
+            line += count
+            offset += len(chunk)
+            continue
+        position = -1
+        for _ in range(number - line):
+            position = chunk.index(b'\n', position + 1)
+        f.seek(offset + position + 1)
+        return True
+    return True
+
+
+def text_lines(path, start, end, max_bytes):
+    """(mimetype, header, dati) con le righe da `start` a `end`, al massimo `max_bytes` byte"""
+    with open(path, 'rb') as f:
+        if not _seek_line(f, start):
+            data = b''
+        else:
+            data = f.read(max_bytes + 1)
+    position = -1
+    for _ in range(end - start + 1):
+        position = data.find(b'\n', position + 1)
+        if position < 0:
+            break
+    if position >= 0:
+        data = data[:position + 1]
+        truncated = False
+    else:
+        # Senza l'ultimo a capo: fine del file, oppure limite di byte raggiunto
+        truncated = len(data) > max_bytes
+        data = data[:max_bytes]
+    last = start + data.count(b'\n') - (1 if data.endswith(b'\n') else 0)
+    text = _decode(data) if truncated else data.decode('utf-8', 'replace')
+    headers = {'X-Preview-Truncated': '1' if truncated else '0',
+               'X-Preview-Lines': f"{start}-{last}" if data else ''}
+    return 'text/plain; charset=utf-8', headers, text.encode('utf-8')
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+class PreviewCache:
+    """Anteprime salvate su disco, generate nel pool una sola volta per file e variante.
+
+    `get()` restituisce un Future con (mimetype, header, dati); mimetype è
+    None se il generatore non è riuscito a produrla (es. immagine
+    danneggiata), e anche questo esito resta in cache finché il file non
+    cambia.
+    """
+
+    def __init__(self, directory, max_bytes, workers):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.executor = ThreadPoolExecutor(workers, thread_name_prefix='preview')
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._saved = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, path, stat_result, variant):
+        key = f"{os.path.abspath(path)}\0{stat_result.st_size}\0{stat_result.st_mtime_ns}\0{variant}"
+        return os.path.join(self.directory,
+                            hashlib.sha1(key.encode('utf-8', 'surrogateescape')).hexdigest())
+
+    def get(self, path, stat_result, variant, func, *args):
+        """Future del risultato di func(*args): già concluso se è in cache, altrimenti
+        generato nel pool"""
+        cached = self._path(path, stat_result, variant)
+        result = self._read(cached)
+        if result is not None:
+            future = Future()
+            future.set_result(result)
+            return future
+        with self._lock:
+            future = self._pending.get(cached)
+            if future is not None:
+                return future
+            future = self.executor.submit(self._load, path, stat_result, cached, func, args)
+            self._pending[cached] = future
+        # Fuori dal lock: se il future è già concluso la callback viene eseguita subito
+        future.add_done_callback(lambda _: self._forget(cached))
+        return future
+
+    def _forget(self, cached):
+        with self._lock:
+            self._pending.pop(cached, None)
+
+    @staticmethod
+    def _read(cached):
+        try:
+            with open(cached, 'rb') as f:
+                meta = json.loads(f.readline())
+                data = f.read()
+            # L'mtime del file registra l'ultimo uso per l'eviction
+            os.utime(cached)
+            return meta['mimetype'], meta['headers'], data
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def _load(self, path, stat_result, cached, func, args):
+        # Nel frattempo può averla generata un altro worker
+        result = self._read(cached)
+        if result is not None:
+            return result
+        result = func(*args) or (None, {}, b'')
+        self._store(path, stat_result, cached, result)
+        return result
+
+    def _store(self, path, stat_result, cached, result):
+        mimetype, headers, data = result
+        if self.max_bytes <= 0:
+            return
+        temp_path = os.path.join(self.directory, f".{uuid.uuid4().hex}.tmp")
+        with open(temp_path, 'wb') as f:
+            f.write(json.dumps({'mimetype': mimetype, 'headers': headers}).encode('utf-8') + b'\n')
+            f.write(data)
+        # Il file può essere cambiato durante la generazione
+        try:
+            unchanged = os.stat(path).st_mtime_ns == stat_result.st_mtime_ns
+        except OSError:
+            unchanged = False
+        if not unchanged:
+            _remove(temp_path)
+            return
+        os.replace(temp_path, cached)
+        self._saved += 1
+        if self._saved % EVICT_EVERY == 0:
+            self.evict()
+
+    def evict(self):
+        """Elimina le anteprime meno usate finché la cache supera max_bytes"""
+        entries = []
+        total = 0
+        now = time.time()
+        for entry in os.scandir(self.directory):
+            try:
+                stat_result = entry.stat()
+            except FileNotFoundError:
+                continue
+            if entry.name.startswith('.'):
+                if now - stat_result.st_mtime > STALE_TEMP_SECONDS:
+                    _remove(entry.path)
+                continue
+            entries.append((stat_result.st_mtime, stat_result.st_size, entry.path))
+            total += stat_result.st_size
+        entries.sort()
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            _remove(path)
+            total -= size
@@ -0,0 +1,410 @@
+#!/usr/bin/env python3
+"""Indice SQLite dei path sotto BASE_DIR: ricerca per nome e dimensioni delle directory"""
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+try:
+    import fcntl
+except ImportError:  # non disponibile su Windows: un solo riconciliatore per processo
+    fcntl = None
+
+# Righe scritte per transazione durante la riconciliazione
+BATCH_SIZE = 5000
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    id INTEGER PRIMARY KEY,
+    path TEXT NOT NULL UNIQUE,
+    parent TEXT NOT NULL,
+    name TEXT NOT NULL,
+    is_directory INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    mtime REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS files_parent ON files(parent);
+-- Byte e numero di file ricorsivi per directory ('' è la directory base)
+CREATE TABLE IF NOT EXISTS totals (
+    path TEXT PRIMARY KEY,
+    bytes INTEGER NOT NULL,
+    files INTEGER NOT NULL
+);
+-- Sottoalberi visitati completamente da reconcile(): i loro totali sono
+-- completi, mentre update() aggiunge gli antenati senza visitarli
+CREATE TABLE IF NOT EXISTS reconciled (
+    path TEXT PRIMARY KEY
+);
+"""
+
+# Indice full-text con tokenizer trigram: ricerche per sottostringa del nome
+FTS_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS names USING fts5(
+    name, content='files', content_rowid='id', tokenize='trigram'
+);
+CREATE TRIGGER IF NOT EXISTS files_ai AFTER INSERT ON files BEGIN
+    INSERT INTO names(rowid, name) VALUES (new.id, new.name);
+END;
+CREATE TRIGGER IF NOT EXISTS files_ad AFTER DELETE ON files BEGIN
+    INSERT INTO names(names, rowid, name) VALUES ('delete', old.id, old.name);
+END;
+CREATE TRIGGER IF NOT EXISTS files_au AFTER UPDATE OF name ON files BEGIN
+    INSERT INTO names(names, rowid, name) VALUES ('delete', old.id, old.name);
+    INSERT INTO names(rowid, name) VALUES (new.id, new.name);
+END;
+"""
+
+
+def _escape_like(value):
+    return value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+def _parent(path):
+    return path.rsplit('/', 1)[0] if '/' in path else ''
+
+
+def _ancestors(path):
+    """Directory che contengono `path`, dalla più vicina fino a ''"""
+    while path:
+        path = _parent(path)
+        yield path
+
+
+def _add(deltas, path, size, files):
+    for ancestor in _ancestors(path):
+        total = deltas.setdefault(ancestor, [0, 0])
+        total[0] += size
+        total[1] += files
+
+
+class SearchIndex:
+    """Indice dei file con aggiornamenti incrementali e riconciliazione periodica.
+
+    I path sono relativi alla directory base, separati da '/'. Le route che
+    modificano i file chiamano update() e remove(); il riconciliatore in
+    background recupera le modifiche fatte direttamente sul disco.
+
+    La tabella totals contiene byte e file ricorsivi di ogni directory: ogni
+    scrittura applica la differenza agli antenati, rebuild_totals() li
+    ricalcola da zero solo come riparazione.
+    """
+
+    def __init__(self, db_path, base_dir, hidden=None):
+        self.db_path = db_path
+        self.base_dir = os.path.abspath(base_dir)
+        self.hidden = hidden
+        self._local = threading.local()
+        self._reconciler = None
+        self.fts = True
+
+        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        conn = self._conn()
+        with conn:
+            conn.executescript(SCHEMA)
+            try:
+                conn.executescript(FTS_SCHEMA)
+            except sqlite3.OperationalError:
+                # SQLite senza FTS5 o senza tokenizer trigram: si usa LIKE
+                self.fts = False
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.row_factory = sqlite3.Row
+            self._local.conn = conn
+        return conn
+
+    def _relative(self, full_path):
+        relative = os.path.relpath(os.path.abspath(full_path), self.base_dir)
+        return '' if relative == '.' else relative.replace(os.sep, '/')
+
+    @staticmethod
+    def _row(relative, stat_result, is_directory):
+        return (relative, _parent(relative), relative.rsplit('/', 1)[-1],
+                int(is_directory), 0 if is_directory else stat_result.st_size,
+                stat_result.st_mtime)
+
+    @contextmanager
+    def _write(self):
+        """Transazione di scrittura: il lock è preso subito perché i totali
+        sono calcolati da ciò che si legge nella stessa transazione"""
+        conn = self._conn()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            yield conn
+        except BaseException:
+            conn.rollback()
+            raise
+        conn.commit()
+
+    @staticmethod
+    def _apply_totals(conn, deltas):
+        conn.executemany(
+            "INSERT INTO totals(path, bytes, files) VALUES (?, ?, ?) "
+            "ON CONFLICT(path) DO UPDATE SET bytes=bytes + excluded.bytes, "
+            "files=files + excluded.files",
+            [(path, size, files) for path, (size, files) in deltas.items()
+             if size or files])
+
+    def _upsert(self, conn, rows):
+        deltas = {}
+        for row in rows:
+            relative, is_directory, size = row[0], row[3], row[4]
+            old = conn.execute("SELECT is_directory, size FROM files WHERE path = ?",
+                               (relative,)).fetchone()
+            if old is not None and old['is_directory'] and not is_directory:
+                # Una directory sostituita da un file: il contenuto non esiste più
+                self._delete(conn, relative, descendants_only=True)
+            old_size, old_files = (old['size'], 1) if old and not old['is_directory'] else (0, 0)
+            new_size, new_files = (0, 0) if is_directory else (size, 1)
+            if (new_size, new_files) != (old_size, old_files):
+                _add(deltas, relative, new_size - old_size, new_files - old_files)
+        conn.executemany(
+            "INSERT INTO files(path, parent, name, is_directory, size, mtime) "
+            "VALUES (?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT(path) DO UPDATE SET is_directory=excluded.is_directory, "
+            "size=excluded.size, mtime=excluded.mtime", rows)
+        self._apply_totals(conn, deltas)
+
+    def _delete(self, conn, relative, descendants_only=False):
+        descendants = _escape_like(relative) + '/%'
+        if descendants_only:
+            where, params = "path LIKE ? ESCAPE '\\'", (descendants,)
+        else:
+            where, params = "path = ? OR path LIKE ? ESCAPE '\\'", (relative, descendants)
+        size, files = conn.execute(
+            f"SELECT COALESCE(SUM(size), 0), COUNT(*) FROM files "
+            f"WHERE is_directory = 0 AND ({where})", params).fetchone()
+        if files:
+            deltas = {}
+            _add(deltas, relative + '/' if descendants_only else relative, -size, -files)
+            self._apply_totals(conn, deltas)
+        conn.execute(f"DELETE FROM files WHERE {where}", params)
+        conn.execute(f"DELETE FROM reconciled WHERE {where}", params)
+        conn.execute("DELETE FROM totals WHERE path = ? OR path LIKE ? ESCAPE '\\'",
+                     (relative, descendants))
+
+    def update(self, full_path):
+        """Aggiungi o aggiorna un file o una directory (non ricorsivo) e i suoi antenati"""
+        rows = []
+        full_path = os.path.abspath(full_path)
+        relative = self._relative(full_path)
+        while relative:
+            stat_result = os.stat(full_path)
+            rows.append(self._row(relative, stat_result, os.path.isdir(full_path)))
+            full_path = os.path.dirname(full_path)
+            relative = _parent(relative)
+        with self._write() as conn:
+            self._upsert(conn, rows)
+
+    def remove(self, full_path):
+        """Rimuovi un path e, se è una directory, tutto il suo contenuto"""
+        relative = self._relative(full_path)
+        if not relative:
+            return
+        with self._write() as conn:
+            self._delete(conn, relative)
+
+    def search(self, query, path='', limit=100):
+        """Cerca i nomi che contengono `query`, opzionalmente sotto `path`"""
+        conn = self._conn()
+        params = []
+        if self.fts and len(query) >= 3:
+            # Con il trigram la frase tra virgolette equivale a una sottostringa
+            sql = ("SELECT files.* FROM names JOIN files ON files.id = names.rowid "
+                   "WHERE names MATCH ?")
+            params.append('"' + query.replace('"', '""') + '"')
+        else:
+            sql = "SELECT files.* FROM files WHERE name LIKE ? ESCAPE '\\'"
+            params.append('%' + _escape_like(query) + '%')
+        if path:
+            sql += " AND files.path LIKE ? ESCAPE '\\'"
+            params.append(_escape_like(path.strip('/')) + '/%')
+        sql += " ORDER BY files.is_directory DESC, files.name COLLATE NOCASE LIMIT ?"
+        params.append(limit)
+
+        return [{
+            'name': row['name'],
+            'relative_path': row['path'],
+            'is_directory': bool(row['is_directory']),
+            'size': row['size'],
+            'modified': datetime.fromtimestamp(row['mtime']).isoformat(),
+        } for row in conn.execute(sql, params)]
+
+    def count(self):
+        """Numero di path indicizzati"""
+        return self._conn().execute("SELECT COUNT(*) FROM files").fetchone()[0]
+
+    def reconciled(self, path=''):
+        """True se `path` è in un sottoalbero già visitato da reconcile()"""
+        relative = path.strip('/')
+        candidates = [relative, *_ancestors(relative)]
+        return self._conn().execute(
+            f"SELECT 1 FROM reconciled WHERE path IN ({', '.join('?' * len(candidates))})",
+            candidates).fetchone() is not None
+
+    def reconcile(self, path=''):
+        """Allinea l'indice al disco visitando l'albero (o solo il sottoalbero `path`);
+        restituisce le modifiche"""
+        conn = self._conn()
+        changes = 0
+        pending = []
+        root = path.strip('/')
+        complete = True
+        stack = [root]
+        while stack:
+            relative_dir = stack.pop()
+            directory = os.path.join(self.base_dir, relative_dir) if relative_dir else self.base_dir
+            indexed = {row['name']: (row['is_directory'], row['size'], row['mtime'])
+                       for row in conn.execute(
+                           "SELECT name, is_directory, size, mtime FROM files WHERE parent = ?",
+                           (relative_dir,))}
+            seen = set()
+            try:
+                entries = list(os.scandir(directory))
+            except OSError:
+                entries = []
+                if relative_dir == root:
+                    complete = False
+            for entry in entries:
+                if self.hidden is not None and self.hidden(entry.path):
+                    continue
+                try:
+                    stat_result = entry.stat()
+                    is_directory = entry.is_dir()
+                    is_link = entry.is_symlink()
+                except OSError:
+                    continue
+                relative = f"{relative_dir}/{entry.name}" if relative_dir else entry.name
+                seen.add(entry.name)
+                row = self._row(relative, stat_result, is_directory)
+                if indexed.get(entry.name) != (row[3], row[4], row[5]):
+                    pending.append(row)
+                # I link simbolici a directory vengono indicizzati ma non visitati
+                if is_directory and not is_link:
+                    stack.append(relative)
+
+            removed = [name for name in indexed if name not in seen]
+            if removed or len(pending) >= BATCH_SIZE:
+                with self._write() as conn:
+                    self._upsert(conn, pending)
+                    for name in removed:
+                        self._delete(conn, f"{relative_dir}/{name}" if relative_dir else name)
+                changes += len(pending) + len(removed)
+                pending = []
+        with self._write() as conn:
+            self._upsert(conn, pending)
+            if complete:
+                conn.execute("INSERT OR IGNORE INTO reconciled(path) VALUES (?)", (root,))
+        changes += len(pending)
+        return changes
+
+    def rebuild_totals(self):
+        """Ricalcola i totali delle directory dalla tabella files; restituisce
+        il numero di directory che avevano totali errati"""
+        with self._write() as conn:
+            totals = {}
+            for path, size in conn.execute("SELECT path, size FROM files WHERE is_directory = 0"):
+                _add(totals, path, size, 1)
+            current = {row['path']: [row['bytes'], row['files']]
+                       for row in conn.execute("SELECT path, bytes, files FROM totals")
+                       if row['bytes'] or row['files']}
+            wrong = [path for path in totals.keys() | current.keys()
+                     if totals.get(path) != current.get(path)]
+            if wrong:
+                conn.execute("DELETE FROM totals")
+                conn.executemany("INSERT INTO totals(path, bytes, files) VALUES (?, ?, ?)",
+                                 [(path, size, files) for path, (size, files) in totals.items()])
+        return len(wrong)
+
+    def _node(self, row):
+        is_directory = bool(row['is_directory'])
+        return {
+            'name': row['name'],
+            'relative_path': row['path'],
+            'is_directory': is_directory,
+            'size': (row['bytes'] or 0) if is_directory else row['size'],
+            'files': (row['files'] or 0) if is_directory else 1,
+            'modified': datetime.fromtimestamp(row['mtime']).isoformat(),
+        }
+
+    def _children(self, conn, node, depth, limit):
+        rows = conn.execute(
+            "SELECT files.*, totals.bytes, totals.files FROM files "
+            "LEFT JOIN totals ON totals.path = files.path WHERE parent = ? "
+            "ORDER BY CASE WHEN is_directory THEN COALESCE(totals.bytes, 0) ELSE size END DESC, "
+            "files.name COLLATE NOCASE LIMIT ?", (node['relative_path'], limit)).fetchall()
+        count = conn.execute("SELECT COUNT(*) FROM files WHERE parent = ?",
+                             (node['relative_path'],)).fetchone()[0]
+        node['children'] = []
+        node['more'] = max(count - len(rows), 0)
+        for row in rows:
+            child = self._node(row)
+            if child['is_directory'] and depth > 1:
+                self._children(conn, child, depth - 1, limit)
+            node['children'].append(child)
+
+    def tree(self, path='', depth=1, limit=100):
+        """Albero sotto `path` fino a `depth` livelli, con byte e file ricorsivi.
+
+        Per ogni directory sono restituiti i `limit` elementi più grandi;
+        `more` indica quanti ne sono stati omessi.
+        """
+        conn = self._conn()
+        relative = path.strip('/')
+        if relative:
+            row = conn.execute(
+                "SELECT files.*, totals.bytes, totals.files FROM files "
+                "LEFT JOIN totals ON totals.path = files.path WHERE files.path = ?",
+                (relative,)).fetchone()
+            if row is None:
+                return None
+            node = self._node(row)
+        else:
+            row = conn.execute("SELECT bytes, files FROM totals WHERE path = ''").fetchone()
+            node = {
+                'name': '',
+                'relative_path': '',
+                'is_directory': True,
+                'size': row['bytes'] if row else 0,
+                'files': row['files'] if row else 0,
+                'modified': datetime.fromtimestamp(os.stat(self.base_dir).st_mtime).isoformat(),
+            }
+        if node['is_directory'] and depth > 0:
+            self._children(conn, node, depth, limit)
+        return node
+
+    def start_reconciler(self, interval, lock_path=None):
+        """Avvia la riconciliazione periodica in un thread in background.
+
+        Con `lock_path` solo il processo che ottiene il lock sul file esegue
+        la riconciliazione, anche con più worker.
+        """
+        if self._reconciler is not None:
+            return
+
+        def run():
+            lock_file = None
+            while True:
+                if lock_path and fcntl is not None and lock_file is None:
+                    candidate = open(lock_path, 'a')
+                    try:
+                        fcntl.flock(candidate, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                        lock_file = candidate
+                    except OSError:
+                        candidate.close()
+                if lock_file is not None or not lock_path or fcntl is None:
+                    try:
+                        self.reconcile()
+                        self.rebuild_totals()
+                    except Exception:
+                        pass
+                time.sleep(interval)
+
+        self._reconciler = threading.Thread(target=run, name='index-reconciler', daemon=True)
+        self._reconciler.start()
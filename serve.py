@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""Avvio del server in produzione con gunicorn: più processi worker, thread e keep-alive.
+
+Esempio:
+    python serve.py --config server.ini --workers 4 --threads 8
+
+Il file di configurazione (vedi server.example.ini) viene letto anche dai
+worker tramite la variabile FILESERVER_CONFIG. Per ricaricare codice e
+configurazione senza interrompere le richieste in corso inviare SIGHUP al
+processo master (es. kill -HUP $(cat server.pid)): gunicorn avvia nuovi
+worker e chiude i vecchi con uno spegnimento controllato.
+"""
+import argparse
+import os
+import sys
+
+import config
+
+try:
+    from gunicorn.app.base import BaseApplication
+except ImportError:  # dipendenza opzionale, necessaria solo per questa modalità
+    BaseApplication = None
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Avvia il File Server in produzione')
+    parser.add_argument('--config', help='file di configurazione INI')
+    parser.add_argument('--bind', help='indirizzo host:porta (predefinito da host e port)')
+    parser.add_argument('--workers', type=int, help='processi worker')
+    parser.add_argument('--threads', type=int, help='thread per worker')
+    parser.add_argument('--keepalive', type=int, help='secondi di attesa su connessioni keep-alive inattive')
+    parser.add_argument('--timeout', type=int, help='secondi massimi per una richiesta prima del riavvio del worker')
+    parser.add_argument('--graceful-timeout', type=int, help='secondi concessi alle richieste in corso in riavvio')
+    parser.add_argument('--max-requests', type=int, help='richieste dopo cui riciclare un worker (0 = mai)')
+    parser.add_argument('--pid', help='file in cui scrivere il pid del master')
+    return parser.parse_args(argv)
+
+
+def gunicorn_options(settings, args):
+    """Opzioni di gunicorn dalla configurazione, sovrascritte dalla riga di comando"""
+    def pick(name):
+        value = getattr(args, name)
+        return settings[name] if value is None else value
+
+    options = {
+        'bind': args.bind or f"{settings['host']}:{settings['port']}",
+        'workers': pick('workers'),
+        'threads': pick('threads'),
+        'worker_class': 'gthread',
+        'keepalive': pick('keepalive'),
+        'timeout': pick('timeout'),
+        'graceful_timeout': pick('graceful_timeout'),
+        'max_requests': pick('max_requests'),
+        'max_requests_jitter': pick('max_requests') // 10,
+        'accesslog': '-',
+    }
+    if args.pid:
+        options['pidfile'] = args.pid
+    return options
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if BaseApplication is None:
+        sys.exit("gunicorn non installato: pip install gunicorn")
+
+    if args.config:
+        # I worker importano Server.py e leggono la stessa configurazione
+        os.environ[config.CONFIG_ENV] = os.path.abspath(args.config)
+    settings = config.load()
+    options = gunicorn_options(settings, args)
+
+    class FileServerApplication(BaseApplication):
+        def load_config(self):
+            for key, value in options.items():
+                self.cfg.set(key, value)
+
+        def load(self):
+            # Importato nei worker: con SIGHUP il codice viene ricaricato
+            from Server import app
+            return app
+
+    print(f"Server avviato. Directory base: {settings['base_dir']}")
+    print(f"Ascolto su {options['bind']} con {options['workers']} worker "
+          f"da {options['threads']} thread")
+    FileServerApplication().run()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+"""Avvio della variante asincrona del server (asgi.py) con uvicorn.
+
+Esempio:
+    python serve_async.py --config server.ini --workers 2
+
+Un solo processo regge migliaia di connessioni lente o inattive: i thread
+(asgi_threads) servono solo per il disco, non per l'attesa dei client.
+Oltre asgi_max_connections le nuove richieste ricevono 503.
+"""
+import argparse
+import os
+import sys
+
+import config
+
+try:
+    import uvicorn
+except ImportError:  # dipendenza opzionale, necessaria solo per questa modalità
+    uvicorn = None
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Avvia la variante asincrona del File Server')
+    parser.add_argument('--config', help='file di configurazione INI')
+    parser.add_argument('--host', help='indirizzo di ascolto (predefinito da host)')
+    parser.add_argument('--port', type=int, help='porta (predefinita da port)')
+    parser.add_argument('--workers', type=int, help='processi worker')
+    parser.add_argument('--threads', type=int, help='thread per l\'I/O su disco per worker')
+    parser.add_argument('--max-connections', type=int, help='connessioni contemporanee per worker')
+    parser.add_argument('--keepalive', type=int, help='secondi di attesa su connessioni keep-alive inattive')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if uvicorn is None:
+        sys.exit("uvicorn non installato: pip install uvicorn")
+
+    if args.config:
+        # I worker importano asgi.py e leggono la stessa configurazione
+        os.environ[config.CONFIG_ENV] = os.path.abspath(args.config)
+    if args.threads is not None:
+        os.environ[config.ENV_PREFIX + 'ASGI_THREADS'] = str(args.threads)
+    settings = config.load()
+
+    def pick(value, key):
+        return settings[key] if value is None else value
+
+    host = pick(args.host, 'host')
+    port = pick(args.port, 'port')
+    workers = pick(args.workers, 'workers')
+    print(f"Server asincrono avviato. Directory base: {settings['base_dir']}")
+    print(f"Ascolto su {host}:{port} con {workers} worker "
+          f"da {settings['asgi_threads']} thread per il disco")
+    uvicorn.run('asgi:app', app_dir=os.path.dirname(os.path.abspath(__file__)),
+                host=host, port=port, workers=workers,
+                limit_concurrency=pick(args.max_connections, 'asgi_max_connections'),
+                timeout_keep_alive=pick(args.keepalive, 'keepalive'),
+                lifespan='on')
+
+
+if __name__ == '__main__':
+    main()
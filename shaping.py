@@ -0,0 +1,386 @@
+#!/usr/bin/env python3
+"""Limiti di banda per client e ripartizione pesata della banda tra i trasferimenti.
+
+Solo i trasferimenti grandi (upload, download con Content-Length oltre una
+soglia o allegati in streaming) passano dallo scheduler; listing e altre
+risposte piccole non vengono mai rallentate. Ogni client ha un token
+bucket con velocità pari alla sua quota della banda totale, ricalcolata
+quando un client inizia o finisce un trasferimento: a parità di peso N
+client attivi ricevono 1/N ciascuno, qualunque sia il numero di stream
+aperti da ognuno. Mentre ci sono richieste interattive in corso, una
+parte della banda totale resta libera per loro.
+
+I limiti valgono per processo: con più worker la banda totale è la somma
+di quella dei worker.
+"""
+import json
+import os
+import threading
+import time
+from collections import deque
+
+# Secondi su cui si misura la velocità di ogni client
+RATE_WINDOW = 5
+# Byte accumulabili da un bucket inattivo, in secondi alla velocità del client
+BURST_SECONDS = 0.25
+# Secondi dopo cui un client senza trasferimenti viene dimenticato
+IDLE_SECONDS = 60
+# Secondi tra due salvataggi dello stato per gli altri worker
+PUBLISH_INTERVAL = 2
+
+
+def parse_weights(value):
+    """'10.0.0.5=2, alice=0.5' -> {'10.0.0.5': 2.0, 'alice': 0.5}"""
+    weights = {}
+    for item in value.split(','):
+        if not item.strip():
+            continue
+        client, _, weight = item.rpartition('=')
+        if not client.strip():
+            raise ValueError(f"Peso non valido: {item.strip()}")
+        weights[client.strip()] = float(weight)
+    return weights
+
+
+class TokenBucket:
+    """Token bucket in byte; la velocità può cambiare mentre è in uso (0 = illimitato)"""
+
+    def __init__(self, rate):
+        self.rate = rate
+        self.tokens = rate * BURST_SECONDS
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        if self.rate:
+            self.tokens = min(self.rate * BURST_SECONDS,
+                              self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def set_rate(self, rate, now):
+        self._refill(now)
+        self.rate = rate
+
+    def reserve(self, amount, now):
+        """Preleva `amount` byte; restituisce i secondi da attendere prima di inviarli"""
+        if not self.rate:
+            return 0.0
+        self._refill(now)
+        self.tokens -= amount
+        return -self.tokens / self.rate if self.tokens < 0 else 0.0
+
+
+class _Client:
+    def __init__(self, weight):
+        self.weight = weight
+        self.streams = 0
+        self.bucket = TokenBucket(0)
+        self.seen = time.monotonic()
+        # Direzione -> [(secondo, byte)] degli ultimi RATE_WINDOW secondi
+        self.samples = {'in': deque(), 'out': deque()}
+        self.totals = {'in': 0, 'out': 0}
+
+    def record(self, direction, amount, now):
+        samples = self.samples[direction]
+        second = int(now)
+        if samples and samples[-1][0] == second:
+            samples[-1][1] += amount
+        else:
+            samples.append([second, amount])
+        while samples[0][0] <= second - RATE_WINDOW:
+            samples.popleft()
+        self.totals[direction] += amount
+
+    def rate(self, direction, now):
+        return sum(amount for second, amount in self.samples[direction]
+                   if second > now - RATE_WINDOW) / RATE_WINDOW
+
+
+class Stream:
+    """Un trasferimento in corso di un client; charge() dice quanto attendere"""
+
+    def __init__(self, scheduler, client, direction):
+        self.scheduler = scheduler
+        self.client = client
+        self.direction = direction
+        self.closed = False
+
+    def charge(self, amount):
+        return self.scheduler._charge(self, amount)
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            self.scheduler._close(self)
+
+
+class BandwidthScheduler:
+    """Stream attivi e velocità per client, con limiti e quote pesate.
+
+    `total_rate` è la banda (byte/s) ripartita tra i client attivi in
+    proporzione ai `weights` (peso 1 se non indicato), `client_rate` il
+    massimo per singolo client; 0 = nessun limite. Mentre ci sono richieste
+    interattive in corso i trasferimenti usano solo (1 - interactive_reserve)
+    della banda totale.
+    """
+
+    def __init__(self, total_rate=0, client_rate=0, weights=None, interactive_reserve=0.2):
+        self.total_rate = total_rate
+        self.client_rate = client_rate
+        self.weights = weights or {}
+        self.interactive_reserve = interactive_reserve
+        self._clients = {}
+        self._interactive = 0
+        self._lock = threading.Lock()
+
+    def open(self, client, direction):
+        """Nuovo trasferimento di `client` ('in' per gli upload, 'out' per i download)"""
+        with self._lock:
+            state = self._clients.get(client)
+            if state is None:
+                state = self._clients[client] = _Client(self.weights.get(client, 1.0))
+            state.streams += 1
+            state.seen = time.monotonic()
+            self._rebalance()
+        return Stream(self, client, direction)
+
+    def interactive(self, delta):
+        """Inizio (+1) o fine (-1) di una richiesta interattiva"""
+        with self._lock:
+            before = self._interactive
+            self._interactive += delta
+            if (before == 0) != (self._interactive == 0):
+                self._rebalance()
+
+    def stream_rate(self, client):
+        """Velocità consigliata per un nuovo stream del client, es. per X-Accel-Limit-Rate"""
+        with self._lock:
+            state = self._clients.get(client)
+            streams = (state.streams if state is not None else 0) + 1
+            weight = self.weights.get(client, 1.0)
+            total_weight = weight + sum(other.weight for key, other in self._clients.items()
+                                        if other.streams and key != client)
+            rate = self._client_limit(weight, total_weight)
+        return int(rate / streams) if rate else 0
+
+    def _client_limit(self, weight, total_weight):
+        limits = []
+        if self.total_rate:
+            available = self.total_rate
+            if self._interactive:
+                available *= 1 - self.interactive_reserve
+            limits.append(available * weight / total_weight)
+        if self.client_rate:
+            limits.append(self.client_rate)
+        return min(limits) if limits else 0
+
+    def _rebalance(self):
+        # Chiamata con il lock: nuove quote per tutti i client con stream aperti
+        now = time.monotonic()
+        active = [state for state in self._clients.values() if state.streams]
+        total_weight = sum(state.weight for state in active)
+        for state in active:
+            state.bucket.set_rate(self._client_limit(state.weight, total_weight), now)
+
+    def _charge(self, stream, amount):
+        now = time.monotonic()
+        with self._lock:
+            state = self._clients[stream.client]
+            state.record(stream.direction, amount, time.time())
+            return state.bucket.reserve(amount, now)
+
+    def _close(self, stream):
+        with self._lock:
+            state = self._clients[stream.client]
+            state.streams -= 1
+            state.seen = time.monotonic()
+            self._rebalance()
+
+    def status(self):
+        """Stato per client: stream aperti, velocità attuali, limite e byte totali"""
+        now = time.time()
+        idle = time.monotonic() - IDLE_SECONDS
+        clients = {}
+        with self._lock:
+            for key, state in list(self._clients.items()):
+                if not state.streams and state.seen < idle:
+                    del self._clients[key]
+                    continue
+                clients[key] = {
+                    'streams': state.streams,
+                    'rate_in': state.rate('in', now),
+                    'rate_out': state.rate('out', now),
+                    'limit': state.bucket.rate if state.streams else 0,
+                    'bytes_in': state.totals['in'],
+                    'bytes_out': state.totals['out'],
+                    'weight': state.weight,
+                }
+        return clients
+
+    def start_publisher(self, directory):
+        """Salva periodicamente lo stato in `directory`, per collect() negli altri worker"""
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f"{os.getpid()}.json")
+
+        def run():
+            while True:
+                time.sleep(PUBLISH_INTERVAL)
+                try:
+                    with open(f"{path}.tmp", 'w') as f:
+                        json.dump(self.status(), f)
+                    os.replace(f"{path}.tmp", path)
+                except OSError:
+                    pass
+
+        threading.Thread(target=run, daemon=True, name='bandwidth-publish').start()
+
+    def collect(self, directory):
+        """Stato di tutti i worker sommato per client (quello del processo corrente è attuale)"""
+        merged = self.status()
+        own = f"{os.getpid()}.json"
+        now = time.time()
+        try:
+            entries = list(os.scandir(directory))
+        except OSError:
+            entries = []
+        for entry in entries:
+            if not entry.name.endswith('.json') or entry.name == own:
+                continue
+            try:
+                if now - entry.stat().st_mtime > 3 * PUBLISH_INTERVAL:
+                    os.remove(entry.path)
+                    continue
+                with open(entry.path) as f:
+                    worker = json.load(f)
+            except (OSError, ValueError):
+                continue
+            for key, values in worker.items():
+                if key not in merged:
+                    merged[key] = values
+                    continue
+                for name, value in values.items():
+                    if name != 'weight':
+                        merged[key][name] += value
+        return merged
+
+
+class ThrottledBody:
+    """Corpo di una risposta inviato al ritmo consentito dallo stream"""
+
+    def __init__(self, iterable, stream):
+        self.iterable = iterable
+        self.stream = stream
+        self._iterator = iter(iterable)
+
+    def next_block(self):
+        """(blocco, secondi da attendere prima di inviarlo), o None alla fine"""
+        for data in self._iterator:
+            if data:
+                return data, self.stream.charge(len(data))
+        return None
+
+    def __iter__(self):
+        while True:
+            block = self.next_block()
+            if block is None:
+                return
+            data, wait = block
+            if wait > 0:
+                time.sleep(wait)
+            yield data
+
+    def close(self):
+        self.stream.close()
+        close = getattr(self.iterable, 'close', None)
+        if close is not None:
+            close()
+
+
+class ThrottledInput:
+    """wsgi.input letto al ritmo consentito dallo stream"""
+
+    def __init__(self, stream, shaping_stream):
+        self._stream = stream
+        self._shaping = shaping_stream
+
+    def _charged(self, data):
+        wait = self._shaping.charge(len(data)) if data else 0
+        if wait > 0:
+            time.sleep(wait)
+        return data
+
+    def read(self, *args):
+        return self._charged(self._stream.read(*args))
+
+    def readline(self, *args):
+        return self._charged(self._stream.readline(*args))
+
+    def readlines(self, *args):
+        return [self._charged(line) for line in self._stream.readlines(*args)]
+
+    def __iter__(self):
+        return iter(self.readline, b'')
+
+
+class ShapingMiddleware:
+    """Middleware WSGI che fa passare dallo scheduler upload e download grandi.
+
+    `client_key(environ)` identifica il client, `is_upload(environ)` dice se
+    il corpo della richiesta è un upload da limitare. Una risposta è un
+    trasferimento se ha Content-Length di almeno `min_bytes`, oppure è un
+    allegato senza lunghezza nota (es. archivio in streaming). Le risposte
+    con X-Accel-Redirect le invia nginx: ricevono X-Accel-Limit-Rate.
+    Se l'environ contiene INPUT_SHAPED il corpo è già stato limitato (asgi.py).
+    """
+
+    INPUT_SHAPED = 'fileserver.shaping.input'
+
+    def __init__(self, app, scheduler, client_key, is_upload, min_bytes):
+        self.app = app
+        self.scheduler = scheduler
+        self.client_key = client_key
+        self.is_upload = is_upload
+        self.min_bytes = min_bytes
+
+    def __call__(self, environ, start_response):
+        client = self.client_key(environ)
+        interactive = not self.is_upload(environ)
+        upload = None
+        if interactive:
+            self.scheduler.interactive(1)
+        elif not environ.get(self.INPUT_SHAPED):
+            upload = self.scheduler.open(client, 'in')
+            environ['wsgi.input'] = ThrottledInput(environ['wsgi.input'], upload)
+
+        response = {}
+
+        def capture(status, headers, exc_info=None):
+            response['args'] = (status, headers, exc_info)
+            return start_response(status, headers, exc_info) if exc_info else None
+
+        try:
+            app_iter = self.app(environ, capture)
+        finally:
+            # Da qui una richiesta interattiva è servita o è diventata un trasferimento
+            if interactive:
+                self.scheduler.interactive(-1)
+            if upload is not None:
+                upload.close()
+
+        status, headers, exc_info = response['args']
+        if exc_info:
+            return app_iter
+        values = {name.lower(): value for name, value in headers}
+        if 'x-accel-redirect' in values:
+            rate = self.scheduler.stream_rate(client)
+            if rate:
+                headers.append(('X-Accel-Limit-Rate', str(rate)))
+            start_response(status, headers)
+            return app_iter
+
+        length = values.get('content-length')
+        bulk = (int(length) >= self.min_bytes if length and length.isdigit()
+                else values.get('content-disposition', '').startswith('attachment'))
+        start_response(status, headers)
+        if not bulk or environ['REQUEST_METHOD'] == 'HEAD':
+            return app_iter
+        return ThrottledBody(app_iter, self.scheduler.open(client, 'out'))
@@ -0,0 +1,54 @@
+"""Configurazione comune dei test: il server usa una directory base temporanea"""
+import os
+import sys
+import tempfile
+import threading
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BASE_DIR = tempfile.mkdtemp(prefix='fileserver-test-')
+
+# Prima dell'import di Server, che legge la configurazione all'avvio
+os.environ.pop('FILESERVER_CONFIG', None)
+os.environ['FILESERVER_BASE_DIR'] = BASE_DIR
+os.environ['FILESERVER_INDEX_RECONCILE_INTERVAL'] = '0'
+sys.path.insert(0, ROOT)
+# Moduli del client dopo quelli del server: alcuni nomi sono in comune
+sys.path.append(os.path.join(ROOT, 'filemanager_app'))
+
+
+@pytest.fixture(scope='session')
+def server():
+    import Server
+    return Server
+
+
+@pytest.fixture
+def client(server):
+    return server.app.test_client()
+
+
+@pytest.fixture
+def base_dir():
+    return BASE_DIR
+
+
+@pytest.fixture
+def live_server(server):
+    """(URL, environ delle richieste ricevute) di un server HTTP reale in un thread"""
+    from werkzeug.serving import make_server
+
+    requests_seen = []
+
+    def app(environ, start_response):
+        requests_seen.append(environ)
+        return server.app(environ, start_response)
+
+    httpd = make_server('127.0.0.1', 0, app, threaded=True)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield f"http://127.0.0.1:{httpd.server_port}", requests_seen
+    finally:
+        httpd.shutdown()
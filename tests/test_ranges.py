@@ -0,0 +1,100 @@
+"""Richieste Range e If-Range su /download e ripresa dei download del client"""
+import json
+import os
+
+import pytest
+import requests
+from werkzeug.http import http_date
+
+SIZE = 256 * 1024
+
+
+@pytest.fixture
+def data(base_dir):
+    """Contenuto di ranges.bin nella directory base"""
+    content = bytes(range(256)) * (SIZE // 256)
+    with open(os.path.join(base_dir, 'ranges.bin'), 'wb') as f:
+        f.write(content)
+    return content
+
+
+def test_single_range(client, data):
+    response = client.get('/download/ranges.bin', headers={'Range': 'bytes=100-199'})
+    assert response.status_code == 206
+    assert response.headers['Content-Range'] == f'bytes 100-199/{SIZE}'
+    assert response.data == data[100:200]
+
+
+def test_suffix_range(client, data):
+    response = client.get('/download/ranges.bin', headers={'Range': 'bytes=-10'})
+    assert response.status_code == 206
+    assert response.headers['Content-Range'] == f'bytes {SIZE - 10}-{SIZE - 1}/{SIZE}'
+    assert response.data == data[-10:]
+
+
+def test_multiple_ranges(client, data):
+    response = client.get('/download/ranges.bin', headers={'Range': 'bytes=0-9,1000-1019'})
+    assert response.status_code == 206
+    mimetype, _, params = response.headers['Content-Type'].partition(';')
+    assert mimetype == 'multipart/byteranges'
+    boundary = params.strip().removeprefix('boundary=')
+    parts = [part for part in response.data.split(b'--' + boundary.encode())
+             if part.strip(b'\r\n') and part.strip(b'\r\n') != b'--']
+    assert len(parts) == 2
+    for part, (start, stop) in zip(parts, ((0, 10), (1000, 1020))):
+        head, _, body = part.partition(b'\r\n\r\n')
+        assert f'Content-Range: bytes {start}-{stop - 1}/{SIZE}'.encode() in head
+        assert body.removesuffix(b'\r\n') == data[start:stop]
+
+
+def test_unsatisfiable_range(client, data):
+    response = client.get('/download/ranges.bin', headers={'Range': f'bytes={SIZE}-'})
+    assert response.status_code == 416
+    assert response.headers['Content-Range'] == f'bytes */{SIZE}'
+
+
+def test_if_range_etag(client, data):
+    etag = client.head('/download/ranges.bin').headers['ETag']
+    response = client.get('/download/ranges.bin', headers={'Range': 'bytes=0-9', 'If-Range': etag})
+    assert response.status_code == 206
+    assert response.data == data[:10]
+
+    response = client.get('/download/ranges.bin',
+                          headers={'Range': 'bytes=0-9', 'If-Range': '"altra-versione"'})
+    assert response.status_code == 200
+    assert response.data == data
+
+
+@pytest.mark.parametrize('offset, status', [(0, 206), (-60, 200), (60, 200)])
+def test_if_range_date(client, data, base_dir, offset, status):
+    # Solo la data esatta di Last-Modified vale come validatore, anche se più recente
+    mtime = int(os.stat(os.path.join(base_dir, 'ranges.bin')).st_mtime)
+    response = client.get('/download/ranges.bin',
+                          headers={'Range': 'bytes=0-9', 'If-Range': http_date(mtime + offset)})
+    assert response.status_code == status
+    assert response.data == (data[:10] if status == 206 else data)
+
+
+def test_ranged_download_resumes_part_file(live_server, data, tmp_path):
+    from transfers import RangedDownload
+
+    url, seen = live_server
+    etag = requests.head(f"{url}/download/ranges.bin").headers['ETag']
+    save_path = str(tmp_path / 'ranges.bin')
+    done = SIZE // 2
+    # Download interrotto a metà: .part preallocato e stato del segmento
+    with open(save_path + '.part', 'wb') as f:
+        f.write(data[:done])
+        f.truncate(SIZE)
+    with open(save_path + '.part.json', 'w') as f:
+        json.dump({'url': f"{url}/download/ranges.bin", 'etag': etag, 'size': SIZE,
+                   'segments': [[0, SIZE, done]]}, f)
+
+    download = RangedDownload(f"{url}/download/ranges.bin", save_path)
+    assert download.run() == save_path
+    with open(save_path, 'rb') as f:
+        assert f.read() == data
+    assert not os.path.exists(save_path + '.part')
+    assert not os.path.exists(save_path + '.part.json')
+    ranges = [environ.get('HTTP_RANGE') for environ in seen if environ['REQUEST_METHOD'] == 'GET']
+    assert ranges == [f'bytes={done}-{SIZE - 1}']
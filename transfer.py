@@ -0,0 +1,244 @@
+#!/usr/bin/env python3
+"""Supporto ai download: validatori, richieste Range e risposte multipart/byteranges"""
+import os
+import uuid
+from urllib.parse import quote
+
+from flask import Response
+from werkzeug.http import http_date
+from werkzeug.utils import send_file
+from werkzeug.wsgi import wrap_file
+
+# Modalità di invio del corpo dei download:
+#   python           - i byte passano dal processo Python a blocchi
+#   sendfile         - wsgi.file_wrapper: con gunicorn il kernel copia con sendfile()
+#   x-sendfile       - header X-Sendfile, il file lo serve il proxy (Apache, lighttpd)
+#   x-accel-redirect - header X-Accel-Redirect verso una location interna di nginx
+DOWNLOAD_BACKENDS = ('python', 'sendfile', 'x-sendfile', 'x-accel-redirect')
+OFFLOAD_BACKENDS = ('x-sendfile', 'x-accel-redirect')
+
+# Oltre questo numero di range la richiesta viene rifiutata con 416
+MAX_RANGES = 64
+# Dimensione dei blocchi letti dal disco durante lo streaming
+CHUNK_SIZE = 64 * 1024
+
+
+def file_etag(stat_result):
+    """ETag forte derivato da dimensione e mtime del file"""
+    return f"{stat_result.st_size:x}-{stat_result.st_mtime_ns:x}"
+
+
+def if_range_matches(if_range, stat_result):
+    """Verifica se l'header If-Range corrisponde alla versione attuale del file"""
+    if if_range.etag is not None:
+        return if_range.etag == file_etag(stat_result)
+    if if_range.date is not None:
+        # Un validatore di tipo data deve coincidere con Last-Modified (RFC 9110 13.1.5)
+        return int(stat_result.st_mtime) == int(if_range.date.timestamp())
+    return True
+
+
+def parse_ranges(value):
+    """Interpreta un header Range "bytes=..." in una lista di (start, stop).
+
+    Per i suffissi ("-500") start è None e stop è la lunghezza del suffisso.
+    A differenza di werkzeug accetta range non ordinati o sovrapposti, che
+    vengono poi fusi da satisfiable_ranges. Restituisce None se la sintassi
+    non è valida.
+    """
+    unit, _, spec = value.partition('=')
+    if unit.strip().lower() != 'bytes':
+        return None
+    ranges = []
+    for part in spec.split(','):
+        part = part.strip()
+        if not part:
+            continue
+        first, sep, last = part.partition('-')
+        first, last = first.strip(), last.strip()
+        if not sep or not (first.isdigit() or last.isdigit()):
+            return None
+        if (first and not first.isdigit()) or (last and not last.isdigit()):
+            return None
+        if not first:
+            ranges.append((None, int(last)))
+        else:
+            stop = int(last) + 1 if last else None
+            if stop is not None and stop <= int(first):
+                return None
+            ranges.append((int(first), stop))
+    return ranges or None
+
+
+def satisfiable_ranges(requested, length):
+    """Normalizza i range richiesti in intervalli [start, stop) ordinati e fusi.
+
+    Restituisce None se nessun range è soddisfacibile.
+    """
+    ranges = []
+    for start, stop in requested:
+        if start is None:
+            start = max(length - stop, 0)
+            stop = length
+        else:
+            stop = length if stop is None else min(stop, length)
+        if start < stop:
+            ranges.append((start, stop))
+    if not ranges:
+        return None
+
+    # Unisci range sovrapposti o adiacenti
+    ranges.sort()
+    merged = [ranges[0]]
+    for start, stop in ranges[1:]:
+        last_start, last_stop = merged[-1]
+        if start <= last_stop:
+            merged[-1] = (last_start, max(last_stop, stop))
+        else:
+            merged.append((start, stop))
+    return merged
+
+
+def iter_file_range(path, start, stop, chunk_size=CHUNK_SIZE):
+    """Genera i byte del file nell'intervallo [start, stop)"""
+    with open(path, 'rb') as f:
+        f.seek(start)
+        remaining = stop - start
+        while remaining > 0:
+            data = f.read(min(chunk_size, remaining))
+            if not data:
+                break
+            remaining -= len(data)
+            yield data
+
+
+class _RangeFile:
+    """File posizionato all'inizio di un intervallo, che ne legge al massimo `length` byte.
+
+    Espone fileno(): gunicorn può così inviare l'intervallo con sendfile()
+    partendo dalla posizione corrente e limitandosi al Content-Length.
+    """
+
+    def __init__(self, path, start, length):
+        self._file = open(path, 'rb')
+        self._file.seek(start)
+        self._remaining = length
+
+    def fileno(self):
+        return self._file.fileno()
+
+    def read(self, size=-1):
+        if size < 0 or size > self._remaining:
+            size = self._remaining
+        data = self._file.read(size)
+        self._remaining -= len(data)
+        return data
+
+    def close(self):
+        self._file.close()
+
+
+def partial_content(path, ranges, length, mimetype, stat_result, environ=None):
+    """Risposta 206 per uno o più intervalli dello stesso file.
+
+    Un solo intervallo viene servito direttamente con Content-Range, più
+    intervalli come multipart/byteranges. Se viene passato `environ`, il
+    singolo intervallo usa wsgi.file_wrapper (sendfile con gunicorn).
+    """
+    if len(ranges) == 1:
+        start, stop = ranges[0]
+        if environ is not None:
+            body = wrap_file(environ, _RangeFile(path, start, stop - start))
+        else:
+            body = iter_file_range(path, start, stop)
+        response = Response(body, status=206, mimetype=mimetype,
+                            direct_passthrough=environ is not None)
+        response.headers['Content-Range'] = f"bytes {start}-{stop - 1}/{length}"
+        response.headers['Content-Length'] = str(stop - start)
+    else:
+        response = _multipart_byteranges(path, ranges, length, mimetype)
+    response.headers['Accept-Ranges'] = 'bytes'
+    response.headers['ETag'] = f'"{file_etag(stat_result)}"'
+    response.headers['Last-Modified'] = http_date(stat_result.st_mtime)
+    return response
+
+
+def _multipart_byteranges(path, ranges, length, mimetype):
+    boundary = uuid.uuid4().hex
+    parts = []
+    for start, stop in ranges:
+        header = (
+            f"--{boundary}\r\n"
+            f"Content-Type: {mimetype}\r\n"
+            f"Content-Range: bytes {start}-{stop - 1}/{length}\r\n\r\n"
+        ).encode('latin-1')
+        parts.append((header, start, stop))
+    trailer = f"--{boundary}--\r\n".encode('latin-1')
+
+    content_length = len(trailer)
+    for header, start, stop in parts:
+        content_length += len(header) + (stop - start) + 2
+
+    def generate():
+        for header, start, stop in parts:
+            yield header
+            yield from iter_file_range(path, start, stop)
+            yield b"\r\n"
+        yield trailer
+
+    response = Response(generate(), status=206,
+                        mimetype=f"multipart/byteranges; boundary={boundary}")
+    response.headers['Content-Length'] = str(content_length)
+    return response
+
+
+def range_not_satisfiable(length):
+    """Risposta 416 con la lunghezza completa della risorsa"""
+    response = Response(status=416)
+    response.headers['Content-Range'] = f"bytes */{length}"
+    response.headers['Accept-Ranges'] = 'bytes'
+    return response
+
+
+def send_whole_file(path, environ, stat_result, backend, download_name=None,
+                    mimetype=None, etag=None):
+    """Risposta con il file intero, con ETag, Last-Modified e richieste condizionali.
+
+    `download_name`, `mimetype` ed `etag` servono quando il file su disco è
+    una rappresentazione (es. compressa) di un altro file.
+    """
+    # I Range li gestisce partial_content(): qui si arriva quando va inviato il
+    # file intero (es. If-Range non corrispondente), che werkzeug non rispetterebbe
+    skip = {'HTTP_RANGE'}
+    if backend == 'python':
+        # Senza wsgi.file_wrapper werkzeug legge il file a blocchi in Python
+        skip.add('wsgi.file_wrapper')
+    environ = {key: value for key, value in environ.items() if key not in skip}
+    return send_file(path, environ, as_attachment=True, conditional=True,
+                     download_name=download_name, mimetype=mimetype,
+                     etag=etag or file_etag(stat_result), last_modified=stat_result.st_mtime,
+                     use_x_sendfile=backend == 'x-sendfile', response_class=Response)
+
+
+def accel_redirect(relative_path, prefix, mimetype, download_name):
+    """Risposta senza corpo che delega a nginx l'invio del file (X-Accel-Redirect)"""
+    response = Response(mimetype=mimetype)
+    response.headers['X-Accel-Redirect'] = prefix.rstrip('/') + '/' + quote(relative_path)
+    response.headers['Content-Disposition'] = content_disposition(download_name)
+    return response
+
+
+def content_disposition(filename):
+    """Header Content-Disposition per un allegato, anche con nomi non ASCII"""
+    try:
+        filename.encode('ascii')
+    except UnicodeEncodeError:
+        return f"attachment; filename*=UTF-8''{quote(filename)}"
+    return 'attachment; filename="{}"'.format(filename.replace('\\', '').replace('"', ''))
+
+
+def is_inside(path, directory):
+    """Vero se il path reale (link simbolici risolti) è dentro la directory reale"""
+    real_path = os.path.realpath(path)
+    real_dir = os.path.realpath(directory)
+    return real_path == real_dir or real_path.startswith(real_dir + os.sep)
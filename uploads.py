@@ -0,0 +1,255 @@
+#!/usr/bin/env python3
+"""Sessioni di upload a blocchi, ripristinabili, scritte in un file temporaneo preallocato"""
+import json
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+from checksums import Hasher
+
+try:
+    import fcntl
+except ImportError:  # non disponibile su Windows: solo lock tra thread
+    fcntl = None
+
+# Dimensione dei blocchi copiati dalla richiesta al file
+COPY_BLOCK_SIZE = 256 * 1024
+# Sessioni non più toccate da questo intervallo vengono eliminate
+SESSION_MAX_AGE = 7 * 24 * 3600
+
+
+class UploadSessionError(Exception):
+    """Errore di una sessione di upload, con il codice HTTP da restituire"""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+def merge_range(ranges, start, stop):
+    """Aggiungi l'intervallo [start, stop) a una lista ordinata di intervalli disgiunti"""
+    merged = []
+    for range_start, range_stop in ranges:
+        if range_stop < start or range_start > stop:
+            merged.append([range_start, range_stop])
+        else:
+            start = min(start, range_start)
+            stop = max(stop, range_stop)
+    merged.append([start, stop])
+    merged.sort()
+    return merged
+
+
+class UploadSessions:
+    """Gestione delle sessioni di upload salvate su disco.
+
+    Per ogni sessione esistono un file <id>.part, preallocato alla dimensione
+    finale e riempito ai vari offset, e un file <id>.json con destinazione,
+    dimensione e intervalli già ricevuti. Al commit il file viene rinominato
+    atomicamente nella destinazione, quindi la directory di staging deve
+    stare sullo stesso filesystem dei file serviti.
+
+    Finché i blocchi arrivano in ordine allo stesso processo i digest del
+    file vengono calcolati durante la scrittura e sono pronti al commit.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self._locks = {}
+        self._locks_lock = threading.Lock()
+        # id sessione -> (byte già inclusi nei digest, Hasher)
+        self._hashers = {}
+
+    def _paths(self, session_id):
+        # Gli id sono esadecimali generati dal server: niente path traversal
+        if not session_id or not all(c in '0123456789abcdef' for c in session_id):
+            raise UploadSessionError('Sessione di upload non trovata', 404)
+        base = os.path.join(self.directory, session_id)
+        return base + '.part', base + '.json'
+
+    @contextmanager
+    def _locked(self, session_id):
+        # Lock tra thread e, con più processi worker, lock sul file della sessione
+        with self._locks_lock:
+            lock = self._locks.setdefault(session_id, threading.Lock())
+        with lock:
+            if fcntl is None:
+                yield
+                return
+            with open(os.path.join(self.directory, session_id + '.lock'), 'a') as f:
+                fcntl.flock(f, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _load(self, session_id):
+        _, meta_path = self._paths(session_id)
+        try:
+            with open(meta_path) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            raise UploadSessionError('Sessione di upload non trovata', 404)
+
+    def _save(self, session):
+        _, meta_path = self._paths(session['id'])
+        session['updated'] = time.time()
+        tmp_path = meta_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(session, f)
+        os.replace(tmp_path, meta_path)
+
+    def create(self, target, size, sha256=None):
+        """Crea una sessione per un file di `size` byte da salvare in `target`"""
+        os.makedirs(self.directory, exist_ok=True)
+        self.expire()
+
+        session_id = uuid.uuid4().hex
+        part_path, _ = self._paths(session_id)
+        with open(part_path, 'wb') as f:
+            if size:
+                try:
+                    os.posix_fallocate(f.fileno(), 0, size)
+                except (AttributeError, OSError):
+                    f.truncate(size)
+
+        session = {
+            'id': session_id,
+            'target': target,
+            'size': size,
+            'received': [],
+            'created': time.time(),
+        }
+        if sha256:
+            # Digest dichiarato dal client, verificato al commit
+            session['sha256'] = sha256
+        self._save(session)
+        return session
+
+    def status(self, session_id):
+        """Restituisci lo stato di una sessione"""
+        return self._load(session_id)
+
+    def write(self, session_id, offset, stream, length):
+        """Scrivi `length` byte letti da `stream` a partire da `offset`"""
+        part_path, _ = self._paths(session_id)
+        session = self._load(session_id)
+        if offset < 0 or offset + length > session['size']:
+            raise UploadSessionError('Blocco fuori dai limiti del file', 416)
+
+        hasher = self._claim_hasher(session_id, offset)
+        written = 0
+        try:
+            with open(part_path, 'r+b') as f:
+                f.seek(offset)
+                while written < length:
+                    data = stream.read(min(COPY_BLOCK_SIZE, length - written))
+                    if not data:
+                        break
+                    f.write(data)
+                    if hasher is not None:
+                        hasher.update(data)
+                    written += len(data)
+        finally:
+            if hasher is not None:
+                with self._locks_lock:
+                    self._hashers.setdefault(session_id, (offset + written, hasher))
+
+        # Registra solo i byte effettivamente ricevuti
+        with self._locked(session_id):
+            session = self._load(session_id)
+            if written:
+                session['received'] = merge_range(session['received'], offset, offset + written)
+            self._save(session)
+        if written < length:
+            raise UploadSessionError('Blocco incompleto', 400)
+        return session
+
+    def commit(self, session_id, place=None):
+        """Completa la sessione spostando il file nella destinazione.
+
+        `place(part_path, session)` sostituisce il rename finale, ad esempio
+        per salvare il contenuto in un archivio deduplicato. Se i digest sono
+        stati calcolati durante la ricezione si trovano in session['checksums'].
+        """
+        part_path, meta_path = self._paths(session_id)
+        with self._locked(session_id):
+            session = self._load(session_id)
+            if session['size'] and session['received'] != [[0, session['size']]]:
+                raise UploadSessionError('Upload incompleto', 409)
+
+            with open(part_path, 'r+b') as f:
+                os.fsync(f.fileno())
+            os.makedirs(os.path.dirname(session['target']), exist_ok=True)
+            checksums = self._streamed_digests(session_id, session['size'])
+            if checksums is not None:
+                session['checksums'] = checksums
+            if place is not None:
+                place(part_path, session)
+            else:
+                os.replace(part_path, session['target'])
+            os.remove(meta_path)
+        self._forget(session_id)
+        return session
+
+    def abort(self, session_id):
+        """Annulla una sessione eliminando i dati ricevuti"""
+        part_path, meta_path = self._paths(session_id)
+        self._load(session_id)
+        for path in (part_path, meta_path):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+        self._forget(session_id)
+
+    def expire(self, max_age=SESSION_MAX_AGE):
+        """Elimina le sessioni abbandonate"""
+        now = time.time()
+        try:
+            names = os.listdir(self.directory)
+        except FileNotFoundError:
+            return
+        for name in names:
+            if not name.endswith('.json'):
+                continue
+            session_id = name[:-len('.json')]
+            try:
+                session = self._load(session_id)
+                if now - session.get('updated', session['created']) > max_age:
+                    self.abort(session_id)
+            except (UploadSessionError, OSError, ValueError, KeyError):
+                continue
+
+    def _claim_hasher(self, session_id, offset):
+        # Un blocco che prosegue i byte già inclusi nei digest li aggiorna;
+        # gli altri (fuori ordine, ripetuti) non toccano i digest
+        with self._locks_lock:
+            if offset == 0:
+                self._hashers.pop(session_id, None)
+                return Hasher()
+            entry = self._hashers.get(session_id)
+            if entry is None or entry[0] != offset:
+                return None
+            del self._hashers[session_id]
+            return entry[1]
+
+    def _streamed_digests(self, session_id, size):
+        with self._locks_lock:
+            entry = self._hashers.pop(session_id, None)
+        if size == 0:
+            return Hasher().hexdigests()
+        if entry is None or entry[0] != size:
+            return None
+        return entry[1].hexdigests()
+
+    def _forget(self, session_id):
+        with self._locks_lock:
+            self._locks.pop(session_id, None)
+            self._hashers.pop(session_id, None)
+        try:
+            os.remove(os.path.join(self.directory, session_id + '.lock'))
+        except FileNotFoundError:
+            pass